@@ -0,0 +1,115 @@
+"""Fit AR(p) models of all orders 1..max_ar at once with NumPy.
+
+Only pure AR models (ARMA with q=0) are used, so no iterative maximum likelihood
+fit is needed. Two estimators are available:
+
+    ols: Least squares on the lagged design matrix [1, y_t-1, ..., y_t-max_ar].
+        The matrix is built and QR decomposed once. Since the first p+1 columns
+        of Q*R only depend on the first p+1 columns of R, the AR(p) solution for
+        every p is a small triangular solve with the same Q'y. All orders are
+        fitted on the same rows, the first max_ar values are only used as lags.
+    yule_walker: The autocovariances are computed once and the Levinson-Durbin
+        recursion returns the coefficients of every order from the previous one.
+
+Like the constant of the removed statsmodels ARMA model, const is the mean of the
+process:
+
+    y_t - const = betas[0] * (y_t-1 - const) + ... + betas[p-1] * (y_t-p - const)
+"""
+
+import numpy as np
+from loguru import logger
+
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+
+METHODS = ["ols", "yule_walker"]
+
+
+def get_lagged_design_matrix(values, max_ar):
+    """Return the design matrix [1, y_t-1, ..., y_t-max_ar] and the targets y_t."""
+    windows = np.lib.stride_tricks.sliding_window_view(values, max_ar + 1)
+    lags = windows[:, -2::-1]
+    design_matrix = np.column_stack([np.ones(len(lags)), lags])
+    return design_matrix, windows[:, -1]
+
+
+def intercept_to_mean(intercept, betas, values):
+    """Convert the regression intercept into the mean of the process."""
+    denominator = 1 - np.sum(betas)
+    if np.isclose(denominator, 0):
+        logger.warning(f"AR model with betas {betas} has a unit root, use the mean.")
+        return float(np.mean(values))
+    return float(intercept / denominator)
+
+
+def fit_ols(values, max_ar):
+    """return: List of (lag, betas, const) for every lag in 1..max_ar."""
+    design_matrix, targets = get_lagged_design_matrix(values, max_ar)
+    q, r = np.linalg.qr(design_matrix)
+    qty = q.T @ targets
+
+    ar_models = []
+    for lag in range(1, max_ar + 1):
+        coefficients = np.linalg.solve(r[: lag + 1, : lag + 1], qty[: lag + 1])
+        betas = coefficients[1:]
+        const = intercept_to_mean(coefficients[0], betas, values)
+        ar_models.append((lag, betas.tolist(), const))
+    return ar_models
+
+
+def get_autocovariances(values, max_lag):
+    """Biased autocovariances of values for the lags 0..max_lag."""
+    centered = values - values.mean()
+    return np.array(
+        [
+            centered[lag:] @ centered[: len(centered) - lag] / len(centered)
+            for lag in range(max_lag + 1)
+        ]
+    )
+
+
+def fit_yule_walker(values, max_ar):
+    """return: List of (lag, betas, const) for every lag in 1..max_ar."""
+    autocovariances = get_autocovariances(values, max_ar)
+    const = float(values.mean())
+    if np.isclose(autocovariances[0], 0):
+        logger.warning(f"Constant series, all betas are zero.")
+        return [(lag, [0.0] * lag, const) for lag in range(1, max_ar + 1)]
+
+    ar_models = []
+    betas = np.zeros(0)
+    error = autocovariances[0]
+    for lag in range(1, max_ar + 1):
+        reflection = (
+            autocovariances[lag] - betas @ autocovariances[lag - 1 : 0 : -1]
+        ) / error
+        betas = np.append(betas - reflection * betas[::-1], reflection)
+        error *= 1 - reflection ** 2
+        ar_models.append((lag, betas.tolist(), const))
+    return ar_models
+
+
+def fit_ar_models(values, max_ar=5, method="ols"):
+    """Fit AR(1) to AR(max_ar) on values.
+
+    values: Array or Series of the time series in chronological order, NaN values
+        are dropped.
+    method: One of METHODS.
+
+    return: List of (lag, betas, const), betas ordered from y_t-1 to y_t-lag.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, use one of {METHODS}.")
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) <= 2 * max_ar:
+        raise ValueError(
+            f"Can not fit AR({max_ar}) models on {len(values)} values, need more than {2 * max_ar}."
+        )
+
+    if method == "ols":
+        return fit_ols(values, max_ar)
+    return fit_yule_walker(values, max_ar)
@@ -0,0 +1,115 @@
+"""Store DataFrames as compressed Parquet files listed in a manifest.
+
+The DataFrames created by the pipeline (converted podcasts, the clean data and
+the training/validation/test partitions) are written to data/dataframe/ as
+zstd compressed Parquet files. data/dataframe/manifest.json lists every
+artifact with its shape, columns and creation time.
+
+Readers only load the columns they need, e.g.
+
+    read_dataframe("data/dataframe/_training_20190125_1200.parquet",
+                   columns=["fake_date", "star_count_rel"])
+
+The files are memory-mapped while reading, so columns that are not requested
+are never read from disk. iter_dataframe_chunks reads an artifact in chunks of
+rows instead of all at once.
+"""
+
+import datetime
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+ARTIFACT_DIR = "data/dataframe"
+MANIFEST_FILENAME = "manifest.json"
+COMPRESSION = "zstd"
+# Rows per chunk when an artifact is read in chunks.
+CHUNK_ROWS = 1_000_000
+
+
+def get_artifact_filename(name, artifact_dir=ARTIFACT_DIR):
+    return os.path.join(artifact_dir, name + ".parquet")
+
+
+def load_manifest(artifact_dir=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(artifact_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def update_manifest(name, entry, artifact_dir=ARTIFACT_DIR):
+    manifest = load_manifest(artifact_dir)
+    manifest[name] = entry
+    filename = os.path.join(artifact_dir, MANIFEST_FILENAME)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+
+
+def to_writable(df):
+    """Convert sparse columns to dense ones, Parquet can not store them."""
+    sparse_columns = [
+        column
+        for column, dtype in df.dtypes.items()
+        if isinstance(dtype, pd.SparseDtype)
+    ]
+    if not sparse_columns:
+        return df
+    return df.assign(
+        **{column: df[column].sparse.to_dense() for column in sparse_columns}
+    )
+
+
+def write_dataframe(df, filename):
+    """Write df to filename and add it to the manifest of its directory.
+
+    Errors are raised, the callers must not continue without the artifact.
+
+    return: filename
+    """
+    artifact_dir, basename = os.path.split(filename)
+    name = os.path.splitext(basename)[0]
+    table = pa.Table.from_pandas(to_writable(df), preserve_index=False)
+    os.makedirs(artifact_dir, exist_ok=True)
+    pq.write_table(table, filename, compression=COMPRESSION)
+
+    update_manifest(
+        name,
+        {
+            "filename": filename,
+            "rows": df.shape[0],
+            "columns": [str(column) for column in df.columns],
+            "created": datetime.datetime.utcnow().isoformat(),
+        },
+        artifact_dir,
+    )
+    logger.info(f"Wrote DataFrame with shape {df.shape} to {filename}.")
+    return filename
+
+
+@logger.catch
+def read_dataframe(filename, columns=None):
+    """Read only the given columns of an artifact, memory-mapping the file."""
+    table = pq.read_table(filename, columns=columns, memory_map=True)
+    df = table.to_pandas()
+    logger.info(f"Read DataFrame with shape {df.shape} from {filename}.")
+    return df
+
+
+def iter_dataframe_chunks(filename, columns=None, batch_size=CHUNK_ROWS):
+    """Yield the rows of an artifact as DataFrames of at most batch_size rows."""
+    parquet_file = pq.ParquetFile(filename, memory_map=True)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
@@ -0,0 +1,162 @@
+"""Walk-forward backtest of the AR models with recursive least squares.
+
+For every cutoff day, the AR(lag) model is fitted on all days before the cutoff and
+predicts the following horizon days. Instead of a refit per cutoff, the least
+squares solution is updated with every day that enters the training window:
+
+    k = P x / (1 + x' P x)
+    theta = theta + k (y - x' theta)
+    P = P - k x' P
+
+with x = [1, y_t-1, ..., y_t-lag], P = (X'X)^-1 of the rows seen so far and theta the
+intercept and betas. Every update is a rank-one update of a (lag + 1) x (lag + 1)
+matrix, so the error curve of all cutoffs costs about as much as a single fit.
+
+The coefficients at every cutoff are the same as the ones of
+ar_engine.fit_ar_models(values[:cutoff], max_ar=lag), const is the mean of the
+process like in modeling.ar_model_fitting.
+"""
+
+import os
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import ar_engine
+import luther
+import modeling
+from base import add_log_sink, add_log_level
+
+add_log_level("RESULTS", no=40, color="<green>")
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/results_{_log_file_name}.log", level="RESULTS")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+BACKTEST_RESULT_DIR = "data/backtest_result"
+# Number of training rows (days after the first lag days) before the first cutoff.
+MIN_TRAINING_ROWS = 30
+
+
+class RecursiveLeastSquares:
+    def __init__(self, design_matrix, targets):
+        """Least squares solution of the initial rows, updated row by row."""
+        xtx = design_matrix.T @ design_matrix
+        if np.linalg.matrix_rank(xtx) < len(xtx):
+            raise ValueError(
+                f"Initial {len(design_matrix)} rows do not determine {len(xtx)} coefficients."
+            )
+        self.p = np.linalg.inv(xtx)
+        self.theta = self.p @ (design_matrix.T @ targets)
+
+    def __repr__(self):
+        return f"RecursiveLeastSquares(theta={self.theta.tolist()})"
+
+    def update(self, x, y):
+        px = self.p @ x
+        gain = px / (1 + x @ px)
+        self.theta = self.theta + gain * (y - x @ self.theta)
+        self.p = self.p - np.outer(gain, px)
+        return self.theta
+
+
+def backtest_ar_model(values, lag, min_training_rows=MIN_TRAINING_ROWS, horizon=1):
+    """Walk forward over values with an AR(lag) model.
+
+    values: Array of the time series in chronological order, e.g. the "mean" column
+        of modeling.prepare_df_for_modeling. NaN values are dropped.
+    horizon: Number of days predicted after every cutoff, each one step ahead from
+        the observed lag values.
+
+    return: DataFrame with one row per cutoff (index into values) with the intercept,
+        betas, const, the one step error at the cutoff and the horizon RMSE.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    design_matrix, targets = ar_engine.get_lagged_design_matrix(values, lag)
+    if len(targets) <= min_training_rows:
+        raise ValueError(
+            f"Can not backtest AR({lag}) on {len(values)} values with {min_training_rows} training rows."
+        )
+
+    rls = RecursiveLeastSquares(
+        design_matrix[:min_training_rows], targets[:min_training_rows]
+    )
+    # Row i predicts values[lag + i], so the cutoff of row i is lag + i.
+    thetas = np.empty((len(targets) - min_training_rows, lag + 1))
+    for idx, row in enumerate(range(min_training_rows, len(targets))):
+        thetas[idx] = rls.theta
+        rls.update(design_matrix[row], targets[row])
+
+    rows = np.arange(min_training_rows, len(targets))
+    predictions = np.einsum("ck,ck->c", design_matrix[rows], thetas)
+    errors = targets[rows] - predictions
+
+    # Row offsets 0..horizon-1 after every cutoff, rows past the end are masked.
+    horizon_rows = rows[:, None] + np.arange(horizon)
+    in_range = horizon_rows < len(targets)
+    horizon_rows = np.minimum(horizon_rows, len(targets) - 1)
+    horizon_predictions = np.einsum("chk,ck->ch", design_matrix[horizon_rows], thetas)
+    squared_errors = np.where(
+        in_range, (targets[horizon_rows] - horizon_predictions) ** 2, 0
+    )
+
+    betas = thetas[:, 1:]
+    denominator = 1 - betas.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        const = np.where(np.isclose(denominator, 0), np.nan, thetas[:, 0] / denominator)
+
+    result = pd.DataFrame(betas, columns=[f"beta_{k}" for k in range(1, lag + 1)])
+    result.insert(0, "const", const)
+    result.insert(0, "intercept", thetas[:, 0])
+    result.insert(0, "cutoff", rows + lag)
+    result["prediction"] = predictions
+    result["value"] = targets[rows]
+    result["error"] = errors
+    result["horizon_rmse"] = np.sqrt(squared_errors.sum(axis=1) / in_range.sum(axis=1))
+    return result
+
+
+@logger.catch
+def backtest_column(
+    df,
+    column_name="star_count_rel",
+    max_ar=5,
+    min_training_rows=MIN_TRAINING_ROWS,
+    horizon=1,
+):
+    """Backtest AR(1) to AR(max_ar) on the fake_date series of column_name.
+
+    df: Clean DataFrame (or pickle filename), grouped like in modeling.
+
+    return: {lag: DataFrame of backtest_ar_model with the fake_date of every cutoff}
+        pickled to data/backtest_result/.
+    """
+    start = time.time()
+    prepared = modeling.prepare_df_for_modeling(df, column_name=column_name)
+    prepared = prepared[prepared["mean"].notna()]
+    results = {}
+    for lag in range(1, max_ar + 1):
+        result = backtest_ar_model(
+            prepared["mean"], lag, min_training_rows=min_training_rows, horizon=horizon
+        )
+        result.insert(0, "fake_date", prepared.index[result["cutoff"]])
+        results[lag] = result
+        logger.log(
+            "RESULTS",
+            f"Backtest AR({lag}) - {column_name} - {len(result)} cutoffs - RMSE: {np.sqrt(np.mean(result['error'] ** 2))}",
+        )
+
+    os.makedirs(BACKTEST_RESULT_DIR, exist_ok=True)
+    filename = os.path.join(
+        BACKTEST_RESULT_DIR, f"backtest_{column_name}_{luther.get_timestamp()}.pk"
+    )
+    with open(filename, "wb") as f:
+        pickle.dump(results, f)
+    logger.success(
+        f"Backtested {max_ar} AR models of {column_name} in {time.time() - start}s, pickled to {filename}."
+    )
+    return results
@@ -5,8 +5,31 @@ import uuid
 
 from loguru import logger
 
+
+def add_log_sink(sink, **kwargs):
+    """Add a loguru sink once per process and return its handler id.
+
+    Every module adds its sinks on import. Without this check, importing a module
+    again (e.g. importlib.reload in a long running service) or adding a shared
+    sink like logs/success.log from several modules writes every message
+    multiple times and keeps adding file handlers.
+    """
+    added_sinks = logger.__dict__.setdefault("_luther_sinks", {})
+    if sink not in added_sinks:
+        added_sinks[sink] = logger.add(sink, **kwargs)
+    return added_sinks[sink]
+
+
+def add_log_level(name, **kwargs):
+    """Add a custom loguru level unless it already exists."""
+    try:
+        return logger.level(name)
+    except ValueError:
+        return logger.level(name, **kwargs)
+
+
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
 
 
 class LutherBaseClass:
@@ -42,7 +65,9 @@ class LutherBaseClass:
         return inst
 
     @classmethod
-    def create_from_list(cls, raw_list, additional_data={}):
+    def create_from_list(cls, raw_list, additional_data=None):
+        if additional_data is None:
+            additional_data = {}
         created_list = []
         for idx, raw_dict in enumerate(raw_list):
             additional_data["_id"] = idx
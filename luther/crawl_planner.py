@@ -0,0 +1,264 @@
+"""Plan the GitHub crawl of all podcasts before fetching any stargazers.
+
+Fetching the stargazers takes one request per 100 stars, and the pages of a
+repository have to be requested one after another. A single large repository
+therefore runs for a long time, and if it is scheduled early it keeps the other
+repositories waiting.
+
+Before the crawl, the cheap REPOSITORY_INFO_QUERY is run for every referenced
+repository. Its stargazers.totalCount gives the number of pages, GraphQL rate limit
+points and the time of every repository. The repositories are crawled by priority:
+
+    1. Repositories with an open mention window (mentioned within the last
+       days_postmention days) first,
+    2. smaller repositories before larger ones.
+
+The plan is printed as a report before any stargazer page is requested, with
+dry_run=True the crawl stops after the report.
+
+Run with:
+    python luther/crawl_planner.py [--dry-run]
+"""
+
+import datetime
+import math
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+import luther
+import star_sampling
+from base import add_log_sink
+from episode_data import Podcast
+from get_github_data import STARGAZERS_PER_PAGE, get_raw_repository_info
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+# Average duration of a single GitHub API request.
+SECONDS_PER_REQUEST = float(os.getenv("LUTHER_SECONDS_PER_REQUEST", default=0.8))
+# GraphQL API limit, a stargazer page of 100 costs one point.
+RATE_LIMIT_POINTS_PER_HOUR = 5000
+DAYS_POSTMENTION = 30
+
+
+class CrawlItem:
+    def __init__(self, references, raw_repo_info, today, days_postmention):
+        """A repository to crawl and all references to it."""
+        self.references = references
+        self.raw_repo_info = raw_repo_info
+        self.full_name = "/".join(references[0].get_registry_key())
+        self.star_count = 0
+        if raw_repo_info is not None:
+            self.full_name = raw_repo_info.get("nameWithOwner", self.full_name)
+            self.star_count = int(raw_repo_info["stargazers"]["totalCount"])
+
+        mention_dates = [
+            reference.date_referenced
+            for reference in references
+            if reference.date_referenced is not None
+        ]
+        first_open_date = today - datetime.timedelta(days=days_postmention)
+        self.is_open = any(first_open_date <= date for date in mention_dates)
+
+        self.is_sampled = star_sampling.use_sampling(self.star_count)
+        page_count = math.ceil(self.star_count / STARGAZERS_PER_PAGE)
+        if self.is_sampled:
+            # The pages around the mention dates are not known before sampling.
+            self.graphql_points = 1
+            self.rest_requests = min(page_count, star_sampling.SAMPLE_PAGE_COUNT)
+        else:
+            self.graphql_points = 1 + page_count
+            self.rest_requests = 0
+
+    def __repr__(self):
+        return f"CrawlItem(full_name={self.full_name}, star_count={self.star_count}, is_open={self.is_open})"
+
+    @property
+    def exists(self):
+        return self.raw_repo_info is not None
+
+    @property
+    def requests(self):
+        return self.graphql_points + self.rest_requests
+
+    @property
+    def seconds(self):
+        return self.requests * SECONDS_PER_REQUEST
+
+    @property
+    def priority(self):
+        """Sort key, lower is crawled first."""
+        return (not self.is_open, self.requests, self.full_name)
+
+
+class CrawlPlan:
+    def __init__(self, items, max_workers):
+        self.items = sorted(items, key=lambda item: item.priority)
+        self.max_workers = max_workers
+
+    def __repr__(self):
+        return f"CrawlPlan(repository_count={len(self.items)}, max_workers={self.max_workers})"
+
+    @property
+    def graphql_points(self):
+        return sum(item.graphql_points for item in self.items)
+
+    @property
+    def rest_requests(self):
+        return sum(item.rest_requests for item in self.items)
+
+    @property
+    def estimated_seconds(self):
+        """Wall-clock estimate of the crawl.
+
+        The workers share all requests, but the pages of one repository are
+        requested one after another and the GraphQL rate limit caps the points
+        per hour.
+        """
+        if not self.items:
+            return 0
+        parallel_seconds = sum(item.seconds for item in self.items) / self.max_workers
+        longest_seconds = max(item.seconds for item in self.items)
+        rate_limit_seconds = self.graphql_points / RATE_LIMIT_POINTS_PER_HOUR * 3600
+        return max(parallel_seconds, longest_seconds, rate_limit_seconds)
+
+    def report(self, max_rows=30):
+        lines = [
+            f"Crawl plan for {len(self.items)} repositories with {self.max_workers} workers:",
+            f"    GraphQL points: {self.graphql_points}, REST requests: {self.rest_requests}",
+            f"    Estimated time: {datetime.timedelta(seconds=round(self.estimated_seconds))}",
+            f"    Open mention windows: {sum(item.is_open for item in self.items)}, "
+            f"sampled: {sum(item.is_sampled for item in self.items)}, "
+            f"not found: {sum(not item.exists for item in self.items)}",
+            "",
+            f"{'#':>4}  {'repository':<45} {'stars':>8} {'requests':>8} {'seconds':>8} {'open':>5} {'refs':>5}",
+        ]
+        for idx, item in enumerate(self.items[:max_rows]):
+            lines.append(
+                f"{idx:>4}  {item.full_name[:45]:<45} {item.star_count:>8} {item.requests:>8} {round(item.seconds):>8} {str(item.is_open):>5} {len(item.references):>5}"
+            )
+        if max_rows < len(self.items):
+            lines.append(f"      ... {len(self.items) - max_rows} more repositories")
+        return "\n".join(lines)
+
+    def crawl_item(self, item):
+        if not item.exists:
+            return None
+        reference, *other_references = item.references
+        repository = reference.fetch_repository(raw_repo_info=dict(item.raw_repo_info))
+        if repository is not None:
+            for other_reference in other_references:
+                repository.refine_star_sample(other_reference.date_referenced)
+        return repository
+
+    @logger.catch
+    def execute(self):
+        """Fetch the stargazers in the planned order and attach the repositories.
+
+        return: {(rep_owner, rep_name): Repository}, usable as registry.
+        """
+        start = time.time()
+        logger.info(f"Execute {self}.")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # The executor starts the submitted items in order.
+            futures = [executor.submit(self.crawl_item, item) for item in self.items]
+
+        registry = {}
+        for item, future in zip(self.items, futures):
+            repository = future.result()
+            if repository is None:
+                continue
+            registry[item.references[0].get_registry_key()] = repository
+            for reference in item.references:
+                reference.attach_repository(repository)
+                reference.pickle(is_raw=False)
+
+        logger.success(
+            f"Crawled {len(registry)} repositories in {time.time() - start}s, estimated {self.estimated_seconds}s."
+        )
+        return registry
+
+
+@logger.catch
+def get_repository_info(key):
+    """Return the raw info of the repository (rep_owner, rep_name), None if missing."""
+    return get_raw_repository_info(rep_owner=key[0], rep_name=key[1])
+
+
+def get_unresolved_references(podcasts, registry=None):
+    """Group the unresolved references of all podcasts by repository."""
+    references = {}
+    for podcast in podcasts:
+        for episode in podcast.episodes:
+            for reference in episode.unresolved_references:
+                key = reference.get_registry_key()
+                if registry is None or key not in registry:
+                    references.setdefault(key, []).append(reference)
+    return references
+
+
+@logger.catch
+def plan_crawl(
+    podcasts,
+    registry=None,
+    max_workers=luther.REPOSITORY_FETCH_WORKERS,
+    days_postmention=DAYS_POSTMENTION,
+    today=None,
+):
+    """Request the info of every unresolved repository and plan the crawl."""
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+    references = get_unresolved_references(podcasts, registry)
+    logger.info(f"Plan the crawl of {len(references)} repositories.")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        raw_repo_infos = list(executor.map(get_repository_info, references))
+
+    items = [
+        CrawlItem(key_references, raw_repo_info, today, days_postmention)
+        for key_references, raw_repo_info in zip(references.values(), raw_repo_infos)
+    ]
+    return CrawlPlan(items, max_workers)
+
+
+@logger.catch
+def run_planned_crawl(
+    podcasts_info=None, dry_run=False, max_workers=luther.REPOSITORY_FETCH_WORKERS
+):
+    """Scrape all podcasts, plan the crawl, print the report and crawl.
+
+    dry_run: Stop after printing the report, no stargazers are requested.
+
+    return: (podcasts, plan)
+    """
+    if podcasts_info is None:
+        podcasts_info = luther.get_podcasts_info()
+
+    podcasts = []
+    for podcast_info in podcasts_info:
+        podcast = Podcast(**podcast_info)
+        raw_episodes, _ = luther.EPISODE_SCRAPERS[podcast_info["source"]](podcast_info)
+        podcast.append_raw_episodes(raw_episodes, resolve=False)
+        podcasts.append(podcast)
+
+    plan = plan_crawl(podcasts, max_workers=max_workers)
+    print(plan.report())
+    if dry_run:
+        logger.info(f"Dry run, stop before crawling.")
+        return podcasts, plan
+
+    plan.execute()
+    for podcast in podcasts:
+        for episode in podcast.episodes:
+            episode.pickle(is_raw=False)
+        podcast.pickle()
+    return podcasts, plan
+
+
+if __name__ == "__main__":
+    run_planned_crawl(dry_run="--dry-run" in sys.argv)
@@ -0,0 +1,52 @@
+"""Run the pipeline as a long running service, see service.py.
+
+The data is refreshed every LUTHER_REFRESH_INTERVAL seconds (default one day)
+until the process receives SIGINT or SIGTERM.
+
+Run with:
+    python luther/daemon.py
+"""
+
+import os
+import signal
+import threading
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from base import add_log_sink
+from service import LutherService
+
+load_dotenv()
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+REFRESH_INTERVAL = int(os.getenv("LUTHER_REFRESH_INTERVAL", default=24 * 60 * 60))
+
+
+def run_daemon(service=None, interval=REFRESH_INTERVAL, max_cycles=None):
+    """Refresh the service every interval seconds.
+
+    max_cycles: Stop after this many refreshes, run until stopped if None.
+    """
+    if service is None:
+        service = LutherService()
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    logger.info(f"Start daemon, refresh every {interval}s.")
+    while not stop.is_set():
+        service.refresh()
+        if max_cycles is not None and service.cycle >= max_cycles:
+            break
+        stop.wait(interval)
+
+    logger.success(f"Stopped daemon after {service.cycle} cycles.")
+    return service
+
+
+if __name__ == "__main__":
+    run_daemon()
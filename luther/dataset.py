@@ -0,0 +1,430 @@
+"""Store the converted star history rows as a partitioned Parquet dataset.
+
+Instead of keeping all rows of a podcast in memory (see
+luther.convert_podcast_to_pd_df), every repository mention is converted and
+written on its own, so at most the rows of one repository are held at a time.
+
+Layout:
+    data/dataset/podcast=<podcast>/repository=<owner_name>/part-<episode>-<reference>.parquet
+
+The dataset can be read back with only the needed columns and with filters that
+are pushed down to the partitions and row groups, e.g.
+
+    read_dataset(DATASET_PATH, columns=["fake_date", "star_count_rel"],
+                 filters=[("podcast", "=", "talk_python_to_me")])
+
+Once written, the dataset can be updated daily with update_podcast_dataset. Only
+the days after the last completed date of every repository mention are converted
+and appended as a new part file. The current day is still changing, its row is
+kept in a separate "-open" part file that every update overwrites. The last
+completed date and accumulated star count of every mention are kept in
+data/dataset/_state.json.
+"""
+
+import datetime
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+import luther
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+DATASET_PATH = "data/dataset"
+PARTITION_COLUMNS = ["podcast", "repository"]
+# Files starting with an underscore are ignored when reading the dataset.
+STATE_FILENAME = "_state.json"
+MENTION_COLUMNS = ["podcast_name", "episode_number", "repository_url"]
+
+# Every file is written with the same schema, otherwise a repository without any
+# primary_language would create a null typed column.
+ROW_SCHEMA = pa.schema(
+    [
+        ("date", pa.date32()),
+        ("star_count_accu", pa.int64()),
+        ("star_count_diff", pa.int64()),
+        ("star_count_rel", pa.float64()),
+        ("date_mentioned", pa.date32()),
+        ("date_repository_created", pa.date32()),
+        ("podcast_name", pa.string()),
+        ("podcast_start_date", pa.date32()),
+        ("episode_number", pa.int64()),
+        ("episode_title", pa.string()),
+        ("repository_url", pa.string()),
+        ("repository_is_fork", pa.bool_()),
+        ("repository_primary_language", pa.string()),
+        ("repository_name", pa.string()),
+        ("repository_owner", pa.string()),
+        ("repository_exists", pa.bool_()),
+        ("manually_modified", pa.bool_()),
+        ("date_requested_repository_data", pa.date32()),
+        ("days_since_data_requested", pa.int64()),
+        ("days_since_creation", pa.int64()),
+        ("days_since_mention", pa.int64()),
+        ("days_since_podcast_start", pa.int64()),
+    ]
+)
+
+
+def get_partition_name(name):
+    """Return name usable as a directory name, same as the dataframe filenames."""
+    name = name.strip().lower().replace(" ", "_")
+    name = name.replace("/", "_")
+    return name.replace(".", "_")
+
+
+def get_partition_path(dataset_path, podcast_name, repository_full_name):
+    return os.path.join(
+        dataset_path,
+        "podcast=" + get_partition_name(podcast_name),
+        "repository=" + get_partition_name(repository_full_name),
+    )
+
+
+def write_rows(luther_data_rows, filename):
+    """Write LutherDataRows into a single Parquet file."""
+    df = pd.DataFrame(
+        [luther_data_row.values for luther_data_row in luther_data_rows],
+        columns=list(luther_data_rows[0].column_names),
+    )
+    table = pa.Table.from_pandas(df, schema=ROW_SCHEMA, preserve_index=False)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    pq.write_table(table, filename, compression="snappy")
+    return filename
+
+
+def get_mention_key(podcast, episode, reference):
+    partition_path = get_partition_path(
+        "", podcast.name, reference.repository.full_name
+    )
+    return os.path.join(partition_path, f"part-{episode.number}-{reference._id}")
+
+
+def get_part_filename(dataset_path, podcast, episode, reference, suffix=""):
+    mention_key = get_mention_key(podcast, episode, reference)
+    return os.path.join(dataset_path, mention_key + suffix + ".parquet")
+
+
+def remove_part_files(dataset_path, podcast, episode, reference):
+    """Remove the part, open and dated part files of a mention.
+
+    return: Removed filenames.
+    """
+    filename = get_part_filename(dataset_path, podcast, episode, reference)
+    prefix = filename[: -len(".parquet")] + "-"
+    filenames = [filename] if os.path.exists(filename) else []
+    for part_filename in glob.glob(glob.escape(prefix) + "*.parquet"):
+        suffix = part_filename[len(prefix) : -len(".parquet")]
+        if suffix == "open" or (len(suffix) == 8 and suffix.isdigit()):
+            filenames.append(part_filename)
+    for part_filename in filenames:
+        os.remove(part_filename)
+    return filenames
+
+
+def load_state(dataset_path=DATASET_PATH):
+    """Return the last stored date and star count of every repository mention."""
+    try:
+        with open(os.path.join(dataset_path, STATE_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, dataset_path=DATASET_PATH):
+    filename = os.path.join(dataset_path, STATE_FILENAME)
+    os.makedirs(dataset_path, exist_ok=True)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(filename + ".tmp", filename)
+    logger.info(f"Saved state of {len(state)} repository mentions to {filename}.")
+
+
+def get_mention_state(luther_data_rows, today, previous_state=None):
+    """Return the state after writing luther_data_rows, None if nothing is complete.
+
+    Only completed days (before today) are part of the state. The row of today is
+    rewritten by every update of the day, stars added later on the day would be
+    lost otherwise.
+    """
+    complete_rows = [row for row in luther_data_rows if row.date < today]
+    if not complete_rows:
+        if previous_state is None:
+            return None
+        last_date = previous_state["last_date"]
+        star_count_accu = previous_state["star_count_accu"]
+    else:
+        last_date = complete_rows[-1].date.isoformat()
+        star_count_accu = complete_rows[-1].star_count_accu
+    last_row = luther_data_rows[-1]
+    return {
+        "podcast_name": last_row.podcast_name,
+        "episode_number": last_row.episode_number,
+        "repository_url": last_row.repository_url,
+        "last_date": last_date,
+        "star_count_accu": star_count_accu,
+        "date_requested": last_row.date_requested_repository_data.isoformat(),
+        "date_updated": today.isoformat(),
+    }
+
+
+def write_mention_rows(
+    luther_data_rows, dataset_path, podcast, episode, reference, today, suffix=""
+):
+    """Write the completed days to a new part file and today to the open part file.
+
+    The open part file of a mention (suffix "-open") only holds the current day and
+    is overwritten by every update.
+    """
+    complete_rows = [row for row in luther_data_rows if row.date < today]
+    open_rows = [row for row in luther_data_rows if today <= row.date]
+    filenames = []
+    if complete_rows:
+        filename = get_part_filename(
+            dataset_path, podcast, episode, reference, suffix=suffix
+        )
+        filenames.append(write_rows(complete_rows, filename))
+    open_filename = get_part_filename(
+        dataset_path, podcast, episode, reference, suffix="-open"
+    )
+    if open_rows:
+        filenames.append(write_rows(open_rows, open_filename))
+    elif os.path.exists(open_filename):
+        os.remove(open_filename)
+    logger.info(f"Wrote {len(luther_data_rows)} rows to {filenames}.")
+    return filenames
+
+
+@logger.catch
+def convert_podcast_to_dataset(podcast, dataset_path=DATASET_PATH, today=None):
+    """Convert a podcast repository by repository and write the rows to the dataset.
+
+    Unlike luther.convert_podcast_to_pd_df no rows are kept on the podcast and the
+    podcast is not pickled again. Existing part files of a mention, including the
+    ones written by update_podcast_dataset, are replaced.
+
+    return: Number of written rows.
+    """
+    start = time.time()
+    logger.info(f"Convert {podcast.name} to the dataset in {dataset_path}.")
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+
+    row_count = 0
+    state = load_state(dataset_path)
+    podcast_row_data = luther.get_podcast_row_data(podcast)
+    for episode in podcast.episodes:
+        episode_row_data = luther.get_episode_row_data(episode, podcast_row_data)
+        for reference in episode.references:
+            if reference.repository is None:
+                continue
+            mention_key = get_mention_key(podcast, episode, reference)
+            remove_part_files(dataset_path, podcast, episode, reference)
+            luther_data_rows = luther.convert_repository_to_luther_datarows(
+                reference.repository, episode_row_data, today=today
+            )
+            if not luther_data_rows:
+                state.pop(mention_key, None)
+                continue
+            write_mention_rows(
+                luther_data_rows, dataset_path, podcast, episode, reference, today
+            )
+            mention_state = get_mention_state(luther_data_rows, today)
+            if mention_state is None:
+                state.pop(mention_key, None)
+            else:
+                state[mention_key] = mention_state
+            row_count += len(luther_data_rows)
+
+    save_state(state, dataset_path)
+    logger.success(
+        f"Converted {podcast.name} to the dataset. Total Row Count: {row_count}, Total Execution Time: {time.time() - start}."
+    )
+    return row_count
+
+
+def get_mention_window_filters(days_premention=365, days_postmention=30):
+    """Return the filters selecting the rows luther.clean_df keeps."""
+    return [
+        ("days_since_mention", ">", -(days_premention + 1)),
+        ("days_since_mention", "<", days_postmention + 1),
+        (
+            "date_mentioned",
+            "<",
+            (datetime.datetime.utcnow() - datetime.timedelta(days=31)).date(),
+        ),
+    ]
+
+
+def convert_new_days_to_luther_datarows(repository, row_data, mention_state, today):
+    """Create the rows for all days after the last stored date of a mention.
+
+    The accumulated star count continues from the stored count and the relative
+    count of the first new day uses it as previous total.
+    """
+    row_data = luther.get_repository_row_data(repository, row_data)
+    last_date = datetime.date.fromisoformat(mention_state["last_date"])
+    date_mapping = luther.create_date_mapping_between(
+        last_date + datetime.timedelta(days=1), today
+    )
+    for date in date_mapping:
+        date["star_count_accu"] = mention_state["star_count_accu"]
+
+    star_ordinals = luther.get_repository_star_ordinals(repository)
+    new_star_ordinals = star_ordinals[
+        np.searchsorted(star_ordinals, last_date.toordinal(), side="right") :
+    ]
+    luther.count_star_ordinals_per_date(date_mapping, new_star_ordinals)
+    return luther.convert_date_mapping_to_luther_datarows(
+        date_mapping,
+        row_data,
+        repository.date_created,
+        prev_total_star_count=mention_state["star_count_accu"],
+    )
+
+
+def get_repository_mentions(podcast):
+    """Return (episode, reference) of every reference with a repository."""
+    return [
+        (episode, reference)
+        for episode in podcast.episodes
+        for reference in episode.references
+        if reference.repository is not None
+    ]
+
+
+@logger.catch
+def update_podcast_dataset(
+    podcast, dataset_path=DATASET_PATH, today=None, mentions=None
+):
+    """Append the days since the last update of every repository mention.
+
+    The repositories of the podcast need to hold the current stargazers. Mentions
+    which are not in the dataset yet are converted completely.
+
+    mentions: Only update these (episode, reference) pairs, see
+        get_repository_mentions. All mentions of the podcast if None.
+
+    return: Number of written rows.
+    """
+    start = time.time()
+    logger.info(f"Update the dataset in {dataset_path} for {podcast.name}.")
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+    if mentions is None:
+        mentions = get_repository_mentions(podcast)
+
+    row_count = 0
+    state = load_state(dataset_path)
+    podcast_row_data = luther.get_podcast_row_data(podcast)
+    for episode, reference in mentions:
+        if reference.repository is None:
+            continue
+        episode_row_data = luther.get_episode_row_data(episode, podcast_row_data)
+        mention_key = get_mention_key(podcast, episode, reference)
+        if mention_key in state:
+            suffix = "-" + today.strftime("%Y%m%d")
+            luther_data_rows = convert_new_days_to_luther_datarows(
+                reference.repository, episode_row_data, state[mention_key], today
+            )
+        else:
+            suffix = ""
+            luther_data_rows = luther.convert_repository_to_luther_datarows(
+                reference.repository, episode_row_data, today=today
+            )
+        if not luther_data_rows:
+            continue
+
+        write_mention_rows(
+            luther_data_rows,
+            dataset_path,
+            podcast,
+            episode,
+            reference,
+            today,
+            suffix=suffix,
+        )
+        mention_state = get_mention_state(
+            luther_data_rows, today, previous_state=state.get(mention_key)
+        )
+        if mention_state is not None:
+            state[mention_key] = mention_state
+        row_count += len(luther_data_rows)
+
+    save_state(state, dataset_path)
+    logger.success(
+        f"Updated the dataset for {podcast.name}. New Row Count: {row_count}, Total Execution Time: {time.time() - start}."
+    )
+    return row_count
+
+
+def refresh_snapshot_columns(df, state):
+    """Set the columns describing the data request to the values of the last update.
+
+    date_requested_repository_data and days_since_data_requested are relative to
+    the day the rows were created. Rows appended by later updates would otherwise
+    differ from a complete rebuild on the day of the last update.
+    """
+    snapshot_columns = ["date_requested_repository_data", "days_since_data_requested"]
+    if not state or not any(column in df.columns for column in snapshot_columns):
+        return df
+    if not all(column in df.columns for column in MENTION_COLUMNS + ["date"]):
+        logger.warning(
+            f"Can not refresh {snapshot_columns} without the columns {MENTION_COLUMNS + ['date']}."
+        )
+        return df
+
+    state_df = pd.DataFrame(list(state.values()))
+    state_df = state_df.drop_duplicates(MENTION_COLUMNS, keep="last")
+    mention_state = df[MENTION_COLUMNS].merge(state_df, on=MENTION_COLUMNS, how="left")
+    has_state = mention_state["date_updated"].notna().to_numpy()
+
+    if "date_requested_repository_data" in df.columns:
+        date_requested = pd.to_datetime(mention_state["date_requested"]).dt.date
+        df.loc[has_state, "date_requested_repository_data"] = date_requested[
+            has_state
+        ].to_numpy()
+    if "days_since_data_requested" in df.columns:
+        days = (
+            pd.to_datetime(df["date"]).to_numpy()
+            - pd.to_datetime(mention_state["date_updated"]).to_numpy()
+        ) // np.timedelta64(1, "D")
+        df.loc[has_state, "days_since_data_requested"] = days[has_state].astype(
+            np.int64
+        )
+    return df
+
+
+@logger.catch
+def read_dataset(dataset_path=DATASET_PATH, columns=None, filters=None):
+    """Read the dataset into a DataFrame.
+
+    columns: Only read these columns.
+    filters: pyarrow filters, e.g. [("days_since_mention", ">", -366)]. These are
+        applied to the partitions and row group statistics before reading.
+
+    The partition columns (podcast, repository) are only returned if requested.
+    """
+    logger.info(f"Read dataset {dataset_path}, columns: {columns}, filters: {filters}.")
+    df = pd.read_parquet(
+        dataset_path, engine="pyarrow", columns=columns, filters=filters
+    )
+    drop_columns = [
+        column
+        for column in PARTITION_COLUMNS
+        if column in df.columns and (columns is None or column not in columns)
+    ]
+    df = df.drop(columns=drop_columns)
+    df = refresh_snapshot_columns(df, load_state(dataset_path))
+    logger.success(f"Read dataset {dataset_path} with shape {df.shape}.")
+    return df
@@ -9,17 +9,21 @@ is passed.
 
 """
 
+import datetime
 import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+import pytz
 from loguru import logger
 
 from github_data import Repository
-from base import LutherBaseClass
+from base import LutherBaseClass, add_log_sink
 from get_github_data import get_raw_repository_info
 
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
-logger.add(f"logs/success.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
 
 
 class Reference(LutherBaseClass):
@@ -36,6 +40,7 @@ class Reference(LutherBaseClass):
 
         # Add Repository data
         repository = ref_data.get("repository", None)
+        resolve_repository = ref_data.pop("resolve_repository", True)
 
         if isinstance(repository, Repository):
             self.repository = repository
@@ -44,7 +49,7 @@ class Reference(LutherBaseClass):
 
         super().__init__(**ref_data)
 
-        if self._is_github_ref and self.repository is None:
+        if resolve_repository and self.needs_repository:
             self.create_repository()
 
     def __hash__(self):
@@ -110,13 +115,30 @@ class Reference(LutherBaseClass):
     def get_repo_data(self):
         return {"rep_owner": self.rep_owner, "rep_name": self.rep_name}
 
+    def get_registry_key(self):
+        """Key of the referenced repository, GitHub names are case insensitive."""
+        return (self.rep_owner.lower(), self.rep_name.lower())
+
+    @property
+    def needs_repository(self):
+        return self._is_github_ref and self.repository is None
+
     @logger.catch
-    def create_repository(self):
-        logger.info(f"Creating Repository for {self}.")
-        raw_repo_info = get_raw_repository_info(**self.get_repo_data())
+    def fetch_repository(self, raw_repo_info=None):
+        """Request the repository and all its stargazers without attaching it.
+
+        raw_repo_info: Repository info requested before, e.g. by crawl_planner.py.
+            Only the stargazers are requested if given.
+
+        Return the Repository or None if it could not be created.
+        """
+        logger.info(f"Fetching Repository for {self}.")
+        if raw_repo_info is None:
+            raw_repo_info = get_raw_repository_info(**self.get_repo_data())
         try:
             raw_repo_info["_parent_uuid"] = str(self._uuid)
-            repository = Repository(**raw_repo_info)
+            raw_repo_info["mention_dates"] = [self.date_referenced]
+            return Repository(**raw_repo_info)
         except TypeError as e:
             if raw_repo_info is None:
                 logger.warning(
@@ -124,12 +146,165 @@ class Reference(LutherBaseClass):
                 )
             logger.warning(f"Can not create repository for {self}. Check manually.")
             logger.error(e)
+            return None
+
+    def attach_repository(self, repository):
+        if repository is None:
             return self
 
         self.repository = repository
         logger.success(f"Created {self}")
         return self
 
+    @logger.catch
+    def create_repository(self):
+        logger.info(f"Creating Repository for {self}.")
+        return self.attach_repository(self.fetch_repository())
+
+
+class RepositoryRegistry:
+    def __init__(self, repositories=None):
+        """Fetch every repository only once, shared by multiple threads.
+
+        repositories: dict {(rep_owner, rep_name): Repository} used as storage,
+            see Reference.get_registry_key. Newly fetched repositories are added.
+
+        A repository requested by several threads at the same time is fetched by the
+        first one, the others wait for its result.
+
+        If the stargazers of a repository are sampled, the stargazers around the
+        mention date of every further reference are fetched completely as well, see
+        Repository.refine_star_sample.
+        """
+        self.repositories = {} if repositories is None else repositories
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._refine_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"RepositoryRegistry(repository_count={len(self)})"
+
+    def __len__(self):
+        return len(self.repositories)
+
+    def __contains__(self, key):
+        return key in self.repositories
+
+    def get_repository(self, reference):
+        """Return the repository of reference, fetch it if nobody else did."""
+        key = reference.get_registry_key()
+        with self._lock:
+            if key in self.repositories:
+                return self.repositories[key]
+            future = self._pending.get(key)
+            is_fetching = future is None
+            if is_fetching:
+                future = self._pending[key] = Future()
+
+        if is_fetching:
+            repository = None
+            try:
+                repository = reference.fetch_repository()
+            finally:
+                with self._lock:
+                    if repository is not None:
+                        self.repositories[key] = repository
+                    del self._pending[key]
+                future.set_result(repository)
+            return repository
+
+        repository = future.result()
+        if repository is not None and repository.is_sampled:
+            with self._refine_lock:
+                repository.refine_star_sample(reference.date_referenced)
+        return repository
+
+
+def get_star_count(key):
+    """Request the current star count of a repository, None if the request failed."""
+    try:
+        raw_repo_info = get_raw_repository_info(rep_owner=key[0], rep_name=key[1])
+        return raw_repo_info, int(raw_repo_info["stargazers"]["totalCount"])
+    except Exception as e:
+        logger.warning(f"Could not get the star count of {key}: {e}")
+        return None, None
+
+
+def get_stale_repositories(repositories, max_workers=8):
+    """Return {key: raw_repo_info} of the repositories whose star count changed.
+
+    repositories: {(rep_owner, rep_name): Repository}, see Reference.get_registry_key.
+
+    Only the cheap repository info is requested for every repository, not the
+    stargazers. A repository with an unchanged star count still holds all its
+    stargazers, its date requested is set to today. A repository whose star count
+    could not be requested is kept as it is.
+    """
+    keys = list(repositories)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        star_counts = list(executor.map(get_star_count, keys))
+
+    today = datetime.datetime.utcnow().replace(tzinfo=pytz.utc).date()
+    stale = {}
+    for key, (raw_repo_info, star_count) in zip(keys, star_counts):
+        repository = repositories[key]
+        if star_count is None:
+            continue
+        if star_count == repository.stargazer_count:
+            repository._date_requested = today
+        else:
+            stale[key] = raw_repo_info
+    logger.info(
+        f"Star count of {len(stale)} of {len(repositories)} repositories changed."
+    )
+    return stale
+
+
+@logger.catch
+def refresh_repositories(references, registry, max_workers=8):
+    """Attach the current repository to every reference, request only what changed.
+
+    registry: {(rep_owner, rep_name): Repository} of the repositories fetched
+        before, updated in place. A repository is only requested again if its star
+        count changed (see get_stale_repositories), or if neither the registry nor
+        the reference holds it.
+
+    return: Number of requested repositories.
+    """
+    references_by_key = {}
+    for reference in references:
+        if reference._is_github_ref:
+            references_by_key.setdefault(reference.get_registry_key(), reference)
+    for key, reference in references_by_key.items():
+        if key not in registry and reference.repository is not None:
+            registry[key] = reference.repository
+
+    stale = get_stale_repositories(
+        {key: registry[key] for key in references_by_key if key in registry},
+        max_workers=max_workers,
+    )
+    to_fetch = [key for key in references_by_key if key in stale or key not in registry]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        repositories = executor.map(
+            lambda key: references_by_key[key].fetch_repository(stale.get(key)),
+            to_fetch,
+        )
+        for key, repository in zip(to_fetch, repositories):
+            if repository is not None:
+                registry[key] = repository
+
+    for reference in references:
+        if not reference._is_github_ref:
+            continue
+        repository = registry.get(reference.get_registry_key())
+        if repository is not None and repository is not reference.repository:
+            reference.attach_repository(repository)
+            reference.pickle(is_raw=False)
+    logger.success(
+        f"Refreshed {len(references_by_key)} repositories, requested {len(to_fetch)}."
+    )
+    return len(to_fetch)
+
 
 class Episode(LutherBaseClass):
     def __init__(self, **episode_data):
@@ -142,10 +317,14 @@ class Episode(LutherBaseClass):
         self.references = []
         self.github_references = []
         self.github_reference_count = episode_data.get("github_reference_count", 0)
+        resolve_repositories = episode_data.pop("resolve_repositories", True)
 
         super().__init__(**episode_data)
         if "reference_list" in episode_data:
-            self.append_raw_references(episode_data["reference_list"])
+            self.append_raw_references(
+                episode_data["reference_list"],
+                resolve_repositories=resolve_repositories,
+            )
 
         logger.success(f"Created {self}")
 
@@ -234,13 +413,18 @@ class Episode(LutherBaseClass):
         self.references += references
         return self.remove_duplicate_references()
 
-    def append_raw_references(self, raw_references):
+    @property
+    def unresolved_references(self):
+        return [ref for ref in self.references if ref.needs_repository]
+
+    def append_raw_references(self, raw_references, resolve_repositories=True):
         logger.info(f"Create and Append References from raw data.")
         episode_data = {
             "episode_number": self.number,
             "episode_title": self.title,
             "date_referenced": self.date_published,
             "_parent_uuid": self._uuid,
+            "resolve_repository": resolve_repositories,
         }
         if not isinstance(raw_references, list):
             raw_reference = {**raw_references, **episode_data}
@@ -315,10 +499,20 @@ class Podcast(LutherBaseClass):
         self.episodes += episodes
         return self.remove_duplicate_episodes()
 
-    def append_raw_episodes(self, raw_episodes):
+    def append_raw_episodes(
+        self, raw_episodes, max_workers=None, resolve=True, registry=None
+    ):
         """Take json data about episodes and create/return the corresponding objects.
 
         All created Episodes will be Appended to self.
+
+        max_workers: If set, build the graph in two phases. First all Episodes and
+            References are created without any GitHub requests, afterwards all
+            repositories are fetched by max_workers threads and attached.
+            If None, every Reference fetches its repository on creation.
+        resolve: If False, no repositories are fetched at all. Call
+            resolve_repositories later.
+        registry: Passed to resolve_repositories, only used if max_workers is set.
         """
         logger.info(f"Create and Append Episodes from raw data.")
         if raw_episodes is None:
@@ -326,11 +520,59 @@ class Podcast(LutherBaseClass):
                 f"Encountered a NoneType while appending raw episodes to {self}"
             )
             return self
-        podcast_info = {"_parent_uuid": self._uuid}
+        podcast_info = {
+            "_parent_uuid": self._uuid,
+            "resolve_repositories": resolve and max_workers is None,
+        }
         if not isinstance(raw_episodes, list):
             episode = Episode.create_from_dict(**{**raw_episodes, **podcast_info})
             self.episodes.append(episode)
-            return self.remove_duplicate_episodes()
+            self.remove_duplicate_episodes()
+        else:
+            episodes = Episode.create_from_list(raw_episodes, podcast_info)
+            self.append_episodes(episodes)
+
+        if resolve and max_workers is not None:
+            self.resolve_repositories(max_workers=max_workers, registry=registry)
+
+        return self
 
-        episodes = Episode.create_from_list(raw_episodes, podcast_info)
-        return self.append_episodes(episodes)
+    @logger.catch
+    def resolve_repositories(self, max_workers=8, registry=None):
+        """Fetch the repositories of all unresolved References in parallel.
+
+        The repositories are attached in episode/reference order afterwards, and every
+        touched Reference and Episode is pickled again, so the stored objects are the
+        same as if each Reference had fetched its repository on creation.
+
+        registry: Optional RepositoryRegistry or dict {(rep_owner, rep_name): Repository}.
+            Repositories in the registry are not fetched again and every repository
+            is fetched only once, even if it is referenced multiple times or by
+            other podcasts resolved at the same time. Newly fetched repositories are
+            added to the registry.
+        """
+        episodes = [ep for ep in self.episodes if ep.unresolved_references]
+        references = [ref for ep in episodes for ref in ep.unresolved_references]
+        logger.info(
+            f"Resolve {len(references)} repositories with {max_workers} workers for {self}."
+        )
+
+        if registry is None:
+            fetch = lambda ref: ref.fetch_repository()
+        else:
+            if not isinstance(registry, RepositoryRegistry):
+                registry = RepositoryRegistry(registry)
+            fetch = registry.get_repository
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            repositories = list(executor.map(fetch, references))
+
+        for reference, repository in zip(references, repositories):
+            reference.attach_repository(repository)
+            reference.pickle(is_raw=False)
+
+        for episode in episodes:
+            episode.pickle(is_raw=False)
+
+        logger.success(f"Resolved {len(references)} repositories for {self}.")
+        return self
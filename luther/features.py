@@ -0,0 +1,326 @@
+"""Build the design matrix of all features once and fit every model spec from it.
+
+A FeatureMatrix holds, per fake_date of the prepared data (see
+modeling.prepare_columns_for_modeling), the columns
+
+    const, lag_1, ..., lag_<max_lag>, rolling_mean_<window>, ..., exogenous columns
+
+in one contiguous column-major (Fortran ordered) float64 array, together with the
+target. Lags and rolling means only use the values before a date. The exogenous
+columns are the daily means over all mentions, e.g. days_since_creation or the
+share of every repository_primary_language dummy (see get_language_columns).
+
+Every column is a contiguous array, FeatureMatrix.design returns a view without a
+copy if the columns are next to each other, e.g. ["const", "lag_1", "lag_2"] for
+AR(2). A column is NaN where its feature is not defined, e.g. before the first
+rolling_mean_28. A spec is fitted on the rows where its own columns and the target
+are defined, so AR(1) does not lose the 28 warm-up rows of rolling_mean_28. X'X
+and X'y of all columns are computed once per distinct set of rows, fitting a spec
+is a small solve on a sub-block and never touches the rows again.
+
+modeling.ar_model_fitting fits its ols AR models here (see fit_ar_models). The
+Yule-Walker estimator, the ARMA order selection (order_selection.py) and the
+recursive least squares backtest (backtest.py) are not a least squares fit on a
+fixed design matrix and keep their own implementations.
+
+The matrices are cached in memory (the MAX_FEATURE_MATRICES most recently used) and
+in the model store (see model_store.py), keyed by the prepared series and the
+feature spec.
+"""
+
+import os
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pyarrow.parquet as pq
+from loguru import logger
+
+import ar_engine
+import artifacts
+import model_store
+import modeling
+from base import add_log_sink, add_log_level
+
+add_log_level("RESULTS", no=40, color="<green>")
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/results_{_log_file_name}.log", level="RESULTS")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+EXOGENOUS_COLUMNS = ["days_since_creation", "days_since_podcast_start"]
+ROLLING_WINDOWS = [7, 28]
+MAX_LAG = 5
+MAX_FEATURE_MATRICES = int(os.getenv("LUTHER_MAX_FEATURE_MATRICES", default=16))
+
+# {key: FeatureMatrix} of the matrices built or loaded by this process, least
+# recently used first.
+_FEATURE_MATRICES = OrderedDict()
+
+
+def get_language_columns(clean_df):
+    """Return the repository_primary_language dummy columns of a cleaned DataFrame.
+
+    clean_df: DataFrame or the filename of a stored one, see artifacts.py.
+    """
+    if isinstance(clean_df, str):
+        column_names = set(pq.read_schema(clean_df).names)
+        clean_df = artifacts.read_dataframe(
+            clean_df, columns=["repository_primary_language"]
+        )
+    else:
+        column_names = set(clean_df.columns)
+    languages = clean_df["repository_primary_language"].dropna().unique()
+    return sorted(str(language) for language in languages if language in column_names)
+
+
+def get_exogenous_columns(data, column_name):
+    """Return EXOGENOUS_COLUMNS and the language dummy columns of data.
+
+    data: See get_feature_matrix. For already prepared columns all of them except
+        column_name, for chunks only EXOGENOUS_COLUMNS.
+    """
+    if isinstance(data, dict):
+        return [name for name in data if name != column_name]
+    if isinstance(data, str) or hasattr(data, "columns"):
+        return EXOGENOUS_COLUMNS + get_language_columns(data)
+    return list(EXOGENOUS_COLUMNS)
+
+
+def get_lags(values, max_lag):
+    """Return the columns y_t-1, ..., y_t-max_lag, NaN before the first value."""
+    lags = np.full((len(values), max_lag), np.nan)
+    for lag in range(1, max_lag + 1):
+        lags[lag:, lag - 1] = values[:-lag]
+    return lags
+
+
+def get_rolling_means(values, windows):
+    """Return the means of the window values before every date, one column per window.
+
+    A mean is NaN if its window is incomplete or contains a NaN value.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    is_defined = ~np.isnan(values)
+    # NaN would spread to every later sum, so they are summed as 0 and counted.
+    cumulative = np.concatenate([[0], np.cumsum(np.where(is_defined, values, 0))])
+    defined_count = np.concatenate([[0], np.cumsum(is_defined)])
+    rolling_means = np.full((len(values), len(windows)), np.nan)
+    for idx, window in enumerate(windows):
+        sums = cumulative[window:-1] - cumulative[: -window - 1]
+        counts = defined_count[window:-1] - defined_count[: -window - 1]
+        rolling_means[window:, idx] = np.where(counts == window, sums / window, np.nan)
+    return rolling_means
+
+
+class FeatureMatrix:
+    def __init__(self, matrix, targets, column_names, dates):
+        """Design matrix (rows, columns) in Fortran order, targets and row dates.
+
+        NaN marks the rows where a column or the target is not defined.
+        """
+        self.matrix = np.asfortranarray(matrix)
+        self.targets = targets
+        self.column_names = list(column_names)
+        self.column_idx = {name: idx for idx, name in enumerate(self.column_names)}
+        self.dates = dates
+        self.defined = np.asfortranarray(~np.isnan(self.matrix))
+        # {rows as bytes: (X'X, X'y)} of the row sets fitted so far.
+        self._grams = {}
+
+    def __repr__(self):
+        return (
+            f"FeatureMatrix(rows={len(self.targets)}, column_names={self.column_names})"
+        )
+
+    def __getstate__(self):
+        # The Gram matrices are cheap to recompute, do not store them.
+        return {**self.__dict__, "_grams": {}}
+
+    def get_column_idx(self, names):
+        return [self.column_idx[name] for name in names]
+
+    def column(self, name):
+        """Return a column as a contiguous view."""
+        return self.matrix[:, self.column_idx[name]]
+
+    def design(self, names):
+        """Return the columns names, a view if they are next to each other."""
+        column_idx = self.get_column_idx(names)
+        first = column_idx[0]
+        if column_idx == list(range(first, first + len(column_idx))):
+            return self.matrix[:, first : first + len(column_idx)]
+        return self.matrix[:, column_idx]
+
+    def get_rows(self, names):
+        """Return the mask of the rows where the columns names and the target are defined."""
+        rows = ~np.isnan(self.targets)
+        for idx in self.get_column_idx(names):
+            rows &= self.defined[:, idx]
+        return rows
+
+    def get_gram(self, rows):
+        """Return X'X and X'y of all columns on rows, computed once per row set.
+
+        Columns which are not defined on all rows count as 0, only the sub-blocks of
+        columns defined on rows are valid.
+        """
+        key = np.packbits(rows).tobytes()
+        if key not in self._grams:
+            design = np.nan_to_num(self.matrix[rows])
+            self._grams[key] = (design.T @ design, design.T @ self.targets[rows])
+        return self._grams[key]
+
+    def fit(self, names, row_names=None):
+        """Least squares coefficients of the columns names from the shared X'X.
+
+        row_names: Fit on the rows where these columns are defined instead of the
+            rows of names, e.g. to fit all AR orders on the same rows.
+        """
+        rows = self.get_rows(names if row_names is None else row_names)
+        gram, xty = self.get_gram(rows)
+        column_idx = self.get_column_idx(names)
+        coefficients, *_ = np.linalg.lstsq(
+            gram[np.ix_(column_idx, column_idx)], xty[column_idx], rcond=None
+        )
+        return coefficients
+
+    def predict(self, names, coefficients):
+        """Predictions of every row, NaN where a column of names is not defined."""
+        return self.design(names) @ coefficients
+
+    def get_rmse(self, names, coefficients):
+        """RMSE on the rows where names and the target are defined."""
+        rows = self.get_rows(names)
+        residuals = self.targets[rows] - self.predict(names, coefficients)[rows]
+        return float(np.sqrt(np.mean(residuals ** 2)))
+
+
+def build_feature_matrix(prepared, column_name, max_lag, windows, exogenous):
+    """Build the FeatureMatrix of column_name from the prepared columns.
+
+    prepared: {column_name: DataFrame with a "mean" column indexed by fake_date},
+        for column_name and all exogenous columns.
+    """
+    values = prepared[column_name]["mean"].to_numpy(dtype=np.float64)
+    columns = [np.ones((len(values), 1)), get_lags(values, max_lag)]
+    columns.append(get_rolling_means(values, windows))
+    columns += [
+        prepared[exogenous_name]["mean"]
+        .reindex(prepared[column_name].index)
+        .to_numpy(dtype=np.float64)[:, None]
+        for exogenous_name in exogenous
+    ]
+    column_names = ["const"] + [f"lag_{lag}" for lag in range(1, max_lag + 1)]
+    column_names += [f"rolling_mean_{window}" for window in windows]
+    column_names += list(exogenous)
+
+    # The first rows miss lags or rolling means, other rows may miss exogenous data.
+    # They are kept as NaN, every spec only drops the rows its columns miss.
+    return FeatureMatrix(
+        np.hstack(columns), values, column_names, prepared[column_name].index
+    )
+
+
+@logger.catch
+def get_feature_matrix(
+    data,
+    column_name="star_count_rel",
+    max_lag=MAX_LAG,
+    windows=ROLLING_WINDOWS,
+    exogenous=None,
+    store=None,
+):
+    """Return the cached FeatureMatrix of data, build it if it is not cached.
+
+    data: Cleaned DataFrame, filename or chunks, see modeling.get_chunks, or the
+        already prepared columns {column_name: prepared DataFrame}.
+    exogenous: Names of the exogenous columns, see get_exogenous_columns if None.
+    store: ModelStore to cache the matrix across processes, only in memory if None.
+    """
+    start = time.time()
+    if exogenous is None:
+        exogenous = get_exogenous_columns(data, column_name)
+    exogenous = list(exogenous)
+    prepared = data
+    if not isinstance(data, dict):
+        prepared = modeling.prepare_columns_for_modeling(
+            data, [column_name] + exogenous
+        )
+    spec = {
+        "kind": "features",
+        "max_lag": max_lag,
+        "windows": list(windows),
+        "exogenous": {
+            name: model_store.get_series_fingerprint(prepared[name])
+            for name in exogenous
+        },
+    }
+    key = model_store.ModelStore.get_key(prepared[column_name], column_name, spec)
+    if key in _FEATURE_MATRICES:
+        _FEATURE_MATRICES.move_to_end(key)
+        return _FEATURE_MATRICES[key]
+
+    def build():
+        return build_feature_matrix(prepared, column_name, max_lag, windows, exogenous)
+
+    if store is None:
+        feature_matrix = build()
+    else:
+        feature_matrix = store.get_or_create(
+            key, build, kind="features", column_name=column_name
+        )
+    if feature_matrix is None:
+        return None
+    _FEATURE_MATRICES[key] = feature_matrix
+    while MAX_FEATURE_MATRICES < len(_FEATURE_MATRICES):
+        _FEATURE_MATRICES.popitem(last=False)
+    logger.success(f"Prepared {feature_matrix} in {time.time() - start}s.")
+    return feature_matrix
+
+
+def get_ar_spec(lag):
+    return ["const"] + [f"lag_{idx}" for idx in range(1, lag + 1)]
+
+
+def fit_ar_models(feature_matrix, max_ar):
+    """Fit AR(1)..AR(max_ar) like ar_engine.fit_ar_models with method "ols".
+
+    All orders are fitted on the same rows, the first max_ar values are only used
+    as lags, const is the mean of the process.
+
+    return: List of (lag, betas, const) for every lag in 1..max_ar.
+    """
+    values = feature_matrix.targets[~np.isnan(feature_matrix.targets)]
+    ar_models = []
+    for lag in range(1, max_ar + 1):
+        coefficients = feature_matrix.fit(get_ar_spec(lag), get_ar_spec(max_ar))
+        betas = coefficients[1:]
+        const = ar_engine.intercept_to_mean(coefficients[0], betas, values)
+        ar_models.append((lag, betas.tolist(), const))
+    return ar_models
+
+
+@logger.catch
+def feature_model_validation(training, validation, column_name, specs, **kwargs):
+    """Fit every spec on training and compute its RMSE on validation.
+
+    training, validation: See get_feature_matrix, kwargs are passed to it. The
+        exogenous columns of training are used for both if exogenous is not given.
+    specs: List of column name lists, e.g. get_ar_spec(2) + ["days_since_creation"].
+        Every spec is fitted and validated on the rows where its columns are
+        defined.
+
+    return: List of (spec, coefficients, rmse)
+    """
+    if kwargs.get("exogenous") is None:
+        kwargs["exogenous"] = get_exogenous_columns(training, column_name)
+    training_matrix = get_feature_matrix(training, column_name, **kwargs)
+    validation_matrix = get_feature_matrix(validation, column_name, **kwargs)
+    results = []
+    for spec in specs:
+        coefficients = training_matrix.fit(spec)
+        rmse = validation_matrix.get_rmse(spec, coefficients)
+        results.append((spec, coefficients.tolist(), rmse))
+        logger.log("RESULTS", f"{spec} - {column_name} - RMSE: {rmse}")
+    return results
@@ -6,6 +6,7 @@ import requests
 import json
 import os
 from loguru import logger
+from base import add_log_sink
 from pprint import pprint
 from dotenv import load_dotenv
 
@@ -13,8 +14,8 @@ from dotenv import load_dotenv
 
 load_dotenv()
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
-logger.add(f"logs/success.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
 
 # The Query Template is generated via Insomina
 QUERY_TEMPLATE = '{"query":"\\nquery { \\n\\trepository(owner:\\"rep_owner\\", name:\\"rep_name\\") {\\n    stargazers(stargazer_limitation_str, orderBy:{field: STARRED_AT, direction: ASC}) {\\n      totalCount\\n      edges {\\n        starredAt\\n        node {\\n          name\\n          createdAt\\n          followers {\\n            totalCount\\n          }\\n          starredRepositories {\\n            totalCount\\n          }\\n          url\\n        }\\n        cursor\\n      }\\n      pageInfo {\\n        endCursor\\n      }\\n    }\\n    collaborators {\\n      totalCount\\n    }\\n    watchers(last:5) {\\n      totalCount\\n\\n    }\\n    createdAt\\n    isFork\\n    forkCount\\n    nameWithOwner\\n    primaryLanguage {\\n      name\\n      id\\n    }\\n    languages(first:40) {\\n      totalCount\\n      nodes {\\n        name\\n        id\\n      }\\n    }\\n    \\n  }\\n}"}'
@@ -28,6 +29,34 @@ GITHUB_API_ENDPOINT = os.getenv(
 GITHUB_USERNAME = os.getenv("GITHUB_USERNAME")
 GITHUB_API_TOKEN = os.getenv("GITHUB_API_ACCESS_TOKEN")
 
+# GitHub accepts at most 100 ids per nodes query.
+USER_BATCH_SIZE = 100
+USER_NODES_QUERY = """
+query {
+  nodes(ids: user_ids) {
+    ... on User {
+      id
+      login
+      name
+      url
+      createdAt
+      followers {
+        totalCount
+      }
+      starredRepositories {
+        totalCount
+      }
+    }
+  }
+}
+"""
+
+# The REST API is only used for stargazer pages, which it serves in any order.
+GITHUB_REST_API_URL = os.getenv("GITHUB_REST_API_URL", default="https://api.github.com")
+STARGAZERS_PER_PAGE = 100
+# GitHub does not serve stargazer pages after this one.
+MAX_STARGAZER_PAGE = 400
+
 
 def run_gql_query(endpoint_url, query, auth):
     logger.info(f"Run GraphQL Query against: {endpoint_url}.")
@@ -126,3 +155,63 @@ def get_raw_stargazer_info(has_next_page=False, is_initial=True, **data):
         )
 
     return stargazers
+
+
+def get_raw_stargazer_page(rep_owner, rep_name, page):
+    """Return a single page of stargazers from the REST API.
+
+    Unlike the cursors of the GraphQL query, any page can be requested without
+    requesting the pages before it. The stargazers are returned in the format of
+    the GraphQL edges, node.name holds the login of the user.
+    """
+    logger.info(f"Get raw stargazer page {page} of {rep_owner}/{rep_name}.")
+    response = requests.get(
+        url=f"{GITHUB_REST_API_URL}/repos/{rep_owner}/{rep_name}/stargazers",
+        params={"per_page": STARGAZERS_PER_PAGE, "page": page},
+        headers={"Accept": "application/vnd.github.v3.star+json"},
+        auth=(GITHUB_USERNAME, GITHUB_API_TOKEN),
+    )
+    logger.info(f"Got a response code of: {response.status_code}.")
+    if response.status_code != 200:
+        logger.warning(
+            f"Could not get stargazer page {page} of {rep_owner}/{rep_name}: {response.content}"
+        )
+        return []
+
+    return [
+        {
+            "starredAt": stargazer["starred_at"],
+            "node": {
+                "name": stargazer["user"]["login"],
+                "id": stargazer["user"]["node_id"],
+                "url": stargazer["user"]["html_url"],
+            },
+        }
+        for stargazer in response2json(response)
+    ]
+
+
+def get_raw_user_info(user_ids):
+    """Return the user data of up to USER_BATCH_SIZE node ids with a single query.
+
+    return: The user data in the order of user_ids, None for ids which do not
+        belong to a user (e.g. deleted accounts). None if the request failed.
+    """
+    logger.info(f"Get raw user info for {len(user_ids)} users.")
+    query = json.dumps(
+        {"query": prepare_gql_query(USER_NODES_QUERY, user_ids=json.dumps(user_ids))}
+    )
+    try:
+        response = run_gql_query(
+            GITHUB_API_ENDPOINT, query, auth=(GITHUB_USERNAME, GITHUB_API_TOKEN)
+        )
+        user_data = clean_gql_query_response(response)
+        nodes = user_data["data"]["nodes"]
+    except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Could not get the user info of {len(user_ids)} users: {e}")
+        return None
+    if nodes is None or len(nodes) != len(user_ids):
+        logger.warning(f"Encountered an invalid response for user info: {user_data}")
+        return None
+
+    return [node if node and "id" in node else None for node in nodes]
@@ -10,12 +10,13 @@ import pytz
 import os
 from loguru import logger
 
-from get_github_data import get_raw_stargazer_info
-from base import LutherBaseClass
+from get_github_data import get_raw_stargazer_info, get_raw_stargazer_page
+from base import LutherBaseClass, add_log_sink
+import star_sampling
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
-logger.add(f"logs/success.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
 
 GITHUB_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
@@ -97,6 +98,47 @@ class StarGazer(LutherBaseClass):
         return self_ == other_
 
 
+class GitHubUser(LutherBaseClass):
+    def __init__(self, **user_data):
+        """Read GitHub GraphQL User data, see get_github_data.USER_NODES_QUERY.
+
+        Users are stored in the github_users.UserCache, not pickled one by one.
+        """
+        self.user_id = user_data.get("id")
+        self.login = user_data.get("login")
+        self.name = user_data.get("name")
+        self.url = user_data.get("url")
+        self.date_created = user_data.get("createdAt")
+        # The counts are null if the user hides them.
+        self.follower_count = int(
+            (user_data.get("followers") or {}).get("totalCount") or 0
+        )
+        self.starred_repository_count = int(
+            (user_data.get("starredRepositories") or {}).get("totalCount") or 0
+        )
+
+        if self.date_created is not None:
+            self.date_created = (
+                datetime.datetime.strptime(self.date_created, GITHUB_DATETIME_FORMAT)
+                .replace(tzinfo=pytz.utc)
+                .date()
+            )
+
+        super().__init__(**user_data)
+
+    def __repr__(self):
+        return f"GitHubUser(login={self.login}, follower_count={self.follower_count})"
+
+    def __hash__(self):
+        return hash((self.user_id, self._date_requested))
+
+    def __eq__(self, other):
+        return (self.user_id, self._date_requested) == (
+            other.user_id,
+            other._date_requested,
+        )
+
+
 class Repository(LutherBaseClass):
     def __init__(self, **repo_data):
         """Read the GitHub GraphQL repository data.
@@ -131,10 +173,14 @@ class Repository(LutherBaseClass):
         )
 
         self.stargazers = []
+        self.star_sample = None
 
         super().__init__(**repo_data)
 
-        if 0 < self.stargazer_count:
+        if star_sampling.use_sampling(self.stargazer_count):
+            logger.info(f"Sample stargazers for {self}")
+            self.sample_stargazers(repo_data.get("mention_dates", []))
+        elif 0 < self.stargazer_count:
             logger.info(f"Create stargazers for {self}")
             stargazers = self.create_stargazers()
             self.append_stargazers(stargazers)
@@ -184,6 +230,64 @@ class Repository(LutherBaseClass):
 
         return stargazers
 
+    @property
+    def is_sampled(self):
+        return getattr(self, "star_sample", None) is not None
+
+    def fetch_stargazer_pages(self, pages):
+        """Fetch the given pages of stargazers and add them to the star sample."""
+        for page in pages:
+            stargazer_data = get_raw_stargazer_page(self.owner, self.name, page)
+            stargazers = [
+                StarGazer(**{**stargazer, **self.repository_info})
+                for stargazer in stargazer_data
+            ]
+            self.star_sample.add_page(
+                page, [stargazer.date_starred.toordinal() for stargazer in stargazers]
+            )
+            self.stargazers += stargazers
+        return self
+
+    def sample_stargazers(self, mention_dates=()):
+        """Fetch a sample of the stargazer pages instead of all, see star_sampling.py.
+
+        mention_dates: The stargazers around these dates are fetched completely.
+        """
+        self.star_sample = star_sampling.StarSample(
+            self.stargazer_count, self.date_created, self._date_requested
+        )
+        self.fetch_stargazer_pages(self.star_sample.get_sample_pages())
+        for mention_date in mention_dates:
+            self.refine_star_sample(mention_date, pickle=False)
+
+        logger.success(
+            f"Sampled {self.star_sample}, error bounds: {self.star_sample.get_error_bounds()}."
+        )
+        return self
+
+    def refine_star_sample(self, mention_date, pickle=True):
+        """Fetch all stargazer pages within EXACT_WINDOW_DAYS of mention_date."""
+        if not self.is_sampled or mention_date is None:
+            return self
+
+        window = datetime.timedelta(days=star_sampling.EXACT_WINDOW_DAYS)
+        pages = self.star_sample.get_window_pages(
+            mention_date - window, mention_date + window
+        )
+        if star_sampling.MAX_EXACT_PAGES < len(pages):
+            logger.warning(
+                f"{len(pages)} pages around {mention_date} for {self}, only fetch {star_sampling.MAX_EXACT_PAGES}."
+            )
+            pages = pages[: star_sampling.MAX_EXACT_PAGES]
+        if not pages:
+            return self
+
+        logger.info(f"Fetch {len(pages)} pages around {mention_date} for {self}.")
+        self.fetch_stargazer_pages(pages)
+        if pickle:
+            self.pickle()
+        return self
+
     @property
     def date_requested(self):
         """Date when the data was requested."""
@@ -0,0 +1,164 @@
+"""Cache the GitHub users who starred any of the tracked repositories.
+
+Many users star several of the tracked repositories, so the users are cached by
+their node id for all repositories together. Missing users are fetched with
+nodes(ids: [...]) queries of up to USER_BATCH_SIZE users each, which makes the
+number of requests proportional to the number of distinct users instead of the
+number of stars.
+
+    user_cache = UserCache.load()
+    user_cache.update_from_podcasts(podcasts)
+    user_cache.save()
+
+Ids that do not belong to a user any more (e.g. deleted accounts) are cached as
+None, so they are not requested again. Ids of a failed request are not cached.
+"""
+
+import datetime
+import os
+import pickle
+import time
+
+import numpy as np
+from loguru import logger
+
+from base import add_log_sink
+from get_github_data import USER_BATCH_SIZE, get_raw_user_info
+from github_data import GitHubUser
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+USER_CACHE_FILENAME = "data/github_user_cache.pk"
+
+
+class UserCache:
+    def __init__(self, users=None, filename=USER_CACHE_FILENAME):
+        """Hold a GitHubUser (or None) for every fetched user node id."""
+        self.users = {} if users is None else users
+        self.filename = filename
+
+    def __repr__(self):
+        return f"UserCache(user_count={len(self)}, filename={self.filename})"
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    @classmethod
+    def load(cls, filename=USER_CACHE_FILENAME):
+        try:
+            with open(filename, "rb") as f:
+                users = pickle.load(f)
+            logger.info(f"Loaded {len(users)} users from {filename}.")
+        except FileNotFoundError:
+            logger.info(f"No user cache in {filename}, start with an empty one.")
+            users = {}
+        return cls(users, filename)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        with open(self.filename + ".tmp", "wb") as f:
+            pickle.dump(self.users, f)
+        os.replace(self.filename + ".tmp", self.filename)
+        logger.info(f"Saved {len(self)} users to {self.filename}.")
+        return self
+
+    def get_missing_ids(self, user_ids, max_age_days=None):
+        """Return the distinct user_ids which are not cached.
+
+        max_age_days: Also return users requested more than max_age_days ago.
+        """
+        if max_age_days is not None:
+            oldest_date = datetime.datetime.utcnow().date() - datetime.timedelta(
+                days=max_age_days
+            )
+        missing_ids = {}
+        for user_id in user_ids:
+            if user_id is None or user_id in missing_ids:
+                continue
+            if user_id not in self.users:
+                missing_ids[user_id] = True
+            elif max_age_days is not None:
+                user = self.users[user_id]
+                if user is not None and user._date_requested < oldest_date:
+                    missing_ids[user_id] = True
+        return list(missing_ids)
+
+    @logger.catch
+    def fetch(self, user_ids, batch_size=USER_BATCH_SIZE, max_age_days=None):
+        """Fetch all missing users in batches.
+
+        Users of a failed request are not cached and requested again by the next
+        fetch.
+
+        return: Number of requested users.
+        """
+        start = time.time()
+        missing_ids = self.get_missing_ids(user_ids, max_age_days=max_age_days)
+        logger.info(
+            f"Fetch {len(missing_ids)} missing users in batches of {batch_size}."
+        )
+        requested_count = len(missing_ids)
+        for batch_start in range(0, len(missing_ids), batch_size):
+            batch_ids = missing_ids[batch_start : batch_start + batch_size]
+            batch_data = get_raw_user_info(batch_ids)
+            if batch_data is None:
+                # Not cached, the users are requested again by the next fetch.
+                requested_count -= len(batch_ids)
+                continue
+            for user_id, user_data in zip(batch_ids, batch_data):
+                if user_data is None:
+                    self.users[user_id] = None
+                else:
+                    self.users[user_id] = GitHubUser(**user_data)
+
+        logger.success(
+            f"Fetched {requested_count} of {len(missing_ids)} users in {time.time() - start}s, {len(self)} users cached."
+        )
+        return requested_count
+
+    def update_from_repositories(self, repositories, **kwargs):
+        """Fetch the missing users of all stargazers of repositories."""
+        user_ids = [
+            stargazer.user_id
+            for repository in repositories
+            for stargazer in repository.stargazers
+        ]
+        return self.fetch(user_ids, **kwargs)
+
+    def update_from_podcasts(self, podcasts, **kwargs):
+        repositories = {}
+        for podcast in podcasts:
+            for episode in podcast.episodes:
+                for reference in episode.references:
+                    if reference.repository is not None:
+                        repositories[id(reference.repository)] = reference.repository
+        return self.update_from_repositories(list(repositories.values()), **kwargs)
+
+
+def get_star_follower_counts(stargazers, user_cache):
+    """Return the star ordinals and the follower count of each stargazer.
+
+    Both arrays are sorted by date, like luther.get_star_ordinals. Stargazers whose
+    user is not cached have a follower count of 0.
+    """
+    star_ordinals = np.array(
+        [stargazer.date_starred.toordinal() for stargazer in stargazers],
+        dtype=np.int32,
+    )
+    follower_counts = np.array(
+        [
+            getattr(user_cache.get(stargazer.user_id), "follower_count", 0)
+            for stargazer in stargazers
+        ],
+        dtype=np.int64,
+    )
+    order = np.argsort(star_ordinals, kind="stable")
+    return star_ordinals[order], follower_counts[order]
@@ -0,0 +1,90 @@
+"""Load test the prediction service, see prediction_service.py.
+
+Sends request_count /predict requests for the repositories the service knows from
+concurrency threads and reports the throughput and the latency percentiles.
+
+Run with:
+    python luther/load_test.py [request_count] [concurrency]
+"""
+
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+from base import add_log_sink
+from prediction_service import DEFAULT_HORIZON, PORT
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+
+BASE_URL = os.getenv("LUTHER_PREDICTION_URL", default=f"http://127.0.0.1:{PORT}")
+REQUEST_COUNT = 2000
+CONCURRENCY = 8
+
+
+def get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+
+def timed_request(url):
+    """return: (seconds, HTTP status)"""
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as error:
+        status = error.code
+    return time.perf_counter() - start, status
+
+
+@logger.catch
+def run_load_test(
+    base_url=BASE_URL,
+    request_count=REQUEST_COUNT,
+    concurrency=CONCURRENCY,
+    horizon=DEFAULT_HORIZON,
+):
+    """return: dict with the throughput, latency percentiles in ms and statuses."""
+    repositories = get_json(f"{base_url}/repositories")
+    if not repositories:
+        raise ValueError(f"The service at {base_url} knows no repositories.")
+    urls = [
+        f"{base_url}/predict?repository={repositories[idx % len(repositories)]}&horizon={horizon}"
+        for idx in range(request_count)
+    ]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_request, urls))
+    total_seconds = time.perf_counter() - start
+
+    latencies = np.array([seconds for seconds, _ in results]) * 1000
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    report = {
+        "requests": request_count,
+        "concurrency": concurrency,
+        "requests_per_second": request_count / total_seconds,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "statuses": statuses,
+    }
+    logger.info(f"Load test of {base_url}: {report}")
+    return report
+
+
+if __name__ == "__main__":
+    arguments = [int(argument) for argument in sys.argv[1:3]]
+    print(json.dumps(run_load_test(*[BASE_URL, *arguments]), indent=2))
@@ -1,22 +1,44 @@
 import uuid
 import datetime
-import pickle
+import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
 import pytz
+import yaml
 
 from github_data import Repository, StarGazer
-from episode_data import Podcast, Episode, Reference
+from episode_data import Podcast, Episode, Reference, RepositoryRegistry
 import scrape_tptm as stptm
+import parallel_conversion
+import dataset
+import artifacts
 
 from loguru import logger
+from base import add_log_sink
 
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
-logger.add(f"logs/success_{_log_file_name}.log", rotation="1 day", level="SUCCESS")
-logger.add(f"logs/success.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success_{_log_file_name}.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+# Number of threads used to fetch the GitHub repositories of a podcast.
+REPOSITORY_FETCH_WORKERS = 8
+# Number of podcasts scraped and fetched at the same time.
+PODCAST_WORKERS = 4
+
+PODCASTS_CONFIG = os.getenv(
+    "LUTHER_PODCASTS_CONFIG",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "podcasts.yaml"),
+)
+REQUIRED_PODCAST_KEYS = ["name", "author", "url", "initial_start_date"]
+# Functions returning (cleaned episodes, pickled) for a podcast_info.
+EPISODE_SCRAPERS = {"talkpython": stptm.get_all_episodes}
+# Functions returning the cleaned episodes of a podcast_info which are not in
+# known_numbers, always scraped from the current episode list.
+NEW_EPISODE_SCRAPERS = {"talkpython": stptm.get_new_episodes}
 
 
 def get_timestamp():
@@ -119,14 +141,174 @@ def make_datetime2date(dt):
         return dt
 
 
+def get_podcast_row_data(podcast):
+    """Return the row fields shared by all rows of a podcast."""
+    return {
+        "podcast_name": podcast.name,
+        "podcast_start_date": podcast.initial_start_date,
+        "_manually_modified": podcast._manually_modified,
+    }
+
+
+def get_episode_row_data(episode, row_data):
+    row_data = row_data.copy()
+    row_data["_manually_modified"] = check_manually_modified(row_data, episode)
+    row_data["episode_number"] = episode.number
+    row_data["episode_title"] = episode.title
+    row_data["date_mentioned"] = episode.date_published
+    return row_data
+
+
+def get_repository_row_data(repository, row_data):
+    row_data = row_data.copy()
+    repository.date_created = make_datetime2date(repository.date_created)
+    repository._date_requested = make_datetime2date(repository._date_requested)
+    row_data["_manually_modified"] = check_manually_modified(row_data, repository)
+    row_data["repository_is_fork"] = repository.is_fork
+    row_data["repository_owner"] = repository.owner
+    row_data["repository_name"] = repository.name
+    row_data["date_requested"] = repository._date_requested  # .date()
+    try:
+        row_data["repository_primary_language"] = repository.primary_language["name"]
+    except (TypeError, AttributeError):
+        logger.warning(
+            f"Encountered NoneType for primary_language field in {repository}. Setting to np.nan."
+        )
+        row_data["repository_primary_language"] = np.nan
+    row_data["repository_url"] = repository.url
+    row_data["date_repository_created"] = repository.date_created
+    return row_data
+
+
+def create_date_mapping_between(first_date, today):
+    """Create one zero star count entry per day from first_date until today."""
+    date_mapping = []
+    for i in range((today - first_date).days, -1, -1):
+        date_mapping.append(
+            {
+                "date": today - datetime.timedelta(days=i),
+                "star_count_accu": 0,
+                "star_count_diff": 0,
+                "repository_exists": True,
+                "days_since_data_requested": -i,
+            }
+        )
+    return date_mapping
+
+
+def create_date_mapping(date_requested, date_created, podcast_start_date, today=None):
+    """Create one zero star count entry per day, ending today.
+
+    Expect one years worth of data before the first podcast was aired, for every
+    repository. Missing info is filled with zeros.
+    """
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+
+    days_since_repository_was_created = (date_requested - date_created).days
+    minimum_date_records = 365 + (date_requested - podcast_start_date).days
+    if days_since_repository_was_created < minimum_date_records:
+        days_since_repository_was_created = minimum_date_records
+
+    first_date = today - datetime.timedelta(days=days_since_repository_was_created - 1)
+    return create_date_mapping_between(first_date, today)
+
+
+def get_star_ordinals(stargazers):
+    """Return the sorted dates the stargazers starred the repository as ordinals."""
+    star_ordinals = np.array(
+        [stargazer.date_starred.toordinal() for stargazer in stargazers],
+        dtype=np.int32,
+    )
+    star_ordinals.sort()
+    return star_ordinals
+
+
+def get_repository_star_ordinals(repository):
+    """Return the star ordinals of repository, estimated if its stargazers are sampled.
+
+    See star_sampling.py.
+    """
+    if repository.is_sampled:
+        return repository.star_sample.star_ordinals
+    return get_star_ordinals(repository.stargazers)
+
+
+def count_star_ordinals_per_date(date_mapping, star_ordinals):
+    """Set the accumulated and daily star counts of every entry in date_mapping.
+
+    star_ordinals: Sorted array of date ordinals, see get_star_ordinals.
+    """
+    date_ordinals = np.array(
+        [date["date"].toordinal() for date in date_mapping], dtype=np.int32
+    )
+    star_count_accu = np.searchsorted(star_ordinals, date_ordinals, side="right")
+    star_count_diff = star_count_accu - np.searchsorted(
+        star_ordinals, date_ordinals, side="left"
+    )
+    for date, accu, diff in zip(
+        date_mapping, star_count_accu.tolist(), star_count_diff.tolist()
+    ):
+        date["star_count_accu"] += accu
+        date["star_count_diff"] += diff
+    return date_mapping
+
+
+def count_stars_per_date(date_mapping, stargazers):
+    return count_star_ordinals_per_date(date_mapping, get_star_ordinals(stargazers))
+
+
+def convert_date_mapping_to_luther_datarows(
+    date_mapping, row_data, date_created, prev_total_star_count=0
+):
+    luther_data_rows = []
+    for date in date_mapping:
+        if date["date"] < date_created:
+            date["repository_exists"] = False
+        try:
+            date["star_count_rel"] = date["star_count_diff"] / prev_total_star_count
+        except ZeroDivisionError:
+            date["star_count_rel"] = 0
+        luther_data_rows.append(LutherDataRow(**{**row_data, **date}))
+        prev_total_star_count = date["star_count_accu"]
+    return luther_data_rows
+
+
+def convert_repository_to_luther_datarows(repository, row_data, today=None):
+    """Create all rows of a single repository mention.
+
+    row_data: The podcast and episode fields, see get_episode_row_data.
+    """
+    row_data = get_repository_row_data(repository, row_data)
+    date_mapping = create_date_mapping(
+        repository._date_requested,
+        repository.date_created,
+        row_data["podcast_start_date"],
+        today=today,
+    )
+    logger.info(f"Created {len(date_mapping)} date entries for {repository}.")
+    count_star_ordinals_per_date(
+        date_mapping, get_repository_star_ordinals(repository)
+    )
+    logger.info(
+        f"Updated star_count for date entries. First: {date_mapping[0]}, Last: {date_mapping[-1]}."
+    )
+    return convert_date_mapping_to_luther_datarows(
+        date_mapping, row_data, repository.date_created
+    )
+
+
+def store_exportable_data_rows(podcast, luther_data_rows):
+    podcast.exportable_data_rows = luther_data_rows
+    podcast.pickle()
+    return podcast
+
+
 @logger.catch
-def convert_podcast_to_luther_datarows(podcast, rows=[]):
+def convert_podcast_to_luther_datarows(podcast, rows=None):
     """Convert/Flatten Data from its Hirarchical Structure to usable/flat rows.
 
-    WARNING: This monstrosity of a function should only be run with caution.
-    Due to too many for-loops this might take significant amounts of time.
-
-    This beeing said, the actual runtime for the current usecase was only roughly two minutes.
+    The actual runtime of the first implementation was roughly two minutes.
     This measurement was made for the following sizes:
         1 Podcast
         191 Episodes
@@ -139,110 +321,34 @@ def convert_podcast_to_luther_datarows(podcast, rows=[]):
 
     Run on JupyterNotebook with Python 3.6
 
-    # REFACTOR: Break this down into simpler and more efficient steps/function/s.
-
+    The star counts are now computed by binary search over the sorted star dates
+    instead of comparing every stargazer with every date.
+    To spread the conversion over multiple processes see parallel_conversion.py.
     """
 
+    if rows is None:
+        rows = []
     luther_data_rows = []
     start = time.time()
     logger.info(f"Converting podcast data into usable data_rows.")
-    row_data = {}
-    podcast_start_date = podcast.initial_start_date
-    row_data["podcast_name"] = podcast.name
-    row_data["podcast_start_date"] = podcast_start_date
-    row_data["_manually_modified"] = podcast._manually_modified
+    today = datetime.datetime.utcnow().date()
+    podcast_row_data = get_podcast_row_data(podcast)
     for episode in podcast.episodes:
-        row_data["_manually_modified"] = check_manually_modified(row_data, episode)
-        row_data["episode_number"] = episode.number
-        row_data["episode_title"] = episode.title
-        row_data["date_mentioned"] = episode.date_published
+        episode_row_data = get_episode_row_data(episode, podcast_row_data)
         for reference in episode.references:
-            row_data["_manually_modified"] = check_manually_modified(
-                row_data, reference
+            if reference.repository is None:
+                continue
+            repository_rows = convert_repository_to_luther_datarows(
+                reference.repository, episode_row_data, today=today
+            )
+            luther_data_rows += repository_rows
+            rows += [luther_data_row.values for luther_data_row in repository_rows]
+
+            logger.info(
+                f"Current Row Count is {len(rows)}, current execution time: {time.time() - start}"
             )
-            if reference.repository is not None:
-                repository = reference.repository
-                repository.date_created = make_datetime2date(repository.date_created)
-                repository._date_requested = make_datetime2date(
-                    repository._date_requested
-                )
-                row_data["_manually_modified"] = check_manually_modified(
-                    row_data, repository
-                )
-                row_data["repository_is_fork"] = repository.is_fork
-                row_data["repository_owner"] = repository.owner
-                row_data["repository_name"] = repository.name
-                row_data["date_requested"] = repository._date_requested  # .date()
-                try:
-                    row_data[
-                        "repository_primary_language"
-                    ] = repository.primary_language["name"]
-                except (TypeError, AttributeError):
-                    logger.warning(
-                        f"Encountered NoneType for primary_language field in {repository}. Setting to np.nan."
-                    )
-                    row_data["repository_primary_language"] = np.nan
-                row_data["repository_url"] = repository.url
-                row_data["date_repository_created"] = repository.date_created
-                date_mapping = []
-                days_since_repository_was_created = (
-                    repository._date_requested - repository.date_created
-                ).days
-                # Expect one years worth of data before the first podcast was aired, for every repository. Fill missing info with zeros.
-                minimum_date_records = (
-                    365 + (repository._date_requested - podcast_start_date).days
-                )
-                if days_since_repository_was_created < minimum_date_records:
-                    days_since_repository_was_created = minimum_date_records
-                for i in range(days_since_repository_was_created - 1, -1, -1):
-                    date_ = (
-                        datetime.datetime.utcnow() - datetime.timedelta(days=i)
-                    ).date()
-                    date_mapping.append(
-                        {
-                            "date": date_,
-                            "star_count_accu": 0,
-                            "star_count_diff": 0,
-                            "repository_exists": True,
-                            "days_since_data_requested": -i,
-                        }
-                    )
-                logger.info(
-                    f"Created {len(date_mapping)} date entries for {repository}."
-                )
-                for stargazer in repository.stargazers:
-                    # row_data['_manually_modified'] = check_manually_modified(row_data, stargazer)
-                    for date in date_mapping:
-                        if stargazer.date_starred <= date["date"]:
-                            date["star_count_accu"] += 1
-                        if stargazer.date_starred == date["date"]:
-                            date["star_count_diff"] += 1
-                logger.info(
-                    f"Updated star_count for date entries. First: {date_mapping[0]}, Last: {date_mapping[-1]}."
-                )
-                prev_total_star_count = 0
-                for date in date_mapping:
-
-                    if date["date"] < repository.date_created:
-                        date["repository_exists"] = False
-                    try:
-                        date["star_count_rel"] = (
-                            date["star_count_diff"] / prev_total_star_count
-                        )
-                    except ZeroDivisionError:
-                        date["star_count_rel"] = 0
-                    luther_data_row = LutherDataRow(**{**row_data, **date})
-                    # podcast.exportable_data_rows.append(luther_data_row)
-                    luther_data_rows.append(luther_data_row)
-                    rows.append(luther_data_row.values)
-                    prev_total_star_count = date["star_count_accu"]
-
-                logger.info(
-                    f"Current Row Count is {len(rows)}, current execution time: {time.time() - start}"
-                )
     columns = luther_data_rows[0].column_names
-    podcast.exportable_data_rows = luther_data_rows
-    podcast.pickle()
+    store_exportable_data_rows(podcast, luther_data_rows)
     logger.info(
         f"Finished converting data into data_rows. Total Row Count: {len(rows)}, Total Execution Time: {time.time() - start}."
     )
@@ -262,65 +368,107 @@ def convert_rows_to_dataframe(rows, columns, podcast, filename=None):
         filename = podcast.name.strip().lower().replace(" ", "_")
         filename = filename.replace("/", "_")
         filename = filename.replace(".", "_")
-        filename = "data/dataframe/" + filename + ".pk"
+        filename = artifacts.get_artifact_filename(filename)
 
-    with open(filename, "wb") as f:
-        pickle.dump(df, f)
-    logger.info(f"Pickled dataframe to {filename}.")
+    artifacts.write_dataframe(df, filename)
+    logger.info(f"Stored dataframe in {filename}.")
 
     logger.success(
         f"Finished converting {len(rows)} for {podcast.name} into pd.DataFrame."
     )
-    logger.success(f"Pickled dataframe to {filename}.")
+    logger.success(f"Stored dataframe in {filename}.")
 
     return df
 
 
-@logger.catch
-def get_multiple_podcasts():
-    logger.info(f"Get Data for multiple Podcasts")
-    tptm_podcast_info = {
-        "author": "Michael Kennedy",
-        "name": "Talk Python To Me",
-        "url": "https://talkpython.fm/episodes/all",
-        "initial_start_date": datetime.datetime(
-            2015, 3, 21, 12, 30, tzinfo=pytz.utc
-        ).date(),
-        "filename": "data/podcast_talk_python_to_me_data.pk",
-    }
+def get_podcast_filename(name):
+    name = name.strip().lower().replace(" ", "_")
+    return f"data/podcast_{name}_data.pk"
+
+
+def get_podcasts_info(config_filename=PODCASTS_CONFIG):
+    """Read the podcast definitions from the config file, see podcasts.yaml."""
+    with open(config_filename) as f:
+        config = yaml.safe_load(f)
+
+    podcasts_info = []
+    for podcast_info in config["podcasts"]:
+        missing_keys = [key for key in REQUIRED_PODCAST_KEYS if key not in podcast_info]
+        if missing_keys:
+            raise ValueError(
+                f"Podcast {podcast_info} in {config_filename} is missing {missing_keys}."
+            )
+        podcast_info.setdefault("source", "talkpython")
+        if (
+            podcast_info["source"] not in EPISODE_SCRAPERS
+            or podcast_info["source"] not in NEW_EPISODE_SCRAPERS
+        ):
+            raise ValueError(
+                f"Unknown source {podcast_info['source']} in {config_filename}, use one of {list(EPISODE_SCRAPERS)}."
+            )
+        podcast_info.setdefault("filename", get_podcast_filename(podcast_info["name"]))
+        if isinstance(podcast_info["initial_start_date"], str):
+            podcast_info["initial_start_date"] = datetime.date.fromisoformat(
+                podcast_info["initial_start_date"]
+            )
+        podcasts_info.append(podcast_info)
+
+    logger.info(f"Read {len(podcasts_info)} podcasts from {config_filename}.")
+    return podcasts_info
 
-    pb_podcast_info = {
-        "author": "Michael Kennedy, Brian Okken",
-        "name": "PythonBytes",
-        "url": "https://pythonbytes.fm/episodes/all",
-        "initial_start_date": datetime.datetime(
-            2016, 11, 5, 12, 30, tzinfo=pytz.utc
-        ).date(),
-        "filename": "data/podcast_python_bytes_data.pk",
-    }
-    podcasts_info = [tptm_podcast_info, pb_podcast_info]
-    podcasts = []
 
-    for podcast_info in podcasts_info:
-        podcast = get_podcast_data(podcast_info)
-        podcasts.append(podcast)
+@logger.catch
+def get_multiple_podcasts(
+    podcasts_info=None,
+    max_workers=PODCAST_WORKERS,
+    fetch_workers=REPOSITORY_FETCH_WORKERS,
+):
+    """Scrape and fetch max_workers podcasts at the same time.
+
+    All podcasts share a RepositoryRegistry, so a repository mentioned in multiple
+    podcasts is only fetched once.
+    """
+    logger.info(f"Get Data for multiple Podcasts")
+    if podcasts_info is None:
+        podcasts_info = get_podcasts_info()
+
+    registry = RepositoryRegistry()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        podcasts = list(
+            executor.map(
+                lambda podcast_info: get_podcast_data(
+                    podcast_info, max_workers=fetch_workers, registry=registry
+                ),
+                podcasts_info,
+            )
+        )
 
-    logger.success(f"Got multiple Podcasts.")
+    logger.success(f"Got multiple Podcasts, fetched {len(registry)} repositories.")
     return podcasts
 
 
 @logger.catch
-def get_podcast_data(podcast_info):
+def get_podcast_data(podcast_info, max_workers=REPOSITORY_FETCH_WORKERS, registry=None):
+    """Scrape all episodes of a podcast and build its object graph.
+
+    max_workers: Number of threads fetching the repositories once all Episodes and
+        References are created. Pass None to fetch every repository serially
+        while creating its Reference.
+    registry: Optional RepositoryRegistry shared with other podcasts.
+    """
     logger.info(f"Create Podcast instance for {podcast_info['name']} podacast.")
 
     # TODO: Get from pickle or create
     podcast = Podcast(**podcast_info)
 
     logger.info(f"Get all podcast episodes.")
-    raw_episode_data, pickled = stptm.get_all_episodes(podcast_info)
+    get_all_episodes = EPISODE_SCRAPERS[podcast_info.get("source", "talkpython")]
+    raw_episode_data, pickled = get_all_episodes(podcast_info)
 
     logger.info(f"Create and Append all Episode instances from raw episode data.")
-    podcast.append_raw_episodes(raw_episode_data)
+    podcast.append_raw_episodes(
+        raw_episode_data, max_workers=max_workers, registry=registry
+    )
 
     logger.info(f"Pickle the entire {podcast.name}")
     podcast.pickle()
@@ -343,47 +491,200 @@ def convert_podcast_to_pd_df(podcast):
     return df
 
 
+# Columns stored with compact dtypes after cleaning.
+INT32_COLUMNS = [
+    "star_count_accu",
+    "star_count_diff",
+    "episode_number",
+    "days_since_data_requested",
+    "days_since_creation",
+    "days_since_mention",
+    "days_since_podcast_start",
+    "dsm_off",
+]
+FLOAT32_COLUMNS = ["star_count_rel"]
+CATEGORY_COLUMNS = [
+    "podcast_name",
+    "episode_title",
+    "repository_url",
+    "repository_primary_language",
+    "repository_name",
+    "repository_owner",
+]
+
+
+def compact_dtypes(df):
+    """Downcast counts to int32/float32 and store string columns as categoricals.
+
+    Call again after concatenating cleaned DataFrames, pd.concat falls back to
+    object columns if the categories differ.
+    """
+    dtypes = {column: np.int32 for column in INT32_COLUMNS if column in df.columns}
+    dtypes.update(
+        {column: np.float32 for column in FLOAT32_COLUMNS if column in df.columns}
+    )
+    dtypes.update(
+        {column: "category" for column in CATEGORY_COLUMNS if column in df.columns}
+    )
+    df = df.astype(dtypes)
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].cat.remove_unused_categories()
+    return df
+
+
 @logger.catch
 def clean_df(df, days_premention=365, days_postmention=30):
+    """Keep the rows around each mention and add the fake_date column.
+
+    df: DataFrame or the path of a dataset written by dataset.py. Only the rows of
+        the mention window are read from the dataset.
+
+    Episodes aired within the last 31 days are excluded. The fake_date aligns all
+    mentions, the mention itself is at 2019-01-01. The input df is not modified.
+    """
     logger.info(f"Clean DataFrame")
-    clean_df = df
-    clean_df["date_mentioned"] = pd.to_datetime(clean_df["date_mentioned"])
-    exclude_new_episodes = clean_df[
-        "date_mentioned"
-    ] < datetime.datetime.utcnow() - datetime.timedelta(days=31)
-    clean_df = clean_df[exclude_new_episodes]
-    time_frame = (clean_df["days_since_mention"] > -(days_premention + 1)) & (
-        clean_df["days_since_mention"] < days_postmention + 1
+    if isinstance(df, str):
+        df = dataset.read_dataset(
+            df,
+            filters=dataset.get_mention_window_filters(
+                days_premention, days_postmention
+            ),
+        )
+    date_mentioned = pd.to_datetime(df["date_mentioned"])
+    days_since_mention = df["days_since_mention"]
+    keep = (
+        (date_mentioned < datetime.datetime.utcnow() - datetime.timedelta(days=31))
+        & (days_since_mention > -(days_premention + 1))
+        & (days_since_mention < days_postmention + 1)
+    )
+
+    clean_df = df.loc[keep]
+    dsm_off = clean_df["days_since_mention"].to_numpy() + days_premention
+    fake_date_start = pd.Timestamp(
+        datetime.date(2019, 1, 1) - datetime.timedelta(days=days_premention)
     )
-    clean_df = df[time_frame]
-    clean_df["dsm_off"] = clean_df["days_since_mention"] + days_premention
-    clean_df["fake_date"] = pd.to_datetime(
-        datetime.datetime(2019, 1, 1, 12, 30) - datetime.timedelta(days=days_premention)
-    ).date()
-    clean_df["fake_date"] = clean_df["fake_date"] + clean_df["dsm_off"].apply(
-        pd.offsets.Day
+    clean_df = clean_df.assign(
+        date_mentioned=date_mentioned[keep],
+        dsm_off=dsm_off,
+        fake_date=fake_date_start + pd.to_timedelta(dsm_off, unit="D"),
     )
-    clean_df = pd.concat(
-        [clean_df, pd.get_dummies(clean_df["repository_primary_language"])], axis=1
+    clean_df = compact_dtypes(clean_df)
+
+    dummies = pd.get_dummies(
+        clean_df["repository_primary_language"], sparse=True, dtype=np.uint8
     )
+    clean_df = pd.concat([clean_df, dummies], axis=1)
     logger.success(f"Cleaned DataFrame.")
     return clean_df
 
 
+def sort_for_partitioning(clean_df):
+    """Sort by podcast and episode, so every episode is a contiguous block of rows."""
+    return clean_df.sort_values(["podcast_name", "episode_number"], kind="mergesort")
+
+
+def get_episode_bounds(sorted_df):
+    """Find the row ranges of every podcast and episode by binary search.
+
+    sorted_df: See sort_for_partitioning.
+
+    return: List of (podcast_name, episodes, episode_starts, stop) for every podcast.
+        episodes are the sorted episode numbers of the podcast, episode_starts the
+        position of the first row of each episode and stop the position after the
+        last row of the podcast.
+    """
+    podcast_codes = pd.factorize(sorted_df["podcast_name"], sort=False)[0]
+    episode_numbers = sorted_df["episode_number"].to_numpy()
+    podcast_starts = np.flatnonzero(np.diff(podcast_codes)) + 1
+    podcast_starts = np.concatenate([[0], podcast_starts])
+    podcast_stops = np.concatenate([podcast_starts[1:], [len(sorted_df)]])
+
+    bounds = []
+    for start, stop in zip(podcast_starts, podcast_stops):
+        podcast_episode_numbers = episode_numbers[start:stop]
+        episodes = np.unique(podcast_episode_numbers)
+        episode_starts = start + np.searchsorted(
+            podcast_episode_numbers, episodes, side="left"
+        )
+        podcast_name = sorted_df["podcast_name"].iat[start]
+        bounds.append((podcast_name, episodes, episode_starts, stop))
+    return bounds
+
+
+def concat_slices(slices):
+    if len(slices) == 1:
+        return slices[0]
+    return pd.concat(slices)
+
+
+@logger.catch
+def rolling_origin_folds(clean_df, n_folds=5, test_share=0.20, validation_share=0.20):
+    """Create training/validation folds for time-series cross-validation.
+
+    The most recent test_share of the episodes of every podcast is held out as in
+    partition_timeseries_podcast_data. The validation window covers validation_share
+    of the episodes and is moved back n_folds times from the test data. Each fold
+    trains on all episodes before its validation window (expanding window), the last
+    fold is the same as the fixed 60/20/20 partition.
+
+    The data is sorted once, all folds are slices of the sorted data. For a single
+    podcast these slices are views, no data is copied.
+
+    return: List of (training, validation), oldest fold first.
+    """
+    logger.info(f"Create {n_folds} rolling origin folds.")
+    sorted_df = sort_for_partitioning(clean_df)
+    folds = [([], []) for _ in range(n_folds)]
+    for podcast_name, episodes, episode_starts, stop in get_episode_bounds(sorted_df):
+        episode_count = len(episodes)
+        test_cutoff = int(episode_count * test_share)
+        window = int(episode_count * validation_share)
+        first_origin = episode_count - test_cutoff - n_folds * window
+        if window == 0 or first_origin < 1:
+            logger.warning(
+                f"Not enough episodes ({episode_count}) for {n_folds} folds of {podcast_name}."
+            )
+            continue
+
+        for fold, (training_slices, validation_slices) in enumerate(folds):
+            origin = first_origin + fold * window
+            training_slices.append(
+                sorted_df.iloc[episode_starts[0] : episode_starts[origin]]
+            )
+            validation_slices.append(
+                sorted_df.iloc[episode_starts[origin] : episode_starts[origin + window]]
+            )
+
+    logger.success(f"Created {n_folds} rolling origin folds.")
+    return [
+        (concat_slices(training_slices), concat_slices(validation_slices))
+        for training_slices, validation_slices in folds
+        if training_slices
+    ]
+
+
 @logger.catch
-def partition_timeseries_podcast_data(clean_df, filename_prefix=""):
+def partition_timeseries_podcast_data(
+    clean_df, filename_prefix="", columns=None, store=True
+):
     """Seperate the dataframe into three groups, Test, Validation and Training.
 
-        clean_df: input a complete and clean dataframe.
+        clean_df: input a complete and clean dataframe, or the path of a dataset
+            written by dataset.py.
+        columns: Only read these columns from the dataset. Must contain podcast_name
+            and episode_number.
+        store: Write the partitions as artifacts, a long running process which
+            partitions repeatedly should pass False.
 
         return training_df, validation_df
 
-        1. Test Data -> New DF pickled and NOT returned.
-        2. Validation Data -> New DF, pickled and returned.
-        3. Training Data -> New DF, pickled and returned.
+        1. Test Data -> New DF stored and NOT returned.
+        2. Validation Data -> New DF, stored and returned.
+        3. Training Data -> New DF, stored and returned.
 
-        The pickled dataframes will be stored in the data/dataframe 
-        directory.
+        The dataframes will be stored as Parquet files in the data/dataframe
+        directory, see artifacts.py.
 
         NOTE: Since this is the final step, clean and complete data is assumed as input.
 
@@ -394,90 +695,101 @@ def partition_timeseries_podcast_data(clean_df, filename_prefix=""):
 
         We partition by taking these percentages of episodes (with mentioned GH Repositories) for every podcast and concatinate
         the resulting dfs.
+
+        The data is sorted once by podcast and episode, the partitions are found by
+        binary search on the episode numbers, see get_episode_bounds.
+        For time-series cross-validation see rolling_origin_folds.
         """
+    if isinstance(clean_df, str):
+        clean_df = dataset.read_dataset(clean_df, columns=columns)
+
     test_dfs = []
     validation_dfs = []
     training_dfs = []
     logger.info(f"Start Partition Timeseries for Podcast Data")
-    podcast_names = clean_df.podcast_name.unique()
-    for podcast_name in podcast_names:
+    sorted_df = sort_for_partitioning(clean_df)
+    for podcast_name, episodes, episode_starts, stop in get_episode_bounds(sorted_df):
         logger.info(f"Partition data for Podcast: {podcast_name}.")
-        podcast_df = clean_df[clean_df["podcast_name"] == podcast_name]
-        episodes = sorted(clean_df["episode_number"].unique())
         episode_count = len(episodes)
         episode_cutoff = int(episode_count * 0.20)
         logger.debug(f"EP Count: {episode_count}, EP Cutoff: {episode_cutoff}")
+        if episode_cutoff == 0:
+            logger.warning(f"Not enough episodes to partition {podcast_name}.")
+            continue
 
-        first_test_ep = sorted(episodes[-episode_cutoff:])[0]
-        validation_episodes = sorted(episodes[-(2 * episode_cutoff) : -episode_cutoff])
-        first_validation_ep, last_validation_ep = (
-            validation_episodes[0],
-            validation_episodes[-1],
-        )
-        last_training_ep = sorted(episodes[: -(2 * episode_cutoff)])[-1]
+        first_test_idx = episode_count - episode_cutoff
+        first_validation_idx = episode_count - 2 * episode_cutoff
         # Get the most recent 20% of episodes for the test data
-        logger.info(f"First Test Episode is: {first_test_ep}.")
-        test_dfs.append(podcast_df[podcast_df["episode_number"] >= first_test_ep])
+        logger.info(f"First Test Episode is: {episodes[first_test_idx]}.")
+        test_dfs.append(sorted_df.iloc[episode_starts[first_test_idx] : stop])
         logger.info(
-            f"Validation Episodes are, First: {first_validation_ep}, Last: {last_validation_ep}."
+            f"Validation Episodes are, First: {episodes[first_validation_idx]}, Last: {episodes[first_test_idx - 1]}."
         )
         validation_dfs.append(
-            podcast_df[
-                (podcast_df["episode_number"] >= first_validation_ep)
-                & (podcast_df["episode_number"] <= last_validation_ep)
+            sorted_df.iloc[
+                episode_starts[first_validation_idx] : episode_starts[first_test_idx]
             ]
         )
-        logger.info(f"Last Training Episode: {last_training_ep}.")
+        logger.info(f"Last Training Episode: {episodes[first_validation_idx - 1]}.")
         training_dfs.append(
-            podcast_df[(podcast_df["episode_number"] <= last_training_ep)]
+            sorted_df.iloc[episode_starts[0] : episode_starts[first_validation_idx]]
         )
 
     test = pd.concat(test_dfs)
     validation = pd.concat(validation_dfs)
     training = pd.concat(training_dfs)
+    if not store:
+        return training, validation
 
     timestamp = get_timestamp()
 
-    test_filename = "data/dataframe/_" + filename_prefix + "_TEST_" + timestamp + ".pk"
-    validation_filename = (
-        "data/dataframe/" + filename_prefix + "_VALIDATION_" + timestamp + ".pk"
+    test_filename = artifacts.get_artifact_filename(
+        "_" + filename_prefix + "_TEST_" + timestamp
     )
-    training_filename = (
-        "data/dataframe/" + filename_prefix + "_training_" + timestamp + ".pk"
+    validation_filename = artifacts.get_artifact_filename(
+        filename_prefix + "_VALIDATION_" + timestamp
+    )
+    training_filename = artifacts.get_artifact_filename(
+        filename_prefix + "_training_" + timestamp
     )
 
-    with open(test_filename, "wb") as f:
-        pickle.dump(test, f)
-        logger.success(f"Pickled test_df to {test_filename}.")
+    artifacts.write_dataframe(test, test_filename)
+    logger.success(f"Stored test_df in {test_filename}.")
 
-    with open(validation_filename, "wb") as f:
-        pickle.dump(validation, f)
-        logger.success(f"Pickled validation_df to {validation_filename}.")
+    artifacts.write_dataframe(validation, validation_filename)
+    logger.success(f"Stored validation_df in {validation_filename}.")
 
-    with open(training_filename, "wb") as f:
-        pickle.dump(training, f)
-        logger.success(f"Pickled validation_df to {training_filename}.")
+    artifacts.write_dataframe(training, training_filename)
+    logger.success(f"Stored training_df in {training_filename}.")
 
     return training, validation
 
 
 @logger.catch
-def run_all():
+def run_all(parallel=False):
+    """Get, convert, clean and partition the data of all podcasts.
+
+    parallel: Convert all podcasts on a process pool, see parallel_conversion.py.
+    """
     logger.info(f"Run All")
 
     podcasts = get_multiple_podcasts()
 
+    if parallel:
+        dfs = parallel_conversion.convert_podcasts_to_pd_dfs_parallel(podcasts)
+    else:
+        dfs = [convert_podcast_to_pd_df(podcast) for podcast in podcasts]
+
     clean_dfs = []
-    for podcast in podcasts:
-        df = convert_podcast_to_pd_df(podcast)
+    for df in dfs:
         clean_dfs.append(clean_df(df, days_premention=366))
 
-    clean = pd.concat(clean_dfs)
+    clean = compact_dtypes(pd.concat(clean_dfs))
 
-    with open(
-        "data/dataframe/clean_data_frame_run_all_" + get_timestamp() + ".pk", "wb"
-    ) as f:
-        pickle.dump(clean, f)
+    artifacts.write_dataframe(
+        clean,
+        artifacts.get_artifact_filename("clean_data_frame_run_all_" + get_timestamp()),
+    )
 
     training, validation = partition_timeseries_podcast_data(clean)
 
@@ -1,21 +1,28 @@
 import luther
 import modeling
+import pipeline
 
 from loguru import logger
+from base import add_log_sink, add_log_level
 
 
-logger.level("RESULTS", no=40, color="<green>")
+add_log_level("RESULTS", no=40, color="<green>")
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
-logger.add(f"logs/success_{_log_file_name}.log", level="SUCCESS")
-logger.add(f"logs/success.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success_{_log_file_name}.log", level="SUCCESS")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
 
 
-def main():
+def main(pipelined=False):
     """Run the entire pipeline.
+
+    pipelined: Scrape, fetch and convert concurrently, see pipeline.py.
     """
     logger.info(f"Starting the Pipeline")
-    training, validation = luther.run_all()
+    if pipelined:
+        training, validation = pipeline.run_all_pipelined()
+    else:
+        training, validation = luther.run_all()
     logger.success(f"Finished Getting Data")
     logger.info(f"Start Modeling and Validating")
     modeling.validate_all(training, validation)
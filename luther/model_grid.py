@@ -0,0 +1,150 @@
+"""Fit and validate the AR models of a (column, lag, fold) grid on a process pool.
+
+modeling.validate_all fits and validates one column and lag after the other on a
+single training/validation split. Here every combination of column name and fold
+(see luther.rolling_origin_folds) is one task, which fits all lags at once and
+validates every lag.
+
+The training and validation data are grouped by fake_date once per fold and column
+in the main process and handed to every worker process once, the tasks only carry
+their (column, fold) key and are sent to the workers in chunks. Results are
+collected in task order, so they do not depend on the number of workers.
+
+All lags are fitted like modeling.ar_model_fitting with max_ar, so the results are
+the same as the ones of the serial pipeline.
+"""
+
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+import luther
+import modeling
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+MAX_WORKERS = os.cpu_count()
+VALIDATION_RESULT_DIR = "data/validation_result"
+
+# {(fold, column_name): (prepared training, prepared validation)}, set in every
+# worker process.
+_PREPARED = None
+
+
+def _init_worker(prepared):
+    global _PREPARED
+    _PREPARED = prepared
+
+
+def validate_grid_task(task):
+    """Fit all AR models of a column on a fold and validate every lag.
+
+    return: List of (lag, betas, const, rmse, calculations) for every lag in
+        1..max_ar, see modeling.predict_ar_model.
+    """
+    column_name, fold, max_ar, method = task
+    prep_training, prep_validation = _PREPARED[(fold, column_name)]
+    return [
+        modeling.predict_ar_model(ar_model, prep_validation)
+        for ar_model in modeling.ar_model_fitting(
+            prep_training, column_name, max_ar=max_ar, method=method
+        )
+    ]
+
+
+def prepare_folds(folds, column_names):
+    prepared = {}
+    for fold, (training, validation) in enumerate(folds):
+        prep_training = modeling.prepare_columns_for_modeling(training, column_names)
+        prep_validation = modeling.prepare_columns_for_modeling(
+            validation, column_names
+        )
+        for column_name in column_names:
+            prepared[(fold, column_name)] = (
+                prep_training[column_name],
+                prep_validation[column_name],
+            )
+    return prepared
+
+
+def create_grid_tasks(fold_count, column_names, max_ar, method):
+    return [
+        (column_name, fold, max_ar, method)
+        for fold in range(fold_count)
+        for column_name in column_names
+    ]
+
+
+def get_chunksize(task_count, max_workers):
+    """Send about four chunks of tasks to every worker."""
+    return max(1, task_count // (4 * (max_workers or 1)))
+
+
+def store_grid_results(grid_results, timestamp):
+    os.makedirs(VALIDATION_RESULT_DIR, exist_ok=True)
+    for fold, fold_results in enumerate(grid_results):
+        for column_name, overall_ar_results in fold_results.items():
+            filename = os.path.join(
+                VALIDATION_RESULT_DIR,
+                f"ar_model_validation_{column_name}_fold{fold}_{timestamp}.pk",
+            )
+            with open(filename, "wb") as f:
+                pickle.dump(overall_ar_results, f)
+            logger.info(f"Pickled AR Validation Results of fold {fold} to {filename}")
+
+
+@logger.catch
+def validate_grid(
+    folds,
+    column_names=("star_count_diff", "star_count_rel"),
+    max_ar=5,
+    method="ols",
+    max_workers=MAX_WORKERS,
+):
+    """Fit and validate all lags of every column on every fold in parallel.
+
+    folds: List of (training, validation) DataFrames, e.g. from
+        luther.rolling_origin_folds or [luther.partition_timeseries_podcast_data(...)].
+
+    return: List with a dict {column_name: overall_ar_results} per fold.
+        overall_ar_results has the same shape as in modeling.ar_model_validation
+        and is pickled to data/validation_result/ for every fold and column.
+    """
+    start = time.time()
+    column_names = list(column_names)
+    prepared = prepare_folds(folds, column_names)
+    tasks = create_grid_tasks(len(folds), column_names, max_ar, method)
+    logger.info(
+        f"Validate {len(tasks)} (column, fold) combinations with max_ar {max_ar} on {max_workers} processes."
+    )
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(prepared,)
+    ) as executor:
+        results = list(
+            executor.map(
+                validate_grid_task,
+                tasks,
+                chunksize=get_chunksize(len(tasks), max_workers),
+            )
+        )
+
+    grid_results = [{} for _ in folds]
+    for (column_name, fold, _, _), overall_ar_results in zip(tasks, results):
+        grid_results[fold][column_name] = overall_ar_results
+        for lag, _, _, rmse, _ in overall_ar_results:
+            logger.log(
+                "RESULTS", f"AR({lag}) - fold {fold} - {column_name} - RMSE: {rmse}"
+            )
+
+    store_grid_results(grid_results, luther.get_timestamp())
+    logger.success(
+        f"Validated {len(tasks) * max_ar} (column, lag, fold) combinations in {time.time() - start}s."
+    )
+    return grid_results
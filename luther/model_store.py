@@ -0,0 +1,294 @@
+"""Store fitted models and validation results keyed by a hash of their inputs.
+
+The key of an entry is a hash of
+
+    - the prepared series (index and "mean" of modeling.prepare_df_for_modeling),
+    - the column name,
+    - the model spec, e.g. {"max_ar": 5, "method": "ols"}, and STORE_VERSION.
+
+So an entry is only used again if the training data, the column and the spec are
+unchanged. Every entry is pickled to data/model_store/<key>.pk, index.json lists
+the entries with their size, creation and last use.
+
+Several processes can share a store. save merges the own changes into the index on
+disk while holding a lock on index.json.lock, so no process drops the entries of
+another one. The last uses of get are only kept in memory and saved with the next
+put, evict or save, or after SAVE_INTERVAL seconds.
+
+    store = ModelStore.load()
+    ar_models = store.get_or_create(
+        store.get_key(prep_training, column_name, spec), fit, kind="fit"
+    )
+    store.evict()
+
+evict removes the entries not used for max_age_days and then the least recently
+used ones until the store is smaller than max_bytes. It also removes pickles which
+are not in the index anymore.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+from loguru import logger
+
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+
+MODEL_STORE_DIR = "data/model_store"
+INDEX_FILENAME = "index.json"
+LOCK_FILENAME = "index.json.lock"
+# Increase when the fitting or validation changes, to invalidate stored entries.
+STORE_VERSION = 2
+MAX_AGE_DAYS = float(os.getenv("LUTHER_MODEL_STORE_MAX_AGE_DAYS", default=30))
+MAX_BYTES = int(float(os.getenv("LUTHER_MODEL_STORE_MAX_MB", default=256)) * 2 ** 20)
+# Seconds between the saves of the last uses of get.
+SAVE_INTERVAL = float(os.getenv("LUTHER_MODEL_STORE_SAVE_INTERVAL", default=60))
+# Pickles without an index entry are only removed after this many seconds, a put of
+# another process may not have saved its entry yet.
+ORPHAN_GRACE_SECONDS = 3600
+
+
+def get_series_fingerprint(prepared):
+    """Hash of the index and the "mean" values of a prepared series."""
+    digest = hashlib.sha256()
+    digest.update(np.asarray(prepared.index.asi8, dtype=np.int64).tobytes())
+    digest.update(prepared["mean"].to_numpy(dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def read_index(store_dir):
+    try:
+        with open(os.path.join(store_dir, INDEX_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def merge_index(disk_index, added, used, removed):
+    """Apply the changes of a process to the index on disk.
+
+    added: {key: entry info} put by the process, replace older entries.
+    used: {key: last use} of get, only for entries still in the index.
+    removed: {key: removal time}, entries put again later are kept.
+    """
+    merged = dict(disk_index)
+    for key, info in added.items():
+        if key not in merged or merged[key]["created"] <= info["created"]:
+            merged[key] = dict(info)
+    for key, last_used in used.items():
+        if key in merged:
+            merged[key] = {
+                **merged[key],
+                "last_used": max(merged[key]["last_used"], last_used),
+            }
+    for key, removed_at in removed.items():
+        if key in merged and merged[key]["created"] <= removed_at:
+            del merged[key]
+    return merged
+
+
+class ModelStore:
+    def __init__(self, index=None, store_dir=MODEL_STORE_DIR):
+        """Hold the index {key: entry info} of the pickled entries in store_dir."""
+        self.index = {} if index is None else index
+        self.store_dir = store_dir
+        # Changes since the last save, see merge_index.
+        self.added = {}
+        self.used = {}
+        self.removed = {}
+        self.last_save = time.time()
+
+    def __repr__(self):
+        return f"ModelStore(entry_count={len(self)}, store_dir={self.store_dir})"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @classmethod
+    def load(cls, store_dir=MODEL_STORE_DIR):
+        return cls(read_index(store_dir), store_dir)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold the lock of the index, other processes wait in save and evict."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(os.path.join(self.store_dir, LOCK_FILENAME), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save(self):
+        """Merge and write the index, the lock has to be held."""
+        self.index = merge_index(
+            read_index(self.store_dir), self.added, self.used, self.removed
+        )
+        filename = os.path.join(self.store_dir, INDEX_FILENAME)
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=2, sort_keys=True)
+        os.replace(filename + ".tmp", filename)
+        self.added = {}
+        self.used = {}
+        self.removed = {}
+        self.last_save = time.time()
+
+    def save(self):
+        """Merge the own changes into the index on disk and reload it."""
+        with self.lock():
+            self._save()
+        return self
+
+    def get_filename(self, key):
+        return os.path.join(self.store_dir, key + ".pk")
+
+    @staticmethod
+    def get_key(prepared, column_name, spec):
+        """Hash of the prepared series, the column name and the model spec."""
+        content = {
+            "series": get_series_fingerprint(prepared),
+            "column_name": column_name,
+            "spec": spec,
+            "version": STORE_VERSION,
+        }
+        content = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the stored value of key, None if it is not stored.
+
+        The last use is saved with the next put, evict or save, at the latest after
+        SAVE_INTERVAL seconds. So reading processes keep their entries from being
+        evicted as well, without writing the index on every read.
+        """
+        if key not in self.index:
+            return None
+        try:
+            with open(self.get_filename(key), "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            logger.warning(f"Entry {key} is missing in {self.store_dir}, drop it.")
+            self.remove(key)
+            return None
+        now = datetime.datetime.utcnow().isoformat()
+        self.index[key]["last_used"] = now
+        self.used[key] = now
+        if SAVE_INTERVAL <= time.time() - self.last_save:
+            self.save()
+        return value
+
+    def put(self, key, value, **info):
+        """Pickle value and add it to the index with info, e.g. kind="fit".
+
+        None can not be stored, get returns None for missing entries.
+        """
+        if value is None:
+            raise ValueError(f"Can not store None for {info} in {self}.")
+        os.makedirs(self.store_dir, exist_ok=True)
+        filename = self.get_filename(key)
+        with open(filename + ".tmp", "wb") as f:
+            pickle.dump(value, f)
+        os.replace(filename + ".tmp", filename)
+        now = datetime.datetime.utcnow().isoformat()
+        self.index[key] = {
+            **info,
+            "size": os.path.getsize(filename),
+            "created": now,
+            "last_used": now,
+        }
+        self.added[key] = self.index[key]
+        self.removed.pop(key, None)
+        self.save()
+        return value
+
+    def get_or_create(self, key, create, **info):
+        """Return the stored value of key or store and return create().
+
+        A failed create (e.g. a function wrapped in logger.catch) returns None, which
+        is returned without storing it.
+        """
+        value = self.get(key)
+        if value is not None:
+            logger.info(f"Loaded {info} from the model store.")
+            return value
+        value = create()
+        if value is None:
+            logger.warning(f"Creating {info} returned None, it is not stored.")
+            return None
+        return self.put(key, value, **info)
+
+    def remove(self, key):
+        """Remove the entry of key, the index is changed on disk by the next save."""
+        self.index.pop(key, None)
+        self.added.pop(key, None)
+        self.used.pop(key, None)
+        self.removed[key] = datetime.datetime.utcnow().isoformat()
+        try:
+            os.remove(self.get_filename(key))
+        except FileNotFoundError:
+            pass
+
+    def remove_orphans(self):
+        """Remove the pickles without an entry in the index, the lock has to be held.
+
+        return: Number of removed pickles.
+        """
+        oldest = time.time() - ORPHAN_GRACE_SECONDS
+        removed_count = 0
+        for filename in glob.glob(os.path.join(self.store_dir, "*.pk")):
+            key = os.path.basename(filename)[: -len(".pk")]
+            if key not in self.index and os.path.getmtime(filename) < oldest:
+                os.remove(filename)
+                removed_count += 1
+        return removed_count
+
+    def evict(self, max_age_days=MAX_AGE_DAYS, max_bytes=MAX_BYTES):
+        """Remove old entries, then the least recently used ones above max_bytes.
+
+        The entries of all processes sharing the store are considered.
+
+        return: Number of removed entries.
+        """
+        with self.lock():
+            self._save()
+            removed_count = self._evict(max_age_days, max_bytes)
+            self._save()
+            orphan_count = self.remove_orphans()
+        if removed_count or orphan_count:
+            logger.info(
+                f"Evicted {removed_count} entries and {orphan_count} orphaned pickles from {self}."
+            )
+        return removed_count
+
+    def _evict(self, max_age_days, max_bytes):
+        oldest = datetime.datetime.utcnow() - datetime.timedelta(days=max_age_days)
+        by_last_use = sorted(self.index, key=lambda key: self.index[key]["last_used"])
+        removed_keys = [
+            key
+            for key in by_last_use
+            if datetime.datetime.fromisoformat(self.index[key]["last_used"]) < oldest
+        ]
+        remaining_keys = [key for key in by_last_use if key not in removed_keys]
+        total_bytes = sum(self.index[key]["size"] for key in remaining_keys)
+        for key in remaining_keys:
+            if total_bytes <= max_bytes:
+                break
+            total_bytes -= self.index[key]["size"]
+            removed_keys.append(key)
+
+        for key in removed_keys:
+            self.remove(key)
+        return len(removed_keys)
@@ -8,27 +8,46 @@ to this implementation.
 The results and the analysis of the results can be done using the results_*.log log-file.
 """
 import luther
+import artifacts
 import numpy as np
 import pandas as pd
 from loguru import logger
+from base import add_log_sink, add_log_level
 import datetime
 import pickle
 
-import statsmodels.api as sm
-import statsmodels.tsa.stattools as ts
+import ar_engine
+import features
+import model_store
+import order_selection
+import streaming_stats
 
-logger.level("RESULTS", no=40, color="<green>")
+add_log_level("RESULTS", no=40, color="<green>")
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
-logger.add(f"logs/success_{_log_file_name}.log", level="SUCCESS")
-logger.add(f"logs/results_{_log_file_name}.log", level="RESULTS")
-logger.add(f"logs/success.log", rotation="1 day", level="SUCCESS")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success_{_log_file_name}.log", level="SUCCESS")
+add_log_sink(f"logs/results_{_log_file_name}.log", level="RESULTS")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+
+def get_chunks(data, columns):
+    """Return data as an iterable of DataFrames.
+
+    data: DataFrame, the filename of a stored DataFrame (read in chunks, only the
+        given columns, see artifacts.py) or an iterable of DataFrames.
+    """
+    if isinstance(data, pd.DataFrame):
+        return [data]
+    if isinstance(data, str):
+        return artifacts.iter_dataframe_chunks(data, columns=columns)
+    return data
 
 
 @logger.catch
-def prepare_df_for_modeling(df, column_name="star_count_rel"):
-    """Group data by the fake_date column and return multiple aggregate
-    functions for column_name.
+def prepare_columns_for_modeling(
+    data, column_names=("star_count_diff", "star_count_rel")
+):
+    """Group data by the fake_date column and aggregate all column_names in one pass.
 
     Aggregate functions:
         - mean
@@ -37,41 +56,100 @@ def prepare_df_for_modeling(df, column_name="star_count_rel"):
         - min/max
         - sum
 
-    return: GroupedDataFrame
+    data: DataFrame, filename or iterable of DataFrames, see get_chunks. The chunks
+        are aggregated one after another with mergeable statistics, see
+        streaming_stats.py.
+
+    return: {column_name: DataFrame of the aggregates indexed by fake_date}
     """
-    logger.info(f"Prepare DataFrame for modeling on column {column_name}.")
-    group = df.groupby(["fake_date"])
-    grouped_df = group.agg({column_name: ["mean", "std", "count", "min", "max", "sum"]})
+    column_names = list(column_names)
+    logger.info(f"Prepare data for modeling on columns {column_names}.")
+    group_statistics = streaming_stats.aggregate_chunks(
+        get_chunks(data, ["fake_date"] + column_names), column_names
+    )
+    prepared = {}
+    for column_name in column_names:
+        grouped = group_statistics.to_frame(column_name)
+        grouped.index = pd.to_datetime(grouped.index)
+        prepared[column_name] = grouped
 
-    logger.success(f"Finished prepare_df_for_modeling for {column_name}.")
-    grouped = grouped_df[column_name]
-    grouped.index = pd.to_datetime(grouped.index)
-    return grouped
+    logger.success(f"Finished prepare_columns_for_modeling for {column_names}.")
+    return prepared
 
 
 @logger.catch
-def fit_arma_model(lag, dataframe, q=0):
-    ar = sm.tsa.ARMA(dataframe["mean"], dates=dataframe.index, freq="D", order=(lag, q))
-    ar_fit = ar.fit()
-    return ar_fit
+def prepare_df_for_modeling(df, column_name="star_count_rel"):
+    """Group data by the fake_date column and return multiple aggregate
+    functions for column_name.
+
+    Prefer prepare_columns_for_modeling to prepare several columns in one pass.
+
+    df: DataFrame, filename or iterable of DataFrames, see get_chunks.
+
+    return: GroupedDataFrame
+    """
+    return prepare_columns_for_modeling(df, [column_name])[column_name]
 
 
 @logger.catch
-def ar_model_fitting(training, column_name, max_ar=5):
-    """Test max_ar no. of lags for an AR model."""
-    ar_models = []
-    for lag in range(1, max_ar + 1):
+def ar_model_fitting(training, column_name, max_ar=5, method="ols"):
+    """Test max_ar no. of lags for an AR model.
 
-        ar_fit = fit_arma_model(lag, training)
+    All lags are fitted at once on training["mean"]. method "ols" fits the
+    get_ar_spec(lag) columns of the FeatureMatrix of training (see features.py),
+    "yule_walker" uses ar_engine.py.
+    """
+    if method == "ols":
+        feature_matrix = features.get_feature_matrix(
+            {column_name: training},
+            column_name,
+            max_lag=max_ar,
+            windows=[],
+            exogenous=[],
+        )
+        ar_fits = features.fit_ar_models(feature_matrix, max_ar)
+    else:
+        ar_fits = ar_engine.fit_ar_models(
+            training["mean"], max_ar=max_ar, method=method
+        )
 
-        betas = [ar_fit.params[k] for k in range(1, lag + 1)]
-        const = ar_fit.params[0]
+    ar_models = []
+    for lag, betas, const in ar_fits:
         ar_models.append((lag, betas, const, column_name))
 
     logger.success(f"Finished ar_model_fitting for {column_name}.")
     return ar_models
 
 
+@logger.catch
+def ar_order_selection(training, column_name, max_ar=10, max_ma=0, criterion="bic"):
+    """Select the AR(p) or ARMA(p, q) order of training["mean"] by AIC or BIC.
+
+    See order_selection.py, the higher orders are pruned once the criterion stops
+    improving.
+
+    return: (selected, table), selected as (lag, betas, const, column_name) like in
+        ar_model_fitting if its q is 0, the dict of order_selection.select_order
+        otherwise. table ranks all fitted candidates.
+    """
+    selected, table = order_selection.select_order(
+        training["mean"], max_ar=max_ar, max_ma=max_ma, criterion=criterion
+    )
+    logger.log(
+        "RESULTS",
+        f"Selected ARMA({selected['p']}, {selected['q']}) by {criterion} for {column_name}:\n{table[['p', 'q', 'aic', 'bic']].to_string()}",
+    )
+    if selected["q"] == 0:
+        selected = (
+            int(selected["p"]),
+            selected["ar_betas"],
+            selected["const"],
+            column_name,
+        )
+    logger.success(f"Finished ar_order_selection for {column_name}.")
+    return selected, table
+
+
 @logger.catch
 def predict_lin_reg(betas, const, xs):
     """Calculate y_predict"""
@@ -82,27 +160,34 @@ def predict_lin_reg(betas, const, xs):
 @logger.catch
 def predict_ar_model(ar_model, dataframe):
     """Given an AR(X) model, predict the y values and calculate the RSME.
+
+    Every prediction uses the lag values starting at i and is compared to the value
+    at lag + i + 1. All predictions are computed as one product of the sliding
+    windows over the validation values with the betas.
     """
     lag, betas, const, column_name = ar_model
     mod_validation_data = dataframe[
         pd.to_datetime(dataframe.index)
         > datetime.datetime(2019, 1, 1, 12, 30) - datetime.timedelta(days=lag)
     ]
-    grouped_star = mod_validation_data[
-        "mean"
-    ]  # prepare_df_for_modeling(mod_validation_data, column_name=column_name)['mean']
-    grouped_mean_list = list(grouped_star)
-    residuals = []
-    y_predicted_list = []
-    calculations = []
-    for i in range(0, len(grouped_mean_list) - lag - 1):
-        xs = grouped_mean_list[i : lag + i]
-        y_predicted = predict_lin_reg(betas, const, xs)
-        y_predicted_list.append(y_predicted)
-        y = grouped_mean_list[lag + i + 1]
-        resid_square = (y - y_predicted) ** 2
-        residuals.append(resid_square)
-        calculations.append((i, y_predicted, y, resid_square))
+    grouped_mean = mod_validation_data["mean"].to_numpy(dtype=np.float64)
+    prediction_count = max(len(grouped_mean) - lag - 1, 0)
+
+    if prediction_count:
+        windows = np.lib.stride_tricks.sliding_window_view(grouped_mean, lag)
+        y_predicted = windows[:prediction_count] @ np.asarray(betas) + const
+    else:
+        y_predicted = np.zeros(0)
+    y = grouped_mean[lag + 1 :]
+    residuals = (y - y_predicted) ** 2
+    calculations = list(
+        zip(
+            range(prediction_count),
+            y_predicted.tolist(),
+            y.tolist(),
+            residuals.tolist(),
+        )
+    )
 
     rmse = np.sqrt(np.mean(residuals))
 
@@ -147,16 +232,59 @@ def ar_model_validation(ar_model_results, validation):
 
 @logger.catch
 def validate_all(
-    training, validation, column_names=["star_count_diff", "star_count_rel"]
+    training,
+    validation,
+    column_names=["star_count_diff", "star_count_rel"],
+    max_ar=5,
+    method="ols",
+    use_store=True,
 ):
+    """Fit and validate AR models for every column.
+
+    training, validation: DataFrames or the filenames of the stored partitions.
+    use_store: Load the fitted models and validation results from the model store
+        if the prepared series and the spec did not change, see model_store.py.
+    """
     logger.info(f"Run Validation Pipeline.")
+    store = model_store.ModelStore.load() if use_store else None
+    spec = {"max_ar": max_ar, "method": method}
 
+    prepared_training = prepare_columns_for_modeling(training, column_names)
+    prepared_validation = prepare_columns_for_modeling(validation, column_names)
     for column_name in column_names:
         logger.info(f"Running the modeling pipeline for {column_name}.")
-        prep_training = prepare_df_for_modeling(training, column_name=column_name)
-        prep_validation = prepare_df_for_modeling(validation, column_name=column_name)
-        ar_model_results = ar_model_fitting(prep_training, column_name)
-        _ = ar_model_validation(ar_model_results, prep_validation)
-
+        prep_training = prepared_training[column_name]
+        prep_validation = prepared_validation[column_name]
+        if store is None:
+            ar_model_results = ar_model_fitting(
+                prep_training, column_name, max_ar=max_ar, method=method
+            )
+            _ = ar_model_validation(ar_model_results, prep_validation)
+            continue
+
+        fit_key = store.get_key(prep_training, column_name, spec)
+        ar_model_results = store.get_or_create(
+            fit_key,
+            lambda: ar_model_fitting(
+                prep_training, column_name, max_ar=max_ar, method=method
+            ),
+            kind="fit",
+            column_name=column_name,
+        )
+        validation_key = store.get_key(
+            prep_validation, column_name, {**spec, "fit": fit_key}
+        )
+        overall_ar_results = store.get_or_create(
+            validation_key,
+            lambda: ar_model_validation(ar_model_results, prep_validation),
+            kind="validation",
+            column_name=column_name,
+            fit_key=fit_key,
+        )
+        for lag, betas, const, rmse, _ in overall_ar_results:
+            logger.log("RESULTS", f"AR({lag}) - {column_name} - RMSE: {rmse}")
+
+    if store is not None:
+        store.evict()
     logger.info(f"Finished Validation Pipeline.")
     logger.success(f"Finished validate_all for {column_names}")
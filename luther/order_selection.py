@@ -0,0 +1,186 @@
+"""Select the order of AR(p) and ARMA(p, q) models by AIC or BIC.
+
+All candidate models are regressions of y_t on a subset of the columns
+
+    [1, y_t-1, ..., y_t-max_ar, e_t-1, ..., e_t-max_ma]
+
+on the same rows, so the Gram matrix Z'Z, Z'y and y'y are computed once. Every
+candidate is then a (p + q + 1) sized solve of a sub-block of Z'Z, its residual sum
+of squares is y'y - b'Z'y. No candidate touches the data again, so a larger order
+space costs one larger Gram matrix instead of one pass over the data per model.
+
+For q > 0 the innovations e_t are unknown. They are estimated like in the
+Hannan-Rissanen method: a long AR(m) model is fitted by least squares first and its
+residuals are used as e_t in the regression above.
+
+The orders are searched with pruning: for every q, p is increased until the
+criterion did not improve for patience orders in a row, and q is increased until
+the best model of a q did not improve for patience values of q.
+
+Like in ar_engine.py, const is the mean of the process.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+import ar_engine
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+
+CRITERIA = ["aic", "bic"]
+PATIENCE = 2
+
+
+def get_long_ar_order(value_count, max_ar, max_ma):
+    """Order of the long AR model of the Hannan-Rissanen first step."""
+    return max(
+        max_ar + max_ma, min(int(10 * math.log10(value_count)), value_count // 4)
+    )
+
+
+def get_innovations(values, long_ar):
+    """Residuals of a least squares AR(long_ar) fit, NaN for the first long_ar values."""
+    design_matrix, targets = ar_engine.get_lagged_design_matrix(values, long_ar)
+    coefficients, *_ = np.linalg.lstsq(design_matrix, targets, rcond=None)
+    innovations = np.full(len(values), np.nan)
+    innovations[long_ar:] = targets - design_matrix @ coefficients
+    return innovations
+
+
+def get_regressors(values, max_ar, max_ma):
+    """Return the full design matrix Z, the targets y and the long AR order.
+
+    Z has the columns [1, y_t-1, ..., y_t-max_ar, e_t-1, ..., e_t-max_ma].
+    """
+    if max_ma == 0:
+        design_matrix, targets = ar_engine.get_lagged_design_matrix(values, max_ar)
+        return design_matrix, targets, 0
+
+    long_ar = get_long_ar_order(len(values), max_ar, max_ma)
+    innovations = get_innovations(values, long_ar)
+    first_row = max(max_ar, long_ar + max_ma)
+    rows = np.arange(first_row, len(values))
+    columns = [np.ones(len(rows))]
+    columns += [values[rows - lag] for lag in range(1, max_ar + 1)]
+    columns += [innovations[rows - lag] for lag in range(1, max_ma + 1)]
+    return np.column_stack(columns), values[rows], long_ar
+
+
+class SufficientStatistics:
+    def __init__(self, design_matrix, targets, max_ar):
+        """Z'Z, Z'y and y'y of the full design matrix, shared by all candidates."""
+        self.gram = design_matrix.T @ design_matrix
+        self.zty = design_matrix.T @ targets
+        self.yty = float(targets @ targets)
+        self.n = len(targets)
+        self.max_ar = max_ar
+
+    def __repr__(self):
+        return f"SufficientStatistics(n={self.n}, columns={len(self.zty)})"
+
+    def get_columns(self, p, q):
+        return [0, *range(1, p + 1), *range(self.max_ar + 1, self.max_ar + q + 1)]
+
+    def fit(self, p, q):
+        """return: dict with p, q, the coefficients, rss, aic and bic."""
+        columns = self.get_columns(p, q)
+        coefficients, *_ = np.linalg.lstsq(
+            self.gram[np.ix_(columns, columns)], self.zty[columns], rcond=None
+        )
+        rss = max(self.yty - coefficients @ self.zty[columns], np.finfo(float).tiny)
+        # The variance of the innovations is a parameter as well.
+        parameter_count = len(columns) + 1
+        log_likelihood_term = self.n * math.log(rss / self.n)
+        return {
+            "p": p,
+            "q": q,
+            "intercept": float(coefficients[0]),
+            "ar_betas": coefficients[1 : p + 1].tolist(),
+            "ma_betas": coefficients[p + 1 :].tolist(),
+            "rss": rss,
+            "aic": log_likelihood_term + 2 * parameter_count,
+            "bic": log_likelihood_term + math.log(self.n) * parameter_count,
+        }
+
+
+def search_orders(statistics, max_ar, max_ma, criterion, patience):
+    """Fit the candidates in order of p and q and stop when they stop improving.
+
+    return: List of the fitted candidates.
+    """
+    candidates = []
+    best = math.inf
+    q_stale = 0
+    for q in range(max_ma + 1):
+        best_of_q = math.inf
+        p_stale = 0
+        for p in range(0 if q else 1, max_ar + 1):
+            candidate = statistics.fit(p, q)
+            candidates.append(candidate)
+            if candidate[criterion] < best_of_q:
+                best_of_q = candidate[criterion]
+                p_stale = 0
+            else:
+                p_stale += 1
+                if patience <= p_stale:
+                    break
+
+        if best_of_q < best:
+            best = best_of_q
+            q_stale = 0
+        else:
+            q_stale += 1
+            if patience <= q_stale:
+                break
+    return candidates
+
+
+def select_order(values, max_ar=10, max_ma=0, criterion="bic", patience=PATIENCE):
+    """Select the ARMA(p, q) model with the lowest criterion.
+
+    values: Array or Series of the time series in chronological order, NaN values
+        are dropped.
+    max_ma: 0 searches AR(p) models only.
+    patience: Number of orders without improvement before the search stops, None
+        fits every candidate.
+
+    return: (selected, table)
+        selected: dict with p, q, ar_betas, ma_betas, const (the process mean),
+            rss, aic and bic.
+        table: DataFrame of all fitted candidates ranked by criterion.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown criterion {criterion}, use one of {CRITERIA}.")
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    design_matrix, targets, long_ar = get_regressors(values, max_ar, max_ma)
+    if len(targets) <= 2 * design_matrix.shape[1]:
+        raise ValueError(
+            f"Can not select from ARMA({max_ar}, {max_ma}) models on {len(values)} values."
+        )
+
+    statistics = SufficientStatistics(design_matrix, targets, max_ar)
+    if patience is None:
+        patience = math.inf
+    candidates = search_orders(statistics, max_ar, max_ma, criterion, patience)
+    for candidate in candidates:
+        candidate["const"] = ar_engine.intercept_to_mean(
+            candidate["intercept"], candidate["ar_betas"], values
+        )
+
+    table = (
+        pd.DataFrame(candidates)
+        .sort_values(criterion, kind="stable")
+        .reset_index(drop=True)
+    )
+    candidate_count = max_ar + max_ma * (max_ar + 1)
+    logger.info(
+        f"Fitted {len(candidates)} of {candidate_count} candidates on {statistics.n} rows (long AR order {long_ar})."
+    )
+    selected = table.iloc[0].to_dict()
+    return selected, table
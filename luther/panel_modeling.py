@@ -0,0 +1,191 @@
+"""Fit AR models per repository mention and per podcast instead of one average.
+
+modeling.prepare_df_for_modeling averages all repositories into one series per
+fake_date. Here every repository mention (podcast, episode, repository) is its own
+series over days_since_mention, and all series are fitted at once:
+
+    - The series are stacked into a matrix with one row per mention and one column
+      per day, missing days are NaN.
+    - The lagged design matrices of all series are one sliding window view of this
+      matrix, rows with a NaN are masked.
+    - X'X and X'y of every series are computed with a single einsum and all systems
+      are solved together. Summing X'X and X'y over the series of a podcast (or all
+      series) gives the pooled least squares fit of the podcast (or panel).
+
+No model object is created per series, the coefficients are rows of a DataFrame.
+Pooling by repository_url fits one model per repository over all its mentions.
+
+With split_day, the models are fitted on the days up to split_day (e.g. 0, the day
+of the mention) and the RMSE is computed on the days after it. Without it, the RMSE
+is the in-sample one-step error.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from base import add_log_sink, add_log_level
+
+add_log_level("RESULTS", no=40, color="<green>")
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/results_{_log_file_name}.log", level="RESULTS")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+SERIES_COLUMNS = ["podcast_name", "episode_number", "repository_url"]
+DAY_COLUMN = "days_since_mention"
+
+
+def get_panel(df, column_name):
+    """Return the series keys and the (series, day) matrix of column_name.
+
+    return: (keys DataFrame with SERIES_COLUMNS, values, days)
+    """
+    series = (
+        df.groupby(SERIES_COLUMNS + [DAY_COLUMN], observed=True)[column_name]
+        .mean()
+        .unstack(DAY_COLUMN)
+        .sort_index(axis=1)
+    )
+    days = series.columns.to_numpy()
+    # Add the days without any data, so neighbouring columns are neighbouring days.
+    all_days = np.arange(days.min(), days.max() + 1)
+    series = series.reindex(columns=all_days)
+    keys = series.index.to_frame(index=False)
+    return keys, series.to_numpy(dtype=np.float64), all_days
+
+
+def get_lagged_panel(values, lag):
+    """Return the lagged design matrices, targets and row mask of all series.
+
+    return: (X with shape (series, rows, lag + 1), y with shape (series, rows), mask)
+    """
+    windows = np.lib.stride_tricks.sliding_window_view(values, lag + 1, axis=1)
+    mask = ~np.isnan(windows).any(axis=2)
+    windows = np.where(mask[..., None], windows, 0)
+    design = np.concatenate(
+        [np.ones(windows.shape[:2] + (1,)), windows[..., -2::-1]], axis=2
+    )
+    design = design * mask[..., None]
+    return design, windows[..., -1], mask
+
+
+def solve_batched(xtx, xty):
+    """Solve all normal equations at once, singular systems get the minimum norm."""
+    return (np.linalg.pinv(xtx) @ xty[..., None])[..., 0]
+
+
+def get_rmse(design, targets, mask, coefficients):
+    """Return the squared error sums and counts of the one-step predictions."""
+    predictions = np.einsum("srk,sk->sr", design, coefficients)
+    squared_errors = np.where(mask, (targets - predictions) ** 2, 0)
+    return squared_errors.sum(axis=1), mask.sum(axis=1)
+
+
+def coefficients_to_frame(coefficients, lag):
+    """Convert intercepts and betas into the const (process mean) and beta columns."""
+    betas = coefficients[:, 1:]
+    denominator = 1 - betas.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        const = np.where(
+            np.isclose(denominator, 0), np.nan, coefficients[:, 0] / denominator
+        )
+    frame = pd.DataFrame(betas, columns=[f"beta_{k}" for k in range(1, lag + 1)])
+    frame.insert(0, "const", const)
+    return frame
+
+
+def fit_pooled(groups, xtx, xty, design, targets, evaluation_mask, lag):
+    """Fit one AR model per group on the summed normal equations of its series.
+
+    groups: Series with the group of every series, e.g. keys["podcast_name"].
+
+    return: DataFrame with one row per group, const, betas, rmse and count.
+    """
+    codes, names = pd.factorize(groups)
+    group_xtx = np.zeros((len(names),) + xtx.shape[1:])
+    group_xty = np.zeros((len(names),) + xty.shape[1:])
+    np.add.at(group_xtx, codes, xtx)
+    np.add.at(group_xty, codes, xty)
+    coefficients = solve_batched(group_xtx, group_xty)
+    error_sums, counts = get_rmse(design, targets, evaluation_mask, coefficients[codes])
+
+    pooled = coefficients_to_frame(coefficients, lag)
+    pooled.insert(0, groups.name, names)
+    group_counts = np.bincount(codes, weights=counts, minlength=len(names))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pooled["rmse"] = np.sqrt(
+            np.bincount(codes, weights=error_sums, minlength=len(names)) / group_counts
+        )
+    pooled["count"] = group_counts.astype(int)
+    return pooled
+
+
+@logger.catch
+def fit_panel(df, column_name="star_count_rel", lag=1, split_day=None):
+    """Fit AR(lag) models per repository mention, repository, podcast and the panel.
+
+    return: dict with
+        series: One row per mention with SERIES_COLUMNS, const, betas, rmse, count.
+        repositories: One row per repository with the pooled fit of its mentions.
+        podcasts: One row per podcast with the pooled fit of its mentions.
+        pooled_rmse: RMSE of all per-series models together.
+        panel: One row with the pooled fit of all mentions.
+    """
+    start = time.time()
+    keys, values, days = get_panel(df, column_name)
+    design, targets, mask = get_lagged_panel(values, lag)
+    target_days = days[lag:]
+    if split_day is None:
+        fit_mask = evaluation_mask = mask
+    else:
+        fit_mask = mask & (target_days <= split_day)
+        evaluation_mask = mask & (split_day < target_days)
+
+    fit_design = design * fit_mask[..., None]
+    xtx = np.einsum("srk,srl->skl", fit_design, fit_design)
+    xty = np.einsum("srk,sr->sk", fit_design, np.where(fit_mask, targets, 0))
+
+    series_coefficients = solve_batched(xtx, xty)
+    error_sums, counts = get_rmse(design, targets, evaluation_mask, series_coefficients)
+    series = pd.concat([keys, coefficients_to_frame(series_coefficients, lag)], axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        series["rmse"] = np.sqrt(error_sums / counts)
+    series["count"] = counts
+
+    pooled_args = (xtx, xty, design, targets, evaluation_mask, lag)
+    repositories = fit_pooled(keys["repository_url"], *pooled_args)
+    podcasts = fit_pooled(keys["podcast_name"], *pooled_args)
+    panel = fit_pooled(pd.Series(["all"] * len(keys), name="panel"), *pooled_args)
+
+    pooled_rmse = float(np.sqrt(error_sums.sum() / counts.sum()))
+    logger.log(
+        "RESULTS",
+        f"Panel AR({lag}) - {column_name} - {len(keys)} series - per series pooled RMSE: {pooled_rmse}, panel RMSE: {panel['rmse'].iloc[0]}",
+    )
+    logger.success(
+        f"Fitted AR({lag}) models for {len(keys)} series, {len(repositories)} repositories and {len(podcasts)} podcasts in {time.time() - start}s."
+    )
+    return {
+        "series": series,
+        "repositories": repositories,
+        "podcasts": podcasts,
+        "pooled_rmse": pooled_rmse,
+        "panel": panel,
+    }
+
+
+@logger.catch
+def fit_panels(df, column_names=("star_count_rel",), max_ar=5, split_day=None):
+    """Fit the panel models of every column and lag.
+
+    return: {(column_name, lag): result of fit_panel}
+    """
+    return {
+        (column_name, lag): fit_panel(df, column_name, lag=lag, split_day=split_day)
+        for column_name in column_names
+        for lag in range(1, max_ar + 1)
+    }
@@ -0,0 +1,163 @@
+"""Convert podcasts into star history rows on a process pool.
+
+Every repository mention is converted by one task. The stargazer dates of all
+repositories are written once into a memory-mapped file of int32 date ordinals,
+a task only carries the offset and length of its repository in that file plus
+the podcast/episode/repository fields of its rows. This way no StarGazer objects
+have to be pickled and send to the worker processes.
+
+The tasks are mapped in podcast/episode/reference order, so the resulting
+DataFrames are the same as the ones created by luther.convert_podcast_to_pd_df.
+"""
+
+import datetime
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from loguru import logger
+
+import luther
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+MAX_WORKERS = os.cpu_count()
+
+# Memory-mapped star ordinals of all repositories, set in every worker process.
+_STAR_ORDINALS = None
+
+
+def _init_worker(filename, size):
+    global _STAR_ORDINALS
+    _STAR_ORDINALS = np.memmap(filename, dtype=np.int32, mode="r", shape=(size,))
+
+
+def convert_repository_task(task):
+    """Create the row values of a single repository mention.
+
+    return: (columns, rows)
+    """
+    row_data, date_requested, date_created, offset, length, today = task
+    date_mapping = luther.create_date_mapping(
+        date_requested, date_created, row_data["podcast_start_date"], today=today
+    )
+    luther.count_star_ordinals_per_date(
+        date_mapping, _STAR_ORDINALS[offset : offset + length]
+    )
+    luther_data_rows = luther.convert_date_mapping_to_luther_datarows(
+        date_mapping, row_data, date_created
+    )
+    columns = tuple(luther_data_rows[0].column_names)
+    return columns, [luther_data_row.values for luther_data_row in luther_data_rows]
+
+
+def create_conversion_tasks(podcasts, today):
+    """Create one task per repository mention and the star ordinals they refer to.
+
+    return: (tasks, podcast_idx for every task, list of star ordinal arrays)
+    """
+    tasks = []
+    task_podcasts = []
+    star_ordinals = []
+    offsets = {}
+    size = 0
+    for podcast_idx, podcast in enumerate(podcasts):
+        podcast_row_data = luther.get_podcast_row_data(podcast)
+        for episode in podcast.episodes:
+            episode_row_data = luther.get_episode_row_data(episode, podcast_row_data)
+            for reference in episode.references:
+                repository = reference.repository
+                if repository is None:
+                    continue
+                row_data = luther.get_repository_row_data(repository, episode_row_data)
+                if id(repository) not in offsets:
+                    ordinals = luther.get_repository_star_ordinals(repository)
+                    offsets[id(repository)] = (size, len(ordinals))
+                    star_ordinals.append(ordinals)
+                    size += len(ordinals)
+                offset, length = offsets[id(repository)]
+                tasks.append(
+                    (
+                        row_data,
+                        repository._date_requested,
+                        repository.date_created,
+                        offset,
+                        length,
+                        today,
+                    )
+                )
+                task_podcasts.append(podcast_idx)
+
+    return tasks, task_podcasts, star_ordinals
+
+
+def write_star_ordinals(star_ordinals, directory):
+    """Write all star ordinals into one memory-mapped file.
+
+    return: (filename, size)
+    """
+    filename = os.path.join(directory, "star_ordinals.bin")
+    size = sum(len(ordinals) for ordinals in star_ordinals)
+    mapped = np.memmap(filename, dtype=np.int32, mode="w+", shape=(max(size, 1),))
+    if size:
+        mapped[:size] = np.concatenate(star_ordinals)
+    mapped.flush()
+    del mapped
+    return filename, max(size, 1)
+
+
+@logger.catch
+def convert_podcasts_to_rows_parallel(podcasts, max_workers=MAX_WORKERS, today=None):
+    """Convert all podcasts on a process pool.
+
+    return: List of (rows, columns) in the order of podcasts.
+
+    Unlike luther.convert_podcast_to_luther_datarows the LutherDataRow objects are
+    not stored in podcast.exportable_data_rows, only their values are send back.
+    """
+    start = time.time()
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+
+    tasks, task_podcasts, star_ordinals = create_conversion_tasks(podcasts, today)
+    logger.info(
+        f"Converting {len(tasks)} repository mentions of {len(podcasts)} podcasts with {max_workers} processes."
+    )
+
+    podcast_rows = [[] for _ in podcasts]
+    podcast_columns = [None for _ in podcasts]
+    with tempfile.TemporaryDirectory() as directory:
+        filename, size = write_star_ordinals(star_ordinals, directory)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(filename, size),
+        ) as executor:
+            chunksize = max(1, len(tasks) // (4 * max_workers))
+            results = executor.map(convert_repository_task, tasks, chunksize=chunksize)
+            for podcast_idx, (columns, rows) in zip(task_podcasts, results):
+                podcast_rows[podcast_idx] += rows
+                podcast_columns[podcast_idx] = columns
+
+    logger.success(
+        f"Converted {len(tasks)} repository mentions in {time.time() - start}s."
+    )
+    return list(zip(podcast_rows, podcast_columns))
+
+
+@logger.catch
+def convert_podcasts_to_pd_dfs_parallel(podcasts, max_workers=MAX_WORKERS):
+    """Parallel version of luther.convert_podcast_to_pd_df for multiple podcasts."""
+    logger.info(f"Convert {len(podcasts)} podcasts to DataFrames in parallel.")
+    dfs = []
+    results = convert_podcasts_to_rows_parallel(podcasts, max_workers=max_workers)
+    for podcast, (rows, columns) in zip(podcasts, results):
+        dfs.append(luther.convert_rows_to_dataframe(rows, columns, podcast))
+
+    logger.success(f"Converted {len(podcasts)} podcasts to DataFrames in parallel.")
+    return dfs
@@ -0,0 +1,282 @@
+"""Run scraping, GitHub fetching and conversion as concurrent stages.
+
+luther.run_all runs every stage for all podcasts before starting the next one.
+Here the stages are connected by bounded queues instead:
+
+    scrape (one thread per podcast)
+        -> episode_queue ->
+    build Episodes/References (no network I/O)
+        -> reference_queue ->
+    fetch repositories and stargazers (fetch_workers threads)
+        -> repository_queue ->
+    convert to star history rows
+
+Every repository is converted as soon as its stargazers are complete, while
+the remaining episodes are still being scraped and fetched. The queues are
+bounded, so a fast stage waits for a slow one instead of piling up objects.
+
+The resulting rows and DataFrames contain the same rows as the ones created by
+luther.convert_podcast_to_pd_df for the finished podcast. Only the row order can
+differ, the episodes are appended in scrape order, while the serial path orders
+them by Podcast.remove_duplicate_episodes.
+"""
+
+import datetime
+import queue
+import threading
+import time
+
+import pandas as pd
+from loguru import logger
+
+import artifacts
+import luther
+from base import add_log_sink
+import scrape_tptm as stptm
+from episode_data import Podcast, Episode
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+QUEUE_SIZE = 64
+FETCH_WORKERS = 8
+
+# Marks the end of the items a producer puts on a queue.
+_DONE = object()
+
+
+def scrape_stage(podcast, podcast_info, episode_queue):
+    try:
+        for raw_episode in stptm.iter_all_episodes(podcast_info):
+            episode_queue.put((podcast, raw_episode))
+    except Exception as e:
+        logger.error(f"Scraping {podcast} failed: {e}")
+    finally:
+        episode_queue.put(_DONE)
+
+
+def build_episode(podcast, raw_episode, idx, seen_episodes):
+    """Create the Episode and add it to podcast, None if it is a duplicate."""
+    episode_data = {
+        **raw_episode,
+        "_id": idx,
+        "_parent_uuid": podcast._uuid,
+        "resolve_repositories": False,
+    }
+    episode = Episode.create_from_dict(**episode_data)
+
+    # Duplicate episodes are dropped like in Podcast.remove_duplicate_episodes.
+    # Appending through Podcast.append_episodes would build a new set of all
+    # episodes for every episode.
+    podcast_episodes = seen_episodes.setdefault(podcast._uuid, set())
+    if episode in podcast_episodes:
+        logger.warning(f"Skip duplicate {episode} of {podcast}.")
+        return None
+    podcast_episodes.add(episode)
+    podcast.episodes.append(episode)
+    return episode
+
+
+def build_stage(episode_queue, reference_queue, producer_count, fetch_workers):
+    """Create Episodes and References and pass the github references on.
+
+    A failing episode is logged and skipped, the queue is always drained, otherwise
+    the scrapers would block on the full queue forever.
+    """
+    episode_ids = {}
+    seen_episodes = {}
+    try:
+        while producer_count:
+            item = episode_queue.get()
+            if item is _DONE:
+                producer_count -= 1
+                continue
+
+            podcast, raw_episode = item
+            idx = episode_ids.get(podcast._uuid, 0)
+            episode_ids[podcast._uuid] = idx + 1
+            try:
+                episode = build_episode(podcast, raw_episode, idx, seen_episodes)
+            except Exception as e:
+                logger.error(f"Building episode {idx} of {podcast} failed: {e}")
+                continue
+            if episode is None:
+                continue
+            for reference in episode.unresolved_references:
+                reference_queue.put((podcast, episode, reference))
+    finally:
+        for _ in range(fetch_workers):
+            reference_queue.put(_DONE)
+
+
+def fetch_stage(reference_queue, repository_queue):
+    try:
+        while True:
+            item = reference_queue.get()
+            if item is _DONE:
+                break
+            podcast, episode, reference = item
+            try:
+                repository = reference.fetch_repository()
+            except Exception as e:
+                logger.error(f"Fetching {reference} failed: {e}")
+                repository = None
+            repository_queue.put((podcast, episode, reference, repository))
+    finally:
+        repository_queue.put(_DONE)
+
+
+@logger.catch
+def convert_repository(podcast, episode, repository, today):
+    row_data = luther.get_episode_row_data(
+        episode, luther.get_podcast_row_data(podcast)
+    )
+    return luther.convert_repository_to_luther_datarows(
+        repository, row_data, today=today
+    )
+
+
+def convert_stage(repository_queue, producer_count, rows_by_reference, today):
+    """Attach the fetched repositories and convert them into rows.
+
+    A failing item is logged and skipped, the queue is always drained, otherwise
+    the fetch workers would block on the full queue forever.
+    """
+    while producer_count:
+        item = repository_queue.get()
+        if item is _DONE:
+            producer_count -= 1
+            continue
+
+        podcast, episode, reference, repository = item
+        try:
+            reference.attach_repository(repository)
+            reference.pickle(is_raw=False)
+            if repository is None:
+                continue
+
+            luther_data_rows = convert_repository(podcast, episode, repository, today)
+            if luther_data_rows is not None:
+                rows_by_reference[id(reference)] = luther_data_rows
+        except Exception as e:
+            logger.error(f"Converting {reference} of {episode} failed: {e}")
+
+
+def collect_podcast_rows(podcast, rows_by_reference):
+    """Return the rows, columns and podcast like
+    luther.convert_podcast_to_luther_datarows, in the order of podcast.episodes.
+
+    rows and columns are empty if no repository of the podcast was converted.
+    """
+    luther_data_rows = []
+    for episode in podcast.episodes:
+        for reference in episode.references:
+            luther_data_rows += rows_by_reference.get(id(reference), [])
+    if not luther_data_rows:
+        logger.warning(f"No rows were converted for {podcast}.")
+        return [], [], podcast
+
+    rows = [luther_data_row.values for luther_data_row in luther_data_rows]
+    columns = luther_data_rows[0].column_names
+    luther.store_exportable_data_rows(podcast, luther_data_rows)
+    return rows, columns, podcast
+
+
+@logger.catch
+def get_podcast_dataframes_pipelined(
+    podcasts_info, fetch_workers=FETCH_WORKERS, queue_size=QUEUE_SIZE
+):
+    """Scrape, fetch and convert all podcasts with overlapping stages.
+
+    return: List of (podcast, DataFrame) in the order of podcasts_info.
+    """
+    start = time.time()
+    logger.info(f"Run pipelined conversion for {len(podcasts_info)} podcasts.")
+    today = datetime.datetime.utcnow().date()
+
+    episode_queue = queue.Queue(maxsize=queue_size)
+    reference_queue = queue.Queue(maxsize=queue_size)
+    repository_queue = queue.Queue(maxsize=queue_size)
+    rows_by_reference = {}
+
+    podcasts = [Podcast(**podcast_info) for podcast_info in podcasts_info]
+    threads = [
+        threading.Thread(
+            target=scrape_stage,
+            args=(podcast, podcast_info, episode_queue),
+            name=f"scrape-{idx}",
+        )
+        for idx, (podcast, podcast_info) in enumerate(zip(podcasts, podcasts_info))
+    ]
+    threads.append(
+        threading.Thread(
+            target=build_stage,
+            args=(episode_queue, reference_queue, len(podcasts), fetch_workers),
+            name="build",
+        )
+    )
+    threads += [
+        threading.Thread(
+            target=fetch_stage,
+            args=(reference_queue, repository_queue),
+            name=f"fetch-{idx}",
+        )
+        for idx in range(fetch_workers)
+    ]
+    threads.append(
+        threading.Thread(
+            target=convert_stage,
+            args=(repository_queue, fetch_workers, rows_by_reference, today),
+            name="convert",
+        )
+    )
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    dataframes = []
+    for podcast in podcasts:
+        for episode in podcast.episodes:
+            episode.pickle(is_raw=False)
+        podcast.pickle()
+
+        rows, columns, podcast = collect_podcast_rows(podcast, rows_by_reference)
+        if rows:
+            df = luther.convert_rows_to_dataframe(rows, columns, podcast)
+        else:
+            df = pd.DataFrame()
+        dataframes.append((podcast, df))
+
+    logger.success(
+        f"Finished pipelined conversion for {len(podcasts)} podcasts in {time.time() - start}s."
+    )
+    return dataframes
+
+
+@logger.catch
+def run_all_pipelined(fetch_workers=FETCH_WORKERS, queue_size=QUEUE_SIZE):
+    """Same as luther.run_all, but scrape, fetch and convert concurrently."""
+    logger.info(f"Run All Pipelined")
+
+    dataframes = get_podcast_dataframes_pipelined(
+        luther.get_podcasts_info(), fetch_workers=fetch_workers, queue_size=queue_size
+    )
+
+    clean_dfs = [
+        luther.clean_df(df, days_premention=366) for _, df in dataframes if not df.empty
+    ]
+    clean = luther.compact_dtypes(pd.concat(clean_dfs))
+
+    artifacts.write_dataframe(
+        clean,
+        artifacts.get_artifact_filename(
+            "clean_data_frame_run_all_" + luther.get_timestamp()
+        ),
+    )
+
+    training, validation = luther.partition_timeseries_podcast_data(clean)
+
+    return training, validation
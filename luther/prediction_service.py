@@ -0,0 +1,353 @@
+"""Answer mention impact predictions over HTTP from models kept in memory.
+
+The service loads
+
+    - the newest AR model of PREDICTION_COLUMN from the model store (see
+      model_store.py), with the lag of the lowest validation RMSE,
+    - the daily star counts of the last HISTORY_DAYS days of every repository in
+      the pickled podcasts of podcasts.yaml,
+
+and predicts the daily stars of a repository for the next horizon days if it is
+mentioned tomorrow. The AR model is fitted on the mention aligned star counts, so
+the forecast starts from the recent stars of the repository and follows the
+average behaviour after a mention. The uplift is the forecast minus the recent
+daily average over the same horizon.
+
+The forecast of an AR(lag) model for all horizons is a fixed linear function of the
+last lag values, its (MAX_HORIZON, lag) matrix is computed once per model. A
+prediction is a single matrix-vector product.
+
+Every RELOAD_INTERVAL seconds the model store entries, the podcast pickles and the
+date are checked. If one of them changed, a new state is built in the background
+and swapped in at once, requests are answered from the old state until then. The
+recent star counts end at the day the state was built, so a new day reloads them.
+
+Endpoints:
+    GET /predict?repository=owner/name&horizon=30
+    GET /repositories
+    GET /health
+    POST /reload
+
+Run with:
+    python luther/prediction_service.py
+"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from loguru import logger
+
+import luther
+import model_store
+from base import add_log_sink
+from episode_data import Podcast
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+HOST = os.getenv("LUTHER_PREDICTION_HOST", default="127.0.0.1")
+PORT = int(os.getenv("LUTHER_PREDICTION_PORT", default=8050))
+RELOAD_INTERVAL = float(os.getenv("LUTHER_PREDICTION_RELOAD_INTERVAL", default=30))
+PREDICTION_COLUMN = "star_count_diff"
+HISTORY_DAYS = 30
+DEFAULT_HORIZON = 30
+MAX_HORIZON = 365
+
+
+def get_forecast_matrix(betas, max_horizon=MAX_HORIZON):
+    """Return M with M[h - 1] @ (last lag values - const) = forecast h days ahead - const.
+
+    The last lag values are ordered from y_t to y_t-lag+1, like the betas.
+    """
+    lag = len(betas)
+    companion = np.eye(lag, k=-1)
+    companion[0] = betas
+    forecast_matrix = np.empty((max_horizon, lag))
+    power = companion
+    for horizon in range(max_horizon):
+        forecast_matrix[horizon] = power[0]
+        power = companion @ power
+    return forecast_matrix
+
+
+def load_ar_model(store, column_name=PREDICTION_COLUMN):
+    """Return the newest fit of column_name in store and its key, (None, None) if none.
+
+    The lag with the lowest RMSE of the validations of that fit is used, the first
+    lag if it was not validated.
+    """
+    fit_keys = sorted(
+        (info["created"], key)
+        for key, info in store.index.items()
+        if info.get("kind") == "fit" and info.get("column_name") == column_name
+    )
+    if not fit_keys:
+        return None, None
+    fit_key = fit_keys[-1][1]
+    ar_models = store.get(fit_key)
+    if not ar_models:
+        return None, None
+
+    rmse_per_lag = {}
+    for key, info in store.index.items():
+        if info.get("kind") == "validation" and info.get("fit_key") == fit_key:
+            for lag, _, _, rmse, _ in store.get(key) or []:
+                if np.isfinite(rmse):
+                    rmse_per_lag[lag] = min(rmse, rmse_per_lag.get(lag, np.inf))
+    best_lag = min(rmse_per_lag, key=rmse_per_lag.get, default=ar_models[0][0])
+    ar_model = next(model for model in ar_models if model[0] == best_lag)
+    return ar_model, fit_key
+
+
+def get_recent_star_counts(repository, today, history_days=HISTORY_DAYS):
+    """Return the stars per day of the history_days days up to today, oldest first."""
+    star_ordinals = luther.get_repository_star_ordinals(repository)
+    first_ordinal = today.toordinal() - history_days + 1
+    recent = star_ordinals[
+        (first_ordinal <= star_ordinals) & (star_ordinals <= today.toordinal())
+    ]
+    return np.bincount(recent - first_ordinal, minlength=history_days).astype(
+        np.float64
+    )
+
+
+def load_recent_star_counts(podcasts_info, today, history_days=HISTORY_DAYS):
+    """Return {full_name in lower case: recent star counts} of all pickled podcasts."""
+    star_counts = {}
+    for podcast_info in podcasts_info:
+        try:
+            podcast = Podcast.unpickle(podcast_info["filename"] + "_instance.pk")
+        except FileNotFoundError:
+            logger.warning(f"No pickled Podcast for {podcast_info['name']}, skip it.")
+            continue
+        for episode in podcast.episodes:
+            for reference in episode.references:
+                repository = reference.repository
+                if repository is None:
+                    continue
+                full_name = repository.full_name.lower()
+                if full_name not in star_counts:
+                    star_counts[full_name] = get_recent_star_counts(
+                        repository, today, history_days
+                    )
+    return star_counts
+
+
+def get_store_entries(store_dir=model_store.MODEL_STORE_DIR):
+    """Keys and creation times of the model store entries.
+
+    Unlike the modification time of the index, these do not change if an entry is
+    only read, see ModelStore.get.
+    """
+    index = model_store.ModelStore.load(store_dir).index
+    return sorted((key, info["created"]) for key, info in index.items())
+
+
+def get_source_versions(podcasts_info, today, store_dir=model_store.MODEL_STORE_DIR):
+    """The date, the model store entries and the modification times of the podcast
+    pickles. The state has to be reloaded if any of them changed."""
+    versions = {"date": today.isoformat(), "store": get_store_entries(store_dir)}
+    for info in podcasts_info:
+        filename = info["filename"] + "_instance.pk"
+        try:
+            versions[filename] = os.path.getmtime(filename)
+        except FileNotFoundError:
+            versions[filename] = None
+    return versions
+
+
+class PredictionState:
+    def __init__(
+        self,
+        ar_model,
+        model_key,
+        star_counts,
+        source_versions,
+        history_days=HISTORY_DAYS,
+    ):
+        """Everything a prediction needs, never changed after creation.
+
+        star_counts: {full_name: stars per day of the last history_days days}, the
+            AR model uses the last lag of them, so lag can not exceed history_days.
+        """
+        if ar_model is not None and history_days < ar_model[0]:
+            raise ValueError(
+                f"AR({ar_model[0]}) model {model_key} needs more than the {history_days} days of star history."
+            )
+        self.ar_model = ar_model
+        self.model_key = model_key
+        self.star_counts = star_counts
+        self.source_versions = source_versions
+        self.loaded = datetime.datetime.utcnow().isoformat()
+        self.forecast_matrix = None
+        if ar_model is not None:
+            self.forecast_matrix = get_forecast_matrix(np.asarray(ar_model[1]))
+
+    def __repr__(self):
+        return f"PredictionState(model_key={self.model_key}, repository_count={len(self.star_counts)})"
+
+    def predict(self, full_name, horizon=DEFAULT_HORIZON):
+        """return: dict with the expected stars per day and the uplift."""
+        lag, betas, const, column_name = self.ar_model
+        recent = self.star_counts[full_name.lower()]
+        deviations = recent[::-1][:lag] - const
+        expected = self.forecast_matrix[:horizon] @ deviations + const
+        baseline = float(recent.mean() * horizon)
+        return {
+            "repository": full_name,
+            "column_name": column_name,
+            "lag": lag,
+            "horizon": horizon,
+            "expected_daily_stars": expected.tolist(),
+            "expected_stars": float(expected.sum()),
+            "baseline_stars": baseline,
+            "uplift": float(expected.sum()) - baseline,
+            "model_key": self.model_key,
+        }
+
+
+class PredictionService:
+    def __init__(self, podcasts_info=None, store_dir=model_store.MODEL_STORE_DIR):
+        if podcasts_info is None:
+            podcasts_info = luther.get_podcasts_info()
+        self.podcasts_info = podcasts_info
+        self.store_dir = store_dir
+        self.state = None
+        self._reload_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"PredictionService(state={self.state})"
+
+    def reload(self):
+        """Build a new state and swap it in, the old one serves until then."""
+        with self._reload_lock:
+            start = time.time()
+            today = datetime.datetime.utcnow().date()
+            source_versions = get_source_versions(
+                self.podcasts_info, today, self.store_dir
+            )
+            store = model_store.ModelStore.load(self.store_dir)
+            ar_model, model_key = load_ar_model(store)
+            # Save the last uses, so the served entries are not evicted.
+            store.save()
+            star_counts = load_recent_star_counts(self.podcasts_info, today)
+            self.state = PredictionState(
+                ar_model, model_key, star_counts, source_versions
+            )
+            logger.success(f"Loaded {self.state} in {time.time() - start}s.")
+            return self.state
+
+    def is_stale(self):
+        if self.state is None:
+            return True
+        today = datetime.datetime.utcnow().date()
+        return self.state.source_versions != get_source_versions(
+            self.podcasts_info, today, self.store_dir
+        )
+
+    def watch(self, stop, interval=RELOAD_INTERVAL):
+        """Reload whenever a source changed, until stop is set."""
+        while not stop.wait(interval):
+            if self.is_stale():
+                logger.info(f"Sources of {self} changed, reload.")
+                try:
+                    self.reload()
+                except Exception:
+                    logger.exception(f"Reload failed, keep serving {self.state}.")
+
+
+class PredictionHandler(BaseHTTPRequestHandler):
+    def send_json(self, status, content):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        state = self.server.service.state
+        if url.path == "/health":
+            self.send_json(
+                200,
+                {
+                    "model_key": state.model_key,
+                    "repository_count": len(state.star_counts),
+                    "loaded": state.loaded,
+                },
+            )
+        elif url.path == "/repositories":
+            self.send_json(200, sorted(state.star_counts))
+        elif url.path == "/predict":
+            self.predict(state, query)
+        else:
+            self.send_json(404, {"error": f"Unknown path {url.path}."})
+
+    def predict(self, state, query):
+        full_name = query.get("repository", [""])[0]
+        try:
+            horizon = int(query.get("horizon", [DEFAULT_HORIZON])[0])
+        except ValueError:
+            horizon = -1
+        if not 1 <= horizon <= MAX_HORIZON:
+            self.send_json(400, {"error": f"horizon must be in 1..{MAX_HORIZON}."})
+        elif state.ar_model is None:
+            self.send_json(503, {"error": "No fitted model in the model store."})
+        elif full_name.lower() not in state.star_counts:
+            self.send_json(404, {"error": f"Unknown repository {full_name}."})
+        else:
+            self.send_json(200, state.predict(full_name, horizon))
+
+    def do_POST(self):
+        if urlparse(self.path).path != "/reload":
+            self.send_json(404, {"error": f"Unknown path {self.path}."})
+            return
+        threading.Thread(target=self.server.service.reload, daemon=True).start()
+        self.send_json(202, {"reloading": True})
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class PredictionServer(ThreadingHTTPServer):
+    # Bursts of new connections are refused with the default backlog of 5.
+    request_queue_size = 128
+    daemon_threads = True
+
+
+@logger.catch
+def run_server(service=None, host=HOST, port=PORT, reload_interval=RELOAD_INTERVAL):
+    """Load the state and serve until KeyboardInterrupt."""
+    if service is None:
+        service = PredictionService()
+    service.reload()
+
+    stop = threading.Event()
+    threading.Thread(
+        target=service.watch, args=(stop, reload_interval), daemon=True
+    ).start()
+    server = PredictionServer((host, port), PredictionHandler)
+    server.service = service
+    logger.info(f"Serve predictions on http://{host}:{port}.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+    logger.success(f"Stopped the prediction service.")
+    return service
+
+
+if __name__ == "__main__":
+    run_server()
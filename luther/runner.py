@@ -0,0 +1,253 @@
+"""Run the pipeline as stages and reuse the stored output of unchanged stages.
+
+The stages and their inputs:
+
+    scrape -> build_graph -> fetch -> convert -> clean -> partition -> fit -> validate
+                                                                   \\________________/
+
+Every stage output is pickled to data/cache/<stage>_<fingerprint>.pk. The
+fingerprint is a hash of the stage name and version, the parameters the stage
+uses and the fingerprints of its inputs. A stage is only run again if one of
+these changed, e.g. changing max_ar only runs fit and validate, changing
+days_premention runs clean and everything after it.
+
+The scrape and fetch stages depend on external data. Their fingerprints contain
+the date, so they are run at most once per day.
+
+Run with:
+    python luther/runner.py
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import pandas as pd
+from loguru import logger
+
+import luther
+from base import add_log_sink
+import modeling
+import scrape_tptm as stptm
+from episode_data import Podcast
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+CACHE_DIR = "data/cache"
+
+# podcasts_info and date are set in run_pipeline, the default date has to be the
+# date of the run and not the date the module was imported.
+DEFAULT_PARAMETERS = {
+    "fetch_workers": luther.REPOSITORY_FETCH_WORKERS,
+    "days_premention": 366,
+    "days_postmention": 30,
+    "column_names": ["star_count_diff", "star_count_rel"],
+    "max_ar": 5,
+}
+
+
+class Stage:
+    def __init__(self, name, func, inputs=(), params=(), version=1):
+        """A pipeline step.
+
+        func: Called with the outputs of inputs followed by the params as keywords.
+        inputs: Names of the stages whose outputs are passed to func.
+        params: Names of the parameters passed to func. Only these are part of the
+            fingerprint.
+        version: Increase when func changes, to invalidate stored outputs.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.params = list(params)
+        self.version = version
+
+    def __repr__(self):
+        return f"Stage(name={self.name}, inputs={self.inputs}, params={self.params})"
+
+    def fingerprint(self, parameters, input_fingerprints):
+        content = {
+            "stage": self.name,
+            "version": self.version,
+            "params": {param: parameters[param] for param in self.params},
+            "inputs": input_fingerprints,
+        }
+        content = json.dumps(content, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def scrape(podcasts_info, date):
+    return [stptm.get_all_episodes(podcast_info)[0] for podcast_info in podcasts_info]
+
+
+def build_graph(raw_episodes, podcasts_info):
+    podcasts = []
+    for podcast_info, podcast_raw_episodes in zip(podcasts_info, raw_episodes):
+        podcast = Podcast(**podcast_info)
+        podcast.append_raw_episodes(podcast_raw_episodes, resolve=False)
+        podcasts.append(podcast)
+    return podcasts
+
+
+def fetch(podcasts, date, fetch_workers):
+    for podcast in podcasts:
+        podcast.resolve_repositories(max_workers=fetch_workers)
+        podcast.pickle()
+    return podcasts
+
+
+def convert(podcasts):
+    return [luther.convert_podcast_to_pd_df(podcast) for podcast in podcasts]
+
+
+def clean(dfs, days_premention, days_postmention):
+    clean_dfs = [
+        luther.clean_df(
+            df, days_premention=days_premention, days_postmention=days_postmention
+        )
+        for df in dfs
+    ]
+    return luther.compact_dtypes(pd.concat(clean_dfs))
+
+
+def partition(clean_df):
+    return luther.partition_timeseries_podcast_data(clean_df)
+
+
+def fit(partitions, column_names, max_ar):
+    training, _ = partitions
+    prepared = modeling.prepare_columns_for_modeling(training, column_names)
+    ar_model_results = {}
+    for column_name in column_names:
+        ar_model_results[column_name] = modeling.ar_model_fitting(
+            prepared[column_name], column_name, max_ar=max_ar
+        )
+    return ar_model_results
+
+
+def validate(partitions, ar_model_results):
+    _, validation = partitions
+    prepared = modeling.prepare_columns_for_modeling(
+        validation, list(ar_model_results)
+    )
+    overall_ar_results = {}
+    for column_name, column_ar_model_results in ar_model_results.items():
+        overall_ar_results[column_name] = modeling.ar_model_validation(
+            column_ar_model_results, prepared[column_name]
+        )
+    return overall_ar_results
+
+
+STAGES = {
+    stage.name: stage
+    for stage in [
+        Stage("scrape", scrape, params=["podcasts_info", "date"]),
+        Stage("build_graph", build_graph, inputs=["scrape"], params=["podcasts_info"]),
+        Stage("fetch", fetch, inputs=["build_graph"], params=["date", "fetch_workers"]),
+        Stage("convert", convert, inputs=["fetch"]),
+        Stage(
+            "clean",
+            clean,
+            inputs=["convert"],
+            params=["days_premention", "days_postmention"],
+        ),
+        Stage("partition", partition, inputs=["clean"]),
+        Stage(
+            "fit",
+            fit,
+            inputs=["partition"],
+            params=["column_names", "max_ar"],
+            version=2,
+        ),
+        Stage("validate", validate, inputs=["partition", "fit"]),
+    ]
+}
+
+
+def get_cache_filename(stage, fingerprint, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{stage.name}_{fingerprint[:16]}.pk")
+
+
+def get_fingerprint(name, parameters):
+    """Return the fingerprint of a stage, computed from the params alone."""
+    stage = STAGES[name]
+    input_fingerprints = [
+        get_fingerprint(input_name, parameters) for input_name in stage.inputs
+    ]
+    return stage.fingerprint(parameters, input_fingerprints)
+
+
+def is_forced(name, force):
+    """Return True if the stage or any of its transitive inputs is forced."""
+    return name in force or any(
+        is_forced(input_name, force) for input_name in STAGES[name].inputs
+    )
+
+
+def run_stage(name, parameters, cache_dir=CACHE_DIR, force=(), results=None):
+    """Return the output of a stage, running its inputs only if needed.
+
+    Stored outputs are loaded without loading the outputs of their inputs.
+
+    force: Names of stages to run even if a stored output exists. The stages
+        using their outputs are run again as well.
+    results: Outputs of the stages already loaded or run in this call.
+    """
+    if results is None:
+        results = {}
+    if name in results:
+        return results[name]
+
+    stage = STAGES[name]
+    fingerprint = get_fingerprint(name, parameters)
+    filename = get_cache_filename(stage, fingerprint, cache_dir)
+
+    if not is_forced(name, force) and os.path.exists(filename):
+        with open(filename, "rb") as f:
+            output = pickle.load(f)
+        logger.info(f"Loaded {stage} output from {filename}.")
+    else:
+        inputs = [
+            run_stage(input_name, parameters, cache_dir, force, results)
+            for input_name in stage.inputs
+        ]
+        start = time.time()
+        logger.info(f"Run {stage}.")
+        kwargs = {param: parameters[param] for param in stage.params}
+        output = stage.func(*inputs, **kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(filename, "wb") as f:
+            pickle.dump(output, f)
+        logger.success(
+            f"Finished {stage} in {time.time() - start}s, stored output in {filename}."
+        )
+
+    results[name] = output
+    return output
+
+
+@logger.catch
+def run_pipeline(target="validate", cache_dir=CACHE_DIR, force=(), **parameters):
+    """Run all stages up to target and return the output of target.
+
+    parameters: Overwrite DEFAULT_PARAMETERS, e.g. max_ar=8. podcasts_info and date
+        default to luther.get_podcasts_info() and the current date.
+    """
+    parameters = {**DEFAULT_PARAMETERS, **parameters}
+    if "date" not in parameters:
+        parameters["date"] = datetime.datetime.utcnow().date()
+    if "podcasts_info" not in parameters:
+        parameters["podcasts_info"] = luther.get_podcasts_info()
+    logger.info(f"Run pipeline up to {target}.")
+    output = run_stage(target, parameters, cache_dir, force)
+    logger.success(f"Finished pipeline up to {target}.")
+    return output
+
+
+if __name__ == "__main__":
+    run_pipeline()
@@ -25,11 +25,12 @@ import numpy as np
 import os
 
 from loguru import logger
+from base import add_log_sink
 
 import os
 
 _log_file_name = __file__.split("/")[-1].split(".")[0]
-logger.add(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
 
 
 TPTM_BASE_URL = "https://talkpython.fm"
@@ -295,6 +296,88 @@ def remove_none_from_list(list_):
     return list_
 
 
+def limit_episode_list(episode_list, podcast_info):
+    """Keep the newest max_episodes entries, if podcast_info sets a limit."""
+    max_episodes = podcast_info.get("max_episodes")
+    if max_episodes is None or len(episode_list) <= max_episodes:
+        return episode_list
+    logger.info(
+        f"Only scrape the newest {max_episodes} of {len(episode_list)} episodes."
+    )
+    episode_list = sorted(
+        episode_list,
+        key=lambda entry: int(entry["show_number"].replace("#", "")),
+        reverse=True,
+    )
+    return episode_list[:max_episodes]
+
+
+def get_cleaned_episode(entry):
+    """Scrape and clean a single entry of the episode list.
+
+    return: The cleaned episode or None if it could not be scraped.
+    """
+    episode, pickled = get_mentioned_links_for_episode(entry)
+    if episode is None:
+        return None
+    if not pickled:
+        episode = clean_episode(episode)
+    episode["reference_list"] = remove_none_from_list(episode["reference_list"])
+    episode["github_references"] = remove_none_from_list(episode["github_references"])
+    return episode
+
+
+@logger.catch
+def get_new_episodes(podcast_info, known_numbers):
+    """Scrape the current episode list and return the cleaned episodes whose show
+    number is not in known_numbers.
+
+    Unlike get_all_episodes the episode list is never loaded from the pickle.
+    """
+    episode_list, _ = get_episode_list(
+        url=podcast_info["url"], load_from_pickle=False, dump_to_pickle=False
+    ) or (None, False)
+    if episode_list is None:
+        logger.warning(f"Could not scrape the episode list of {podcast_info['name']}.")
+        return []
+
+    new_entries = [
+        entry
+        for entry in episode_list
+        if int(entry["show_number"].replace("#", "")) not in known_numbers
+    ]
+    logger.info(f"Found {len(new_entries)} new episodes for {podcast_info['name']}.")
+    return remove_none_from_list([get_cleaned_episode(entry) for entry in new_entries])
+
+
+def iter_all_episodes(podcast_info):
+    """Yield every cleaned episode as soon as it is scraped.
+
+    Same as get_all_episodes, but allows the following steps to start before all
+    episodes are scraped. The full list is pickled once the last episode was yielded.
+    """
+    logger.info(f"Iterate all Episodes for {podcast_info}.")
+
+    data = try_to_load_from_pickle(**podcast_info)
+    if data:
+        yield from remove_none_from_list(data)
+        return
+
+    episode_list, pickled = get_episode_list(**podcast_info)
+    episode_list = limit_episode_list(episode_list, podcast_info)
+    cleaned_episode_list = []
+
+    for entry in episode_list:
+        episode = get_cleaned_episode(entry)
+        if episode is None:
+            continue
+        cleaned_episode_list.append(episode)
+        yield episode
+
+    try_to_save_to_pickle(data=cleaned_episode_list, **podcast_info)
+    logger.success(f"Iterated all Episodes.")
+
+
 @logger.catch
 def get_all_episodes(podcast_info):
     logger.info(f"Get all Episodes for {podcast_info}.")
@@ -305,18 +388,13 @@ def get_all_episodes(podcast_info):
         return data, True
 
     episode_list, pickled = get_episode_list(**podcast_info)
+    episode_list = limit_episode_list(episode_list, podcast_info)
     cleaned_episode_list = []
 
     for entry in episode_list:
-        episode, pickled = get_mentioned_links_for_episode(entry)
+        episode = get_cleaned_episode(entry)
         if episode is None:
             continue
-        if not pickled:
-            episode = clean_episode(episode)
-        episode["reference_list"] = remove_none_from_list(episode["reference_list"])
-        episode["github_references"] = remove_none_from_list(
-            episode["github_references"]
-        )
         cleaned_episode_list.append(episode)
 
     cleaned_episodes = remove_none_from_list(cleaned_episode_list)
@@ -0,0 +1,193 @@
+"""Keep the pipeline state in memory and refresh it repeatedly.
+
+luther.run_all and modeling.validate_all are written for a single run per
+process. LutherService wraps the same steps into a re-entrant refresh, which
+can be called any number of times in a long running process (see daemon.py).
+
+Between refreshes the service keeps the loaded podcasts, the repository
+registry and the fitted models. A refresh reuses the podcasts and repositories,
+only new episodes are added and only repositories whose star count changed are
+requested again (see episode_data.refresh_repositories). Repositories which are
+no longer referenced are dropped from the registry, the clean data and the
+models are replaced once the refresh finished, so nothing accumulates from cycle
+to cycle.
+"""
+
+import gc
+import os
+import time
+
+import pandas as pd
+from loguru import logger
+
+import luther
+import modeling
+from base import add_log_sink
+from episode_data import Podcast, RepositoryRegistry, refresh_repositories
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+
+def get_memory_usage():
+    """Return the resident memory of this process in MB, None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (FileNotFoundError, IndexError, ValueError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+class LutherService:
+    def __init__(
+        self,
+        podcasts_info=None,
+        fetch_workers=luther.REPOSITORY_FETCH_WORKERS,
+        days_premention=366,
+        days_postmention=30,
+        column_names=("star_count_diff", "star_count_rel"),
+        max_ar=5,
+    ):
+        if podcasts_info is None:
+            podcasts_info = luther.get_podcasts_info()
+        self.podcasts_info = podcasts_info
+        self.fetch_workers = fetch_workers
+        self.days_premention = days_premention
+        self.days_postmention = days_postmention
+        self.column_names = list(column_names)
+        self.max_ar = max_ar
+
+        # Warm state, reused or replaced by every refresh.
+        self.podcasts = {}
+        self.repository_registry = {}
+        self.clean_df = None
+        self.ar_models = {}
+        self.validation_results = {}
+        self.cycle = 0
+
+    def __repr__(self):
+        return f"LutherService(podcasts={list(self.podcasts)}, cycle={self.cycle})"
+
+    def load_podcast(self, podcast_info, registry):
+        """Scrape a podcast and fetch its repositories through the registry.
+
+        A podcast loaded by a previous refresh is reused, only the episodes missing
+        in it are scraped from the current episode list and added.
+        """
+        source = podcast_info.get("source", "talkpython")
+        podcast = self.podcasts.get(podcast_info["name"])
+        if podcast is None:
+            podcast = Podcast(**podcast_info)
+            raw_episode_data, _ = luther.EPISODE_SCRAPERS[source](podcast_info)
+        else:
+            known_numbers = {episode.number for episode in podcast.episodes}
+            raw_episode_data = luther.NEW_EPISODE_SCRAPERS[source](
+                podcast_info, known_numbers
+            )
+        if raw_episode_data:
+            podcast.append_raw_episodes(raw_episode_data, resolve=False)
+        podcast.resolve_repositories(max_workers=self.fetch_workers, registry=registry)
+        podcast.pickle()
+        return podcast
+
+    def refresh_repositories(self):
+        """Request the repositories of the loaded podcasts whose star count changed."""
+        references = [
+            reference
+            for podcast in self.podcasts.values()
+            for episode in podcast.episodes
+            for reference in episode.references
+        ]
+        requested = refresh_repositories(
+            references, self.repository_registry, max_workers=self.fetch_workers
+        )
+        if requested:
+            for podcast in self.podcasts.values():
+                for episode in podcast.episodes:
+                    episode.pickle(is_raw=False)
+
+    def prune_registry(self, podcasts):
+        """Drop the repositories which none of the podcasts references."""
+        keys = {
+            reference.get_registry_key()
+            for podcast in podcasts.values()
+            for episode in podcast.episodes
+            for reference in episode.references
+            if reference.repository is not None
+        }
+        for key in list(self.repository_registry):
+            if key not in keys:
+                del self.repository_registry[key]
+
+    def convert(self, podcasts):
+        """Convert and clean all podcasts into a single DataFrame."""
+        clean_dfs = []
+        for podcast in podcasts:
+            df = luther.convert_podcast_to_pd_df(podcast)
+            # The rows are stored with the pickled podcast, no need to keep them.
+            podcast.exportable_data_rows = []
+            clean_dfs.append(
+                luther.clean_df(
+                    df,
+                    days_premention=self.days_premention,
+                    days_postmention=self.days_postmention,
+                )
+            )
+        return luther.compact_dtypes(pd.concat(clean_dfs))
+
+    def fit(self, training, validation):
+        ar_models = {}
+        validation_results = {}
+        prep_training = modeling.prepare_columns_for_modeling(
+            training, self.column_names
+        )
+        prep_validation = modeling.prepare_columns_for_modeling(
+            validation, self.column_names
+        )
+        for column_name in self.column_names:
+            ar_models[column_name] = modeling.ar_model_fitting(
+                prep_training[column_name], column_name, max_ar=self.max_ar
+            )
+            validation_results[column_name] = modeling.ar_model_validation(
+                ar_models[column_name], prep_validation[column_name]
+            )
+        return ar_models, validation_results
+
+    @logger.catch
+    def refresh(self):
+        """Run the whole pipeline once and update the warm state."""
+        start = time.time()
+        logger.info(f"Start refresh cycle {self.cycle + 1} of {self}.")
+
+        self.refresh_repositories()
+        registry = RepositoryRegistry(self.repository_registry)
+        podcasts = {}
+        for podcast_info in self.podcasts_info:
+            podcast = self.load_podcast(podcast_info, registry)
+            podcasts[podcast.name] = podcast
+        self.podcasts = podcasts
+        self.prune_registry(podcasts)
+
+        clean_df = self.convert(podcasts.values())
+        # Every cycle would add new artifacts, the service keeps the frames in memory.
+        training, validation = luther.partition_timeseries_podcast_data(
+            clean_df, store=False
+        )
+        ar_models, validation_results = self.fit(training, validation)
+
+        self.clean_df = clean_df
+        self.ar_models = ar_models
+        self.validation_results = validation_results
+        self.cycle += 1
+
+        del training, validation
+        gc.collect()
+        logger.success(
+            f"Finished refresh cycle {self.cycle} in {time.time() - start}s, memory usage: {get_memory_usage()}MB."
+        )
+        return self
+
+    def get_repository(self, rep_owner, rep_name):
+        return self.repository_registry.get((rep_owner.lower(), rep_name.lower()))
@@ -0,0 +1,142 @@
+"""Estimate the star history of very large repositories from a sample of pages.
+
+Fetching all stargazers takes one request per 100 stars, and GitHub does not serve
+more than MAX_STARGAZER_PAGE pages at all. For repositories with more than
+SAMPLING_THRESHOLD stars (disabled by default) only SAMPLE_PAGE_COUNT pages, spread
+evenly over all pages, are fetched through the REST API.
+
+The stargazers are ordered by the date they starred the repository. A star between
+two fetched pages was therefore starred between the last date of the first page
+and the first date of the second one. These are the bounds of every unknown star,
+its date is estimated by linear interpolation between them.
+
+The pages around every mention date (+/- EXACT_WINDOW_DAYS) are always fetched
+completely, so the star counts right before and after a mention are exact.
+"""
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from base import add_log_sink
+from get_github_data import MAX_STARGAZER_PAGE, STARGAZERS_PER_PAGE
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+
+# Sample the stargazers of repositories with more stars, 0 disables sampling.
+SAMPLING_THRESHOLD = int(os.getenv("LUTHER_STAR_SAMPLING_THRESHOLD", default=0))
+SAMPLE_PAGE_COUNT = int(os.getenv("LUTHER_STAR_SAMPLE_PAGES", default=20))
+EXACT_WINDOW_DAYS = 31
+# Upper limit of pages fetched completely around a single mention date.
+MAX_EXACT_PAGES = 100
+
+
+def use_sampling(stargazer_count, threshold=None):
+    if threshold is None:
+        threshold = SAMPLING_THRESHOLD
+    return 0 < threshold < stargazer_count
+
+
+class StarSample:
+    def __init__(self, total_count, date_created, date_requested):
+        """Hold the fetched stargazer pages of a repository.
+
+        total_count: Number of stars of the repository.
+        date_created, date_requested: Bounds of stars before the first and after the
+            last fetched page.
+        """
+        self.total_count = total_count
+        self.first_ordinal = date_created.toordinal()
+        self.last_ordinal = date_requested.toordinal()
+        # {page: sorted star ordinals}, pages start at 1.
+        self.pages = {}
+
+    def __repr__(self):
+        return f"StarSample(total_count={self.total_count}, fetched_pages={len(self.pages)}, page_count={self.page_count})"
+
+    @property
+    def page_count(self):
+        return math.ceil(self.total_count / STARGAZERS_PER_PAGE)
+
+    @property
+    def fetchable_page_count(self):
+        return min(self.page_count, MAX_STARGAZER_PAGE)
+
+    def get_sample_pages(self, sample_count=SAMPLE_PAGE_COUNT):
+        """Return sample_count pages spread evenly, including the first and last."""
+        if MAX_STARGAZER_PAGE < self.page_count:
+            logger.warning(
+                f"Only {MAX_STARGAZER_PAGE} of {self.page_count} pages of {self} can be fetched, the last stars are interpolated up to the request date."
+            )
+        pages = np.linspace(1, self.fetchable_page_count, num=sample_count)
+        return sorted(set(pages.round().astype(int).tolist()) - set(self.pages))
+
+    def add_page(self, page, star_ordinals):
+        self.pages[page] = np.sort(np.asarray(star_ordinals, dtype=np.int32))
+
+    def get_known_ordinals(self):
+        """Return the ordinals of all stars with the fetched ones set, NaN otherwise."""
+        ordinals = np.full(self.total_count, np.nan)
+        for page, page_ordinals in self.pages.items():
+            start = (page - 1) * STARGAZERS_PER_PAGE
+            page_ordinals = page_ordinals[: max(0, self.total_count - start)]
+            ordinals[start : start + len(page_ordinals)] = page_ordinals
+        return ordinals
+
+    def get_bounds(self):
+        """Return the earliest and latest possible ordinal of every star."""
+        known = pd.Series(self.get_known_ordinals())
+        lower = known.ffill().fillna(self.first_ordinal).to_numpy()
+        upper = known.bfill().fillna(self.last_ordinal).to_numpy()
+        return lower.astype(np.int32), upper.astype(np.int32)
+
+    @property
+    def star_ordinals(self):
+        """Sorted ordinals of all stars, interpolated between the fetched pages.
+
+        Can be used like luther.get_star_ordinals.
+        """
+        known = self.get_known_ordinals()
+        is_known = ~np.isnan(known)
+        indices = np.flatnonzero(is_known)
+        anchor_indices = [-1, *indices.tolist(), self.total_count]
+        anchor_ordinals = [self.first_ordinal, *known[is_known], self.last_ordinal]
+        estimated = np.interp(
+            np.arange(self.total_count), anchor_indices, anchor_ordinals
+        )
+        return np.floor(estimated).astype(np.int32)
+
+    def get_window_pages(self, first_date, last_date):
+        """Return the pages not fetched yet, which may hold stars in the window."""
+        lower, upper = self.get_bounds()
+        page_idx = np.arange(self.total_count) // STARGAZERS_PER_PAGE + 1
+        in_window = (lower <= last_date.toordinal()) & (
+            first_date.toordinal() <= upper
+        )
+        pages = set(np.unique(page_idx[in_window]).tolist())
+        pages = {page for page in pages if page <= self.fetchable_page_count}
+        return sorted(pages - set(self.pages))
+
+    def get_error_bounds(self):
+        """Describe how far the estimated star history may be off.
+
+        return: dict with
+            interpolated_share: Share of stars whose date is estimated.
+            max_star_count_error: Largest difference between the highest and lowest
+                possible accumulated star count of any day.
+            max_day_error: Largest number of days a single star may be off.
+        """
+        lower, upper = self.get_bounds()
+        # lower and upper are sorted, so the counts of every day are searchsorted.
+        max_count = np.searchsorted(lower, lower, side="right")
+        min_count = np.searchsorted(upper, lower, side="right")
+        known_count = int((~np.isnan(self.get_known_ordinals())).sum())
+        return {
+            "interpolated_share": 1 - known_count / max(self.total_count, 1),
+            "max_star_count_error": int((max_count - min_count).max(initial=0)),
+            "max_day_error": int((upper - lower).max(initial=0)),
+        }
@@ -0,0 +1,187 @@
+"""Mergeable per-group statistics of several columns, computed chunk by chunk.
+
+modeling.prepare_df_for_modeling grouped the whole DataFrame once per column. Here
+the count, sum, mean, M2 (sum of squared deviations from the mean), min and max of
+all columns are updated per chunk, so the data can be read in chunks (see
+artifacts.iter_dataframe_chunks) and never has to be in memory at once.
+
+A chunk is reduced to the statistics of its groups with bincount, and two sets of
+statistics are merged with the parallel variant of Welford's algorithm (Chan et
+al.):
+
+    delta = mean_b - mean_a
+    mean = mean_a + delta * n_b / n
+    M2 = M2_a + M2_b + delta ** 2 * n_a * n_b / n
+
+Statistics of partitions computed separately (e.g. in other processes) can be
+merged the same way with GroupStatistics.merge.
+
+NaN values and rows with a missing group key (NaN/NaT) are skipped like in pandas,
+std has one degree of freedom.
+"""
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from base import add_log_sink
+
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+
+STATISTICS = ["count", "sum", "mean", "m2", "min", "max"]
+AGGREGATES = ["mean", "std", "count", "min", "max", "sum"]
+
+
+def empty_statistics(group_count):
+    return {
+        "count": np.zeros(group_count, dtype=np.int64),
+        "sum": np.zeros(group_count),
+        "mean": np.zeros(group_count),
+        "m2": np.zeros(group_count),
+        "min": np.full(group_count, np.inf),
+        "max": np.full(group_count, -np.inf),
+    }
+
+
+def get_chunk_statistics(codes, values, group_count):
+    """Statistics of values per group code, values may contain NaN.
+
+    Rows with the code -1 (missing group key) are skipped.
+    """
+    valid = ~np.isnan(values) & (0 <= codes)
+    codes, values = codes[valid], values[valid]
+    count = np.bincount(codes, minlength=group_count)
+    total = np.bincount(codes, weights=values, minlength=group_count)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(0 < count, total / count, 0)
+    m2 = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=group_count)
+    minimum = np.full(group_count, np.inf)
+    maximum = np.full(group_count, -np.inf)
+    np.minimum.at(minimum, codes, values)
+    np.maximum.at(maximum, codes, values)
+    return {
+        "count": count,
+        "sum": total,
+        "mean": mean,
+        "m2": m2,
+        "min": minimum,
+        "max": maximum,
+    }
+
+
+def merge_statistics(a, b):
+    """Merge the statistics b into a, both for the same groups."""
+    count = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        b_share = np.where(0 < count, b["count"] / count, 0)
+    a["mean"] = a["mean"] + delta * b_share
+    a["m2"] = a["m2"] + b["m2"] + delta ** 2 * a["count"] * b_share
+    a["count"] = count
+    a["sum"] = a["sum"] + b["sum"]
+    a["min"] = np.minimum(a["min"], b["min"])
+    a["max"] = np.maximum(a["max"], b["max"])
+    return a
+
+
+class GroupStatistics:
+    def __init__(self, group_column, column_names):
+        """Statistics of column_names per value of group_column."""
+        self.group_column = group_column
+        self.column_names = list(column_names)
+        self.group_keys = []
+        self.group_codes = {}
+        self.statistics = {
+            column_name: empty_statistics(0) for column_name in self.column_names
+        }
+        self.row_count = 0
+
+    def __repr__(self):
+        return f"GroupStatistics(group_column={self.group_column}, column_names={self.column_names}, group_count={len(self.group_keys)}, row_count={self.row_count})"
+
+    def get_codes(self, keys):
+        """Return the group code of every key, new keys get new groups.
+
+        Missing keys (NaN/NaT) get the code -1, like in pd.factorize.
+        """
+        chunk_codes, chunk_keys = pd.factorize(keys)
+        global_codes = np.empty(len(chunk_keys), dtype=np.int64)
+        for idx, key in enumerate(chunk_keys):
+            if key not in self.group_codes:
+                self.group_codes[key] = len(self.group_keys)
+                self.group_keys.append(key)
+            global_codes[idx] = self.group_codes[key]
+        codes = np.full(len(chunk_codes), -1, dtype=np.int64)
+        has_key = chunk_codes != -1
+        codes[has_key] = global_codes[chunk_codes[has_key]]
+        return codes
+
+    def grow(self):
+        """Add empty statistics for the groups added since the last update."""
+        group_count = len(self.group_keys)
+        for column_name, statistics in self.statistics.items():
+            missing = group_count - len(statistics["count"])
+            if missing:
+                empty = empty_statistics(missing)
+                for name in STATISTICS:
+                    statistics[name] = np.concatenate([statistics[name], empty[name]])
+
+    def update(self, chunk):
+        """Add the rows of a DataFrame with the group column and column_names."""
+        codes = self.get_codes(chunk[self.group_column])
+        self.grow()
+        group_count = len(self.group_keys)
+        for column_name in self.column_names:
+            values = chunk[column_name].to_numpy(dtype=np.float64, na_value=np.nan)
+            merge_statistics(
+                self.statistics[column_name],
+                get_chunk_statistics(codes, values, group_count),
+            )
+        self.row_count += len(chunk)
+        return self
+
+    def merge(self, other):
+        """Merge the statistics of another partition into this one."""
+        codes = self.get_codes(pd.Series(other.group_keys, dtype=object))
+        self.grow()
+        group_count = len(self.group_keys)
+        for column_name in self.column_names:
+            other_statistics = empty_statistics(group_count)
+            for name in STATISTICS:
+                other_statistics[name][codes] = other.statistics[column_name][name]
+            merge_statistics(self.statistics[column_name], other_statistics)
+        self.row_count += other.row_count
+        return self
+
+    def to_frame(self, column_name):
+        """Return the aggregates of column_name like groupby(...).agg(AGGREGATES)."""
+        statistics = self.statistics[column_name]
+        count = statistics["count"]
+        has_values = 0 < count
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.where(1 < count, np.sqrt(statistics["m2"] / (count - 1)), np.nan)
+        frame = pd.DataFrame(
+            {
+                "mean": np.where(has_values, statistics["mean"], np.nan),
+                "std": std,
+                "count": count,
+                "min": np.where(has_values, statistics["min"], np.nan),
+                "max": np.where(has_values, statistics["max"], np.nan),
+                "sum": statistics["sum"],
+            },
+            index=pd.Index(self.group_keys, name=self.group_column),
+        )
+        return frame[AGGREGATES].sort_index()
+
+
+def aggregate_chunks(chunks, column_names, group_column="fake_date"):
+    """Aggregate an iterable of DataFrames in one pass.
+
+    return: GroupStatistics
+    """
+    group_statistics = GroupStatistics(group_column, column_names)
+    for chunk in chunks:
+        group_statistics.update(chunk)
+    logger.info(f"Aggregated {group_statistics}.")
+    return group_statistics
@@ -0,0 +1,190 @@
+"""Watch the podcasts for new episodes and keep the dataset up to date.
+
+Instead of running luther.run_all again, every poll only
+
+    - scrapes the episodes which are not part of the podcast yet,
+    - fetches the repositories referenced in these new episodes,
+    - fetches the current stargazers of repositories whose mention window is still
+      open, i.e. which were mentioned within the last days_postmention days, and
+      whose star count changed since the last poll,
+    - appends the rows of these repository mentions to the dataset (see dataset.py).
+
+Repositories mentioned before the window are not requested again, clean_df drops
+their rows after days_postmention anyway.
+
+Run with:
+    python luther/watch.py
+"""
+
+import datetime
+import os
+import signal
+import threading
+import time
+
+from dotenv import load_dotenv
+from loguru import logger
+
+import dataset
+import episode_data
+import luther
+import scrape_tptm as stptm
+from base import add_log_sink
+from episode_data import Podcast
+
+load_dotenv()
+_log_file_name = __file__.split("/")[-1].split(".")[0]
+add_log_sink(f"logs/{_log_file_name}.log", rotation="1 day")
+add_log_sink(f"logs/success.log", rotation="1 day", level="SUCCESS")
+
+WATCH_INTERVAL = int(os.getenv("LUTHER_WATCH_INTERVAL", default=60 * 60))
+DAYS_POSTMENTION = 30
+
+
+def load_podcast(podcast_info):
+    """Unpickle the podcast stored by a previous run, create it if there is none."""
+    try:
+        podcast = Podcast.unpickle(podcast_info["filename"] + "_instance.pk")
+        logger.info(f"Loaded {podcast} from pickle.")
+        return podcast
+    except FileNotFoundError:
+        logger.info(f"No pickled Podcast for {podcast_info['name']}, create it.")
+        return luther.get_podcast_data(podcast_info)
+
+
+def get_new_raw_episodes(podcast_info, podcast):
+    """Scrape the episode list and return the cleaned episodes missing in podcast.
+
+    The scraper is chosen by the source of podcast_info, see
+    luther.NEW_EPISODE_SCRAPERS.
+    """
+    known_numbers = {episode.number for episode in podcast.episodes}
+    get_new_episodes = luther.NEW_EPISODE_SCRAPERS[
+        podcast_info.get("source", "talkpython")
+    ]
+    return get_new_episodes(podcast_info, known_numbers) or []
+
+
+def store_raw_episodes(podcast_info, raw_episodes):
+    """Add the new episodes to the pickled episode list used by get_all_episodes."""
+    stored_episodes = stptm.try_to_load_from_pickle(**podcast_info) or []
+    stptm.try_to_save_to_pickle(data=stored_episodes + raw_episodes, **podcast_info)
+
+
+def get_open_mentions(podcast, days_postmention=DAYS_POSTMENTION, today=None):
+    """Return (episode, reference) of all GitHub references with an open window."""
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+    first_date = today - datetime.timedelta(days=days_postmention)
+    return [
+        (episode, reference)
+        for episode in podcast.episodes
+        if episode.date_published is not None and first_date <= episode.date_published
+        for reference in episode.references
+        if reference._is_github_ref
+    ]
+
+
+def refresh_repositories(mentions, max_workers, registry):
+    """Attach the current repository to every mention.
+
+    registry: {(rep_owner, rep_name): Repository} of repositories fetched in this
+        poll already. These are attached without requesting them again. All other
+        repositories are only requested again if their star count changed, see
+        episode_data.refresh_repositories.
+    """
+    references = []
+    for _, reference in mentions:
+        repository = registry.get(reference.get_registry_key())
+        if repository is None:
+            references.append(reference)
+        elif repository is not reference.repository:
+            reference.attach_repository(repository)
+            reference.pickle(is_raw=False)
+    logger.info(f"Refresh {len(references)} references with an open window.")
+    episode_data.refresh_repositories(references, registry, max_workers=max_workers)
+
+    for episode in {episode for episode, _ in mentions}:
+        episode.pickle(is_raw=False)
+
+
+@logger.catch
+def poll_podcast(
+    podcast,
+    podcast_info,
+    dataset_path=dataset.DATASET_PATH,
+    days_postmention=DAYS_POSTMENTION,
+    max_workers=luther.REPOSITORY_FETCH_WORKERS,
+    today=None,
+):
+    """Add new episodes to podcast and append the open mentions to the dataset.
+
+    return: Number of rows written to the dataset.
+    """
+    start = time.time()
+    if today is None:
+        today = datetime.datetime.utcnow().date()
+
+    registry = {}
+    raw_episodes = get_new_raw_episodes(podcast_info, podcast)
+    new_numbers = {raw_episode["show_number"] for raw_episode in raw_episodes}
+    if raw_episodes:
+        podcast.append_raw_episodes(raw_episodes, resolve=False)
+        podcast.resolve_repositories(max_workers=max_workers, registry=registry)
+        store_raw_episodes(podcast_info, raw_episodes)
+
+    mentions = get_open_mentions(podcast, days_postmention, today)
+    refresh_repositories(mentions, max_workers, registry)
+    # New episodes published before the window are added completely once.
+    open_references = {id(reference) for _, reference in mentions}
+    mentions += [
+        (episode, reference)
+        for episode, reference in dataset.get_repository_mentions(podcast)
+        if episode.number in new_numbers and id(reference) not in open_references
+    ]
+    podcast.pickle()
+
+    row_count = dataset.update_podcast_dataset(
+        podcast, dataset_path, today=today, mentions=mentions
+    )
+    logger.success(
+        f"Polled {podcast.name}: {len(raw_episodes)} new episodes, {len(mentions)} mentions, {row_count} rows in {time.time() - start}s."
+    )
+    return row_count
+
+
+def watch(
+    podcasts_info=None,
+    interval=WATCH_INTERVAL,
+    dataset_path=dataset.DATASET_PATH,
+    days_postmention=DAYS_POSTMENTION,
+    max_polls=None,
+):
+    """Poll all podcasts every interval seconds until SIGINT or SIGTERM.
+
+    max_polls: Stop after this many polls, run until stopped if None.
+    """
+    if podcasts_info is None:
+        podcasts_info = luther.get_podcasts_info()
+    podcasts = [load_podcast(podcast_info) for podcast_info in podcasts_info]
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    logger.info(f"Watch {len(podcasts)} podcasts, poll every {interval}s.")
+    poll_count = 0
+    while not stop.is_set():
+        for podcast, podcast_info in zip(podcasts, podcasts_info):
+            poll_podcast(podcast, podcast_info, dataset_path, days_postmention)
+        poll_count += 1
+        if max_polls is not None and max_polls <= poll_count:
+            break
+        stop.wait(interval)
+
+    logger.success(f"Stopped watching after {poll_count} polls.")
+    return podcasts
+
+
+if __name__ == "__main__":
+    watch()